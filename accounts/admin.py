@@ -32,7 +32,7 @@ class UserAdmin(BaseUserAdmin):
     add_form = UserCreationForm
 
     # These define the fields in the list view
-    list_display = ('id', 'email', 'first_name', 'last_name', 'is_staff')
+    list_display = ('id', 'email', 'first_name', 'last_name', 'is_staff', 'current_booking')
     list_filter = ('is_staff',)
     # These are the fields on the 'edit' page
     fieldsets = (
@@ -51,6 +51,14 @@ class UserAdmin(BaseUserAdmin):
     ordering = ('email',)
     filter_horizontal = ()
 
+    def get_queryset(self, request):
+        # Find every listed user's current booking in the same query
+        return super(UserAdmin, self).get_queryset(request).with_current_booking()
+
+    def current_booking(self, obj):
+        return obj.current_booking_id
+    current_booking.admin_order_field = 'current_booking_id'
+
     # Method overrides to increase security
     def get_inline_instances(self, request, obj=None):
         # Prevents inline fields (address credit card) when creating new user or if user is staff
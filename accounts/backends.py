@@ -0,0 +1,21 @@
+#
+#   Author(s): Huon Imberger
+#   Description: Authentication backends
+#
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+
+
+class CurrentBookingModelBackend(ModelBackend):
+    """
+    Model backend that loads the logged in user with their current booking id (see
+    UserQuerySet.with_current_booking()), so pages showing the current booking link don't need another query for
+    users without one
+    """
+    def get_user(self, user_id):
+        try:
+            user = get_user_model()._default_manager.with_current_booking().get(pk=user_id)
+        except get_user_model().DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
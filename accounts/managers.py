@@ -4,9 +4,29 @@
 #
 
 from django.contrib.auth.base_user import BaseUserManager
+from django.db import models
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
 
 
-class UserManager(BaseUserManager):
+class UserQuerySet(models.QuerySet):
+    """
+    User queryset with booking lookups for many users at once
+    """
+    def with_current_booking(self, now=None):
+        """
+        Annotates each user with current_booking_id (None if they don't have a current booking), in the same query.
+        User.get_current_booking() uses the annotation when it is present.
+        """
+        if now is None:
+            now = timezone.now()
+        bookings = self.model._meta.get_field('booking').related_model.objects
+        return self.annotate(current_booking_id=Subquery(
+            bookings.current(now).filter(user=OuterRef('pk')).values('id')[:1]
+        ))
+
+
+class UserManager(BaseUserManager.from_queryset(UserQuerySet)):
     """
     User manager that provides methods for creating users and superusers, setting password's properly
     """
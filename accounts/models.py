@@ -7,6 +7,7 @@ from django.db import models
 from django.contrib.auth.base_user import AbstractBaseUser
 from django.contrib.auth.models import PermissionsMixin
 from django.conf import settings
+from django.utils import timezone
 
 from .managers import UserManager
 from emails.utils import send_templated_email
@@ -84,16 +85,20 @@ class User(AbstractBaseUser, PermissionsMixin):
 
     def get_current_booking(self):
         """
-        Gets this user's current booking
+        Gets this user's current booking. The result is remembered, so templates can call this repeatedly during a
+        request without repeating the query.
         """
-        current_bookings = self.booking_set.all()
-        active_bookings = [b for b in current_bookings if b.is_active()]
-        # Should only ever be one active booking (enforced via validation when creating a booking),
-        # but it's technically possible so we always return the first one.
-        if active_bookings:
-            return active_bookings[0]
-        else:
-            return None
+        if not hasattr(self, '_current_booking'):
+            # Use annotation from UserQuerySet.with_current_booking() if present
+            if hasattr(self, 'current_booking_id') and self.current_booking_id is None:
+                self._current_booking = None
+            else:
+                # Should only ever be one active booking (enforced via validation when creating a booking),
+                # but it's technically possible so we always return the first one.
+                now = timezone.now()
+                self._current_booking = self.booking_set.current(now).with_status(now).select_related(
+                    'vehicle').first()
+        return self._current_booking
 
 
 class Address(models.Model):
@@ -1,7 +1,12 @@
 from django.core import mail
 from django.test import TestCase
+from django.utils import timezone
 
+import datetime as dt
+
+from ..backends import CurrentBookingModelBackend
 from ..models import *
+from carshare.models import Booking, Pod, Vehicle, VehicleType
 
 
 class AccountsUserModelTests(TestCase):
@@ -14,6 +19,57 @@ class AccountsUserModelTests(TestCase):
         self.assertEqual(self.user.get_short_name(), 'John')
 
 
+class AccountsCurrentBookingTests(TestCase):
+    def setUp(self):
+        vt = VehicleType.objects.create(description='Premium', hourly_rate=12.50, daily_rate=80.00)
+        p1 = Pod.objects.create(latitude='-39.34523453', longitude='139.53524344', description='Pod 1')
+        self.v1 = Vehicle.objects.create(pod=p1, type=vt, name='Vehicle1', make='Toyota', model='Yaris', year=2012,
+                                         registration='AAA222')
+        self.u1 = User.objects.create(email='test1@test.com', first_name='John', last_name='Doe',
+                                      date_of_birth='1980-01-01')
+        self.u2 = User.objects.create(email='test2@test.com', first_name='Jane', last_name='Doe',
+                                      date_of_birth='1980-01-01')
+        now = timezone.now()
+        self.create_booking(self.u1, now - dt.timedelta(days=2), now - dt.timedelta(days=1))
+        self.create_booking(self.u1, now - dt.timedelta(hours=1), now + dt.timedelta(hours=1), cancelled=now)
+        self.current = self.create_booking(self.u1, now - dt.timedelta(hours=1), now + dt.timedelta(hours=1))
+        self.create_booking(self.u1, now + dt.timedelta(days=1), now + dt.timedelta(days=2))
+        self.create_booking(self.u2, now + dt.timedelta(days=1), now + dt.timedelta(days=2))
+
+    def create_booking(self, user, start, end, cancelled=None):
+        return Booking.objects.create(user=user, vehicle=self.v1, schedule_start=start, schedule_end=end,
+                                      cancelled=cancelled)
+
+    def test_current_booking(self):
+        """
+        Only a non-cancelled booking in progress is current, and it is only looked up once
+        """
+        user = User.objects.get(pk=self.u1.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(user.get_current_booking(), self.current)
+            self.assertEqual(user.get_current_booking(), self.current)
+        self.assertIsNone(self.u2.get_current_booking())
+
+    def test_current_bookings_for_many_users(self):
+        """
+        Users' current bookings are found in the same query as the users
+        """
+        with self.assertNumQueries(1):
+            users = {u.email: u for u in User.objects.with_current_booking()}
+            self.assertIsNone(users['test2@test.com'].get_current_booking())
+        self.assertEqual(users['test1@test.com'].current_booking_id, self.current.id)
+
+    def test_logged_in_user(self):
+        """
+        The logged in user is loaded with their current booking id
+        """
+        with self.assertNumQueries(1):
+            user = CurrentBookingModelBackend().get_user(self.u2.pk)
+            self.assertIsNone(user.get_current_booking())
+        self.assertEqual(CurrentBookingModelBackend().get_user(self.u1.pk).current_booking_id, self.current.id)
+        self.assertIsNone(CurrentBookingModelBackend().get_user(0))
+
+
 class AccountsAddressModelTests(TestCase):
     address = Address(address_line_1='Address Line 1', address_line_2='Address Line 2', city='City', state='VIC',
                       postcode='3000')
@@ -1,7 +1,9 @@
 from django.test import TestCase, override_settings
 from django.shortcuts import reverse
 from django.core import mail
+from django.core.management import call_command
 
+from io import StringIO
 import datetime as dt
 
 from ..models import User
@@ -74,8 +76,10 @@ class AccountsRegisterViewTests(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertFalse('user_id' in self.client.session)
         self.assertFalse('address_id' in self.client.session)
-        # Email
+        # Email (queued, and sent by the outbox worker)
         user = User.objects.get(id=user_id)
+        self.assertEqual(len(mail.outbox), 0)
+        call_command('send_emails', once=True, stdout=StringIO())
         self.assertEqual(len(mail.outbox), 1)
         self.assertEqual(mail.outbox[0].subject, 'Thank you for joining Vroom!')
         self.assertTrue('Hi {0}!'.format(user.first_name) in mail.outbox[0].body)
@@ -9,6 +9,7 @@ from django.http import HttpResponse
 from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.tokens import default_token_generator
+from django.db import transaction
 from django.urls import reverse
 from django.utils.encoding import force_bytes, force_text
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
@@ -147,7 +148,6 @@ def register_credit_card(request):
             # Save CC info
             credit_card = credit_card_form.save(commit=False)
             credit_card.user = user_obj
-            credit_card.save()
 
             # Create activation URL
             kwargs = {
@@ -158,14 +158,16 @@ def register_credit_card(request):
             activate_url = "{0}://{1}{2}".format(request.scheme, request.get_host(), activation_url)
             url_how_it_works = reverse('carshare:how_it_works')
             url_how_it_works = "{0}://{1}{2}".format(request.scheme, request.get_host(), url_how_it_works)
-            user_obj.send_email(
-                template_name='Registration',
-                context={
-                    'user': user_obj,
-                    'activate_url': activate_url,
-                    'url_how_it_works': url_how_it_works,
-                },
-            )
+            with transaction.atomic():
+                credit_card.save()
+                user_obj.send_email(
+                    template_name='Registration',
+                    context={
+                        'user': user_obj,
+                        'activate_url': activate_url,
+                        'url_how_it_works': url_how_it_works,
+                    },
+                )
 
             # Clear registration-related session vars
             del request.session['user_id']
@@ -302,23 +304,24 @@ def update_email(request):
         email_form = EmailChangeForm(request.POST, instance=user)
 
         if email_form.is_valid():
-            email_form.save()
-
-            # Send verification email
-            kwargs = {
-                "uidb64": urlsafe_base64_encode(force_bytes(user.pk)).decode(),
-                "token": default_token_generator.make_token(user)
-            }
-            verification_url = reverse("update_email_verify", kwargs=kwargs)
-            verify_url = "{0}://{1}{2}".format(request.scheme, request.get_host(), verification_url)
-            send_templated_email(
-                template_name='Verify Email',
-                recipient_list=[user.requested_email],
-                context={
-                    'user': user,
-                    'verify_url': verify_url
-                },
-            )
+            with transaction.atomic():
+                email_form.save()
+
+                # Send verification email
+                kwargs = {
+                    "uidb64": urlsafe_base64_encode(force_bytes(user.pk)).decode(),
+                    "token": default_token_generator.make_token(user)
+                }
+                verification_url = reverse("update_email_verify", kwargs=kwargs)
+                verify_url = "{0}://{1}{2}".format(request.scheme, request.get_host(), verification_url)
+                send_templated_email(
+                    template_name='Verify Email',
+                    recipient_list=[user.requested_email],
+                    context={
+                        'user': user,
+                        'verify_url': verify_url
+                    },
+                )
             return render(request, 'accounts/verify_email_request.html')
     else:
         email_form = EmailChangeForm()
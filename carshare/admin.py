@@ -4,8 +4,9 @@
 #
 
 from django.contrib import admin
+from django.utils import timezone
 
-from .models import Vehicle, Pod, VehicleType, Booking, Invoice
+from .models import Vehicle, Pod, VehicleType, Booking, BookingReminder, Invoice, InvoiceJob
 
 
 # Methods for bulk action - making vehicles inactive or active
@@ -23,6 +24,17 @@ def make_inactive(modeladmin, request, queryset):
 make_inactive.short_description = "Mark selected vehicles as inactive"
 
 
+# Bulk action for running failed invoice jobs again. Finished jobs would email the invoice again, and running jobs
+# are still held by a worker (they are run again anyway if they time out).
+def retry_jobs(modeladmin, request, queryset):
+    queryset.exclude(status__in=[InvoiceJob.DONE, InvoiceJob.RUNNING]).update(
+        status=InvoiceJob.PENDING, attempts=0, run_after=timezone.now()
+    )
+
+
+retry_jobs.short_description = "Retry selected jobs"
+
+
 # Define what data is displayed on admin pages
 class VehicleAdmin(admin.ModelAdmin):
     list_display = ['id', 'name', 'make', 'model', 'pod', 'active']
@@ -50,9 +62,24 @@ class InvoiceAdmin(admin.ModelAdmin):
     ordering = ['id']
 
 
+class InvoiceJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'invoice', 'status', 'attempts', 'run_after']
+    list_filter = ['status']
+    ordering = ['-id']
+    actions = [retry_jobs]
+
+
+class BookingReminderAdmin(admin.ModelAdmin):
+    list_display = ['id', 'booking', 'kind', 'time', 'sent']
+    list_filter = ['kind']
+    ordering = ['-id']
+
+
 # Register custom definitions with django-admin
 admin.site.register(VehicleType, VehicleTypeAdmin)
 admin.site.register(Vehicle, VehicleAdmin)
 admin.site.register(Pod, PodAdmin)
 admin.site.register(Booking, BookingAdmin)
+admin.site.register(BookingReminder, BookingReminderAdmin)
 admin.site.register(Invoice, InvoiceAdmin)
+admin.site.register(InvoiceJob, InvoiceJobAdmin)
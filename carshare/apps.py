@@ -5,3 +5,7 @@ from django.apps import AppConfig
 
 class CarshareConfig(AppConfig):
     name = 'carshare'
+
+    def ready(self):
+        # Connect signal handlers
+        from . import signals
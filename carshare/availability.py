@@ -0,0 +1,179 @@
+#
+#   Author(s): Huon Imberger
+#   Description: Vehicle availability lookups that avoid scanning a vehicle's whole booking history
+#
+
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+
+from collections import OrderedDict
+from functools import lru_cache
+import datetime as dt
+
+from pytz.exceptions import AmbiguousTimeError, NonExistentTimeError
+
+
+def find_free_slots(bookings, start, end, length, count):
+    """
+    Finds the earliest gaps between bookings within [start, end) that are at least the given length.
+    :param bookings: (schedule_start, schedule_end) tuples, ordered by schedule_start
+    :param length: timedelta
+    :return: list of up to count (start, end) tuples
+    """
+    slots = []
+    cursor = start
+    for booking_start, booking_end in bookings:
+        if booking_start - cursor >= length:
+            slots.append((cursor, booking_start))
+            if len(slots) == count:
+                return slots
+        cursor = max(cursor, booking_end)
+    if end - cursor >= length:
+        slots.append((cursor, end))
+    return slots
+
+
+def local_day_bounds(date):
+    """
+    Returns the aware start and end of a local calendar day. Days are 23 or 25 hours long across DST changes.
+    """
+    tz = timezone.get_current_timezone()
+    day_start = timezone.make_aware(dt.datetime.combine(date, dt.time.min), tz)
+    day_end = timezone.make_aware(dt.datetime.combine(date + dt.timedelta(days=1), dt.time.min), tz)
+    return day_start, day_end
+
+
+def local_hour(date, hour):
+    """
+    Returns the aware datetime of a wall clock hour on a local day, or None if that hour is skipped by DST.
+    When the hour occurs twice (end of DST), the first occurrence is used.
+    """
+    tz = timezone.get_current_timezone()
+    naive = dt.datetime.combine(date, dt.time(hour=hour))
+    try:
+        return timezone.make_aware(naive, tz)
+    except NonExistentTimeError:
+        return None
+    except AmbiguousTimeError:
+        return timezone.make_aware(naive, tz, is_dst=True)
+
+
+def local_dates(start, end):
+    """
+    Returns the local calendar days touched by the window [start, end)
+    """
+    date = timezone.localtime(start).date()
+    last = timezone.localtime(end - dt.timedelta(microseconds=1)).date()
+    dates = []
+    while date <= last:
+        dates.append(date)
+        date += dt.timedelta(days=1)
+    return dates
+
+
+@lru_cache(maxsize=1024)
+def _day_hours(date, tz):
+    starts = [(hour, local_hour(date, hour)) for hour in range(0, 24)]
+    starts = [(hour, start) for hour, start in starts if start is not None]
+    _, day_end = local_day_bounds(date)
+    ends = [start for _, start in starts[1:]] + [day_end]
+    return tuple((hour, start, end) for (hour, start), end in zip(starts, ends))
+
+
+def day_hours(date):
+    """
+    Returns (hour, start, end) for each wall clock hour that exists on a local day. Each hour runs until the next one
+    starts, so the repeated hour when daylight saving ends covers both occurrences.
+    """
+    return _day_hours(date, timezone.get_current_timezone())
+
+
+def hours_mask(date, start, end):
+    """
+    Returns a bitmap of the hours on a local day that overlap the window [start, end), with bit n for hour n
+    """
+    mask = 0
+    for hour, hour_start, hour_end in day_hours(date):
+        if hour_start < end and hour_end > start:
+            mask |= 1 << hour
+    return mask
+
+
+# Cache alias holding the availability bitmaps (see CACHES in settings)
+AVAILABILITY_CACHE = 'availability'
+
+
+def bitmap_key(vehicle_id, date):
+    return 'vehicle:{0}:{1}'.format(vehicle_id, date.isoformat())
+
+
+def get_bitmaps(vehicle_ids, dates):
+    """
+    Returns {(vehicle_id, date): bitmap} of the hours booked (fully or partly) by non-cancelled bookings on each local
+    day. Bitmaps missing from the cache are built from the database in a single query, then cached.
+    """
+    cache = caches[AVAILABILITY_CACHE]
+    keys = {bitmap_key(vehicle_id, date): (vehicle_id, date) for vehicle_id in vehicle_ids for date in dates}
+    bitmaps = {keys[key]: bitmap for key, bitmap in cache.get_many(list(keys)).items()}
+    missing = {day: 0 for day in keys.values() if day not in bitmaps}
+    if missing:
+        from .models import Booking
+        missing_dates = sorted({date for _, date in missing})
+        range_start, _ = local_day_bounds(missing_dates[0])
+        _, range_end = local_day_bounds(missing_dates[-1])
+        bookings = Booking.objects.filter(
+            vehicle_id__in={vehicle_id for vehicle_id, _ in missing}
+        ).overlapping(range_start, range_end).values_list('vehicle_id', 'schedule_start', 'schedule_end')
+        for vehicle_id, start, end in bookings:
+            for date in local_dates(max(start, range_start), min(end, range_end)):
+                if (vehicle_id, date) in missing:
+                    missing[(vehicle_id, date)] |= hours_mask(date, start, end)
+        cache.set_many({bitmap_key(vehicle_id, date): bitmap for (vehicle_id, date), bitmap in missing.items()})
+        bitmaps.update(missing)
+    return bitmaps
+
+
+def invalidate_bitmaps(vehicle_id, start, end):
+    """
+    Removes the cached bitmaps for the days touched by a booking. This happens straight away, and again once the
+    current transaction commits, so a bitmap rebuilt from the old data in the meantime isn't left in the cache.
+    """
+    keys = [bitmap_key(vehicle_id, date) for date in local_dates(start, end)]
+    cache = caches[AVAILABILITY_CACHE]
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def build_day_timeline(vehicle, date, user, now=None):
+    """
+    Builds the hourly occupancy grid shown on the booking timeline for a single local day, from the cached bitmap.
+    If any hour is booked, the user's own bookings for the day are fetched in one query.
+    :return: OrderedDict of hour (0-23) -> 'available', 'booked_by_user' or 'unavailable'
+    """
+    if now is None:
+        now = timezone.now()
+    booked = get_bitmaps([vehicle.id], [date])[(vehicle.id, date)]
+    booked_by_user = 0
+    if booked:
+        day_start, day_end = local_day_bounds(date)
+        own_bookings = vehicle.booking_set.filter(user_id=user.id).overlapping(day_start, day_end)
+        for start, end in own_bookings.values_list('schedule_start', 'schedule_end'):
+            booked_by_user |= hours_mask(date, start, end)
+    # Hours can still be booked up to an hour after they start
+    earliest_bookable = now - dt.timedelta(hours=1)
+
+    hours = OrderedDict()
+    for i in range(0, 24):
+        datetime = local_hour(date, i)
+        bit = 1 << i
+        if datetime is None:
+            # Hour doesn't exist on this day (start of DST)
+            hours[i] = 'unavailable'
+        elif not booked & bit and datetime > earliest_bookable:
+            hours[i] = 'available'
+        elif booked_by_user & bit:
+            hours[i] = 'booked_by_user'
+        else:
+            hours[i] = 'unavailable'
+    return hours
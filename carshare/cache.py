@@ -0,0 +1,156 @@
+#
+#   Author(s): Huon Imberger
+#   Description: Caching helpers
+#
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.db import DatabaseCache
+from django.db import connections, models, router
+from django.utils import timezone
+from django.utils.encoding import force_bytes
+
+from datetime import datetime
+import base64
+import pickle
+import time
+
+
+class ProcessLocalCache(object):
+    """
+    Keeps a value in process memory, rebuilding it when its version in the shared cache changes.
+    Calling invalidate() in one process (e.g. from a post_save signal) makes every process rebuild the value on next
+    use. If the version key is evicted from the shared cache, processes rebuild too, so eviction is always safe.
+    The version is checked at most once every settings.PROCESS_LOCAL_CACHE_CHECK_INTERVAL seconds (default 1), so a
+    value can be that much out of date in other processes (but never in the process that invalidated it). An interval
+    of None only reads the version when the value is rebuilt.
+    """
+    def __init__(self, version_key, build):
+        """
+        :param version_key: shared cache key holding the current version
+        :param build: function returning a fresh value
+        """
+        self.version_key = version_key
+        self.build = build
+        self._value = None
+        self._version = None
+        self._checked = None
+
+    def get(self):
+        now = time.monotonic()
+        if self._value is not None:
+            check_interval = getattr(settings, 'PROCESS_LOCAL_CACHE_CHECK_INTERVAL', 1)
+            if check_interval is None or now - self._checked < check_interval:
+                return self._value
+        # Read the version before building, so a change made during the build causes another rebuild next time
+        version = cache.get(self.version_key, 0)
+        if self._value is None or version != self._version:
+            self._value = self.build()
+            self._version = version
+        self._checked = now
+        return self._value
+
+    def reload(self):
+        """
+        Rebuilds the value in this process only
+        """
+        self._value = None
+        return self.get()
+
+    def invalidate(self):
+        self._value = None
+        try:
+            cache.incr(self.version_key)
+        except ValueError:
+            # Key is missing (never set, or evicted)
+            cache.set(self.version_key, 1, None)
+
+
+class BulkDatabaseCache(DatabaseCache):
+    """
+    Database cache backend whose get_many(), set_many() and delete_many() take a single query each, rather than one or
+    more queries per key. Entries are written with an upsert (PostgreSQL 9.5+ or SQLite 3.24+), and expired entries
+    are culled when a read comes across one, rather than counting the entries on every write.
+    """
+    # Most keys in one query, below SQLite's limit of 999 query parameters
+    CHUNK_SIZE = 300
+
+    def _chunks(self, items):
+        items = list(items)
+        return [items[i:i + self.CHUNK_SIZE] for i in range(0, len(items), self.CHUNK_SIZE)]
+
+    def get_many(self, keys, version=None):
+        key_map = {self.make_key(key, version=version): key for key in keys}
+        for key in key_map:
+            self.validate_key(key)
+        connection = connections[router.db_for_read(self.cache_model_class)]
+        table = connection.ops.quote_name(self._table)
+        rows = []
+        with connection.cursor() as cursor:
+            for chunk in self._chunks(key_map):
+                cursor.execute('SELECT cache_key, value, expires FROM {0} WHERE cache_key IN ({1})'.format(
+                    table, ', '.join(['%s'] * len(chunk))
+                ), chunk)
+                rows.extend(cursor.fetchall())
+
+        expression = models.Expression(output_field=models.DateTimeField())
+        converters = connection.ops.get_db_converters(expression) + expression.get_db_converters(connection)
+        now = timezone.now()
+        values = {}
+        expired = False
+        for key, value, expires in rows:
+            for converter in converters:
+                expires = converter(expires, expression, connection, {})
+            if expires < now:
+                expired = True
+                continue
+            value = connection.ops.process_clob(value)
+            values[key_map[key]] = pickle.loads(base64.b64decode(force_bytes(value)))
+        if expired:
+            db = router.db_for_write(self.cache_model_class)
+            with connections[db].cursor() as cursor:
+                self._cull(db, cursor, now.replace(microsecond=0))
+        return values
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        timeout = self.get_backend_timeout(timeout)
+        if timeout is None:
+            expires = datetime.max
+        elif settings.USE_TZ:
+            expires = datetime.utcfromtimestamp(timeout)
+        else:
+            expires = datetime.fromtimestamp(timeout)
+        connection = connections[router.db_for_write(self.cache_model_class)]
+        table = connection.ops.quote_name(self._table)
+        expires = connection.ops.adapt_datetimefield_value(expires.replace(microsecond=0))
+        rows = []
+        for key, value in data.items():
+            key = self.make_key(key, version=version)
+            self.validate_key(key)
+            rows.append((key, base64.b64encode(pickle.dumps(value, pickle.HIGHEST_PROTOCOL)).decode('latin1')))
+
+        with connection.cursor() as cursor:
+            for chunk in self._chunks(rows):
+                params = []
+                for key, value in chunk:
+                    params.extend([key, value, expires])
+                # The upsert means concurrent writes of the same key can't conflict, unlike set()'s UPDATE/INSERT
+                cursor.execute(
+                    'INSERT INTO {0} (cache_key, value, expires) VALUES {1} ON CONFLICT (cache_key) DO UPDATE SET '
+                    'value = excluded.value, expires = excluded.expires'.format(
+                        table, ', '.join(['(%s, %s, %s)'] * len(chunk))
+                    ), params
+                )
+
+    def delete_many(self, keys, version=None):
+        keys = [self.make_key(key, version=version) for key in keys]
+        for key in keys:
+            self.validate_key(key)
+        connection = connections[router.db_for_write(self.cache_model_class)]
+        table = connection.ops.quote_name(self._table)
+        with connection.cursor() as cursor:
+            for chunk in self._chunks(keys):
+                cursor.execute('DELETE FROM {0} WHERE cache_key IN ({1})'.format(
+                    table, ', '.join(['%s'] * len(chunk))
+                ), chunk)
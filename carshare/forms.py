@@ -34,7 +34,10 @@ class ContactForm(forms.Form):
         )
 
 
-class BookingForm(forms.Form):
+class BookingWindowForm(forms.Form):
+    """
+    Booking start and end, without any layout, for when the times only need to be parsed and validated
+    """
     TIMES = (
         ('00:00', '00:00'),
         ('01:00', '01:00'),
@@ -85,7 +88,7 @@ class BookingForm(forms.Form):
         return booking_end_time
 
     def clean(self):
-        cleaned_data = super(BookingForm, self).clean()
+        cleaned_data = super(BookingWindowForm, self).clean()
         if ('booking_start_date' in cleaned_data and 'booking_start_time' in cleaned_data
                 and 'booking_end_date' in cleaned_data and 'booking_end_time' in cleaned_data):
             schedule_start = timezone.make_aware(
@@ -117,6 +120,8 @@ class BookingForm(forms.Form):
             cleaned_data['schedule_end'] = schedule_end
         return cleaned_data
 
+
+class BookingForm(BookingWindowForm):
     def __init__(self, *args, **kwargs):
         initial_start_datetime = kwargs.pop('initial_start_datetime', None)
         initial_length = int(kwargs.pop('initial_length', 1))
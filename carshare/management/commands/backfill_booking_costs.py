@@ -0,0 +1,54 @@
+#
+#   Author(s): Huon Imberger
+#   Description: Stores the cost of bookings made before costs were stored
+#
+
+from django.core.management.base import BaseCommand
+from django.db import models
+from django.db.models import Case, Value, When
+
+from carshare.models import Booking
+from carshare.pricing import cost_cents, to_cents
+
+
+class Command(BaseCommand):
+    help = "Stores the cost of bookings that don't have one yet, quoted at their vehicle's current rates"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help='Number of bookings updated per query')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        bookings = Booking.objects.filter(quoted_cost__isnull=True).order_by('id').values_list(
+            'id', 'schedule_start', 'schedule_end', 'vehicle__type__hourly_rate', 'vehicle__type__daily_rate'
+        )
+        last_id = 0
+        total = 0
+        while True:
+            # Continue from the last id rather than an offset, since updated rows drop out of the filter
+            rows = list(bookings.filter(id__gt=last_id)[:chunk_size])
+            if not rows:
+                break
+            self.update_chunk(rows)
+            last_id = rows[-1][0]
+            total += len(rows)
+            self.stdout.write('Stored costs for {0} bookings'.format(total))
+        self.stdout.write(self.style.SUCCESS('Done, {0} bookings updated'.format(total)))
+
+    @staticmethod
+    def update_chunk(rows):
+        """
+        Updates a chunk of bookings in a single query (a CASE per field, keyed on id)
+        """
+        costs, hourly_rates, daily_rates = [], [], []
+        for booking_id, start, end, hourly_rate, daily_rate in rows:
+            quoted_cost = cost_cents(end - start, to_cents(hourly_rate), to_cents(daily_rate))
+            costs.append(When(id=booking_id, then=Value(quoted_cost)))
+            hourly_rates.append(When(id=booking_id, then=Value(hourly_rate)))
+            daily_rates.append(When(id=booking_id, then=Value(daily_rate)))
+        rate_field = models.DecimalField(max_digits=6, decimal_places=2)
+        Booking.objects.filter(id__in=[row[0] for row in rows]).update(
+            quoted_cost=Case(*costs, output_field=models.PositiveIntegerField()),
+            quoted_hourly_rate=Case(*hourly_rates, output_field=rate_field),
+            quoted_daily_rate=Case(*daily_rates, output_field=rate_field),
+        )
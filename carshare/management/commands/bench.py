@@ -0,0 +1,160 @@
+#
+#   Author(s): Huon Imberger
+#   Description: Times the key views and model methods, and reports latency percentiles and query counts as JSON
+#
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+import datetime as dt
+import json
+import logging
+import math
+import time
+
+from accounts.models import User
+from carshare.models import Booking, BookingReminder, Pod, SiteStatistics, Vehicle
+from carshare.pricing import total_cost
+
+
+# The benchmark doesn't need collectstatic to have been run
+STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage'
+
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile of a list of numbers, e.g. fraction=0.95 for p95
+    """
+    values = sorted(values)
+    return values[max(int(math.ceil(fraction * len(values))) - 1, 0)]
+
+
+class Command(BaseCommand):
+    help = ('Times the key views (with the test client) and model methods against the current database, e.g. after '
+            'manage.py seed_benchmark, and prints p50/p95 latency and query counts as JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=30, help='Timed runs of each benchmark')
+        parser.add_argument('--warmup', type=int, default=3, help='Untimed runs first, to fill caches')
+        parser.add_argument('--only', nargs='+', metavar='NAME', help='Only run these benchmarks')
+        parser.add_argument('--user', help='Email of the user to log in as (default: the one with most bookings)')
+        parser.add_argument('--output', help='Write the JSON to this file as well as printing it')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError('--iterations must be at least 1')
+        benchmarks = self.get_benchmarks(self.get_user(options['user']))
+        if options['only']:
+            unknown = set(options['only']) - set(benchmarks)
+            if unknown:
+                raise CommandError('Unknown benchmarks: {0}'.format(', '.join(sorted(unknown))))
+            benchmarks = {name: benchmarks[name] for name in options['only']}
+
+        # Every request is logged at INFO by the timing middleware, which would drown out the results
+        timing_logger = logging.getLogger('vroom_car_share.timing')
+        log_level = timing_logger.level
+        timing_logger.setLevel(logging.WARNING)
+        try:
+            with override_settings(STATICFILES_STORAGE=STATICFILES_STORAGE):
+                results = {name: self.run(benchmark, options['warmup'], options['iterations'])
+                           for name, benchmark in sorted(benchmarks.items())}
+        finally:
+            timing_logger.setLevel(log_level)
+
+        report = json.dumps({
+            'time': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'rows': {
+                'pods': Pod.objects.count(),
+                'vehicles': Vehicle.objects.count(),
+                'users': User.objects.count(),
+                'bookings': Booking.objects.count(),
+            },
+            'iterations': options['iterations'],
+            'results': results,
+        }, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(report)
+        self.stdout.write(report)
+
+    def get_user(self, email):
+        if email:
+            try:
+                return User.objects.get(email=email)
+            except User.DoesNotExist:
+                raise CommandError('There is no user {0}'.format(email))
+        busiest = Booking.objects.values('user').annotate(bookings=Count('id')).order_by('-bookings').first()
+        if busiest is None:
+            raise CommandError('There are no bookings to benchmark (run manage.py seed_benchmark first)')
+        return User.objects.get(pk=busiest['user'])
+
+    def get_benchmarks(self, user):
+        """
+        Returns a dict of benchmark name to a function that runs it once
+        """
+        vehicles = Vehicle.objects.filter(active=True, pod__isnull=False).select_related('pod').order_by('id')
+        vehicle = vehicles.first()
+        if vehicle is None:
+            raise CommandError('There are no active vehicles to benchmark (run manage.py seed_benchmark first)')
+        location = {'lat': vehicle.pod.latitude, 'lng': vehicle.pod.longitude}
+        tomorrow = (timezone.localtime() + dt.timedelta(days=1)).strftime('%d/%m/%Y')
+        quote = {
+            'booking_start_date': tomorrow, 'booking_start_time': '10:00',
+            'booking_end_date': tomorrow, 'booking_end_time': '13:00',
+            'vehicle': list(vehicles.values_list('id', flat=True)[:20]),
+        }
+        client = Client()
+        client.force_login(user)
+
+        def get(url, params=None):
+            return lambda: client.get(url, params or {})
+
+        return {
+            'view:about_us': get(reverse('carshare:about_us')),
+            'view:find_a_car': get(reverse('carshare:find_a_car')),
+            'view:nearby_vehicles': get(reverse('carshare:nearby_vehicles'), dict(location, k=10)),
+            'view:nearby_vehicles_radius': get(reverse('carshare:nearby_vehicles'), dict(location, radius=2)),
+            'view:booking_timeline': get(reverse('carshare:booking_create', args=[vehicle.id])),
+            'view:booking_quote': get(reverse('carshare:ajax_booking_quote'), quote),
+            'view:my_bookings': get(reverse('carshare:my_bookings')),
+            'view:past_bookings': get(reverse('carshare:ajax_past_bookings')),
+            'model:site_statistics': SiteStatistics.get,
+            'model:vehicles_with_availability': lambda: list(Vehicle.objects.with_availability()),
+            'model:user_current_booking': lambda: list(user.booking_set.current()[:1]),
+            'model:user_total_cost': lambda: total_cost(user.booking_set.all()),
+            'model:bookings_needing_reminder': lambda: [list(Booking.objects.needing_reminder(kind))
+                                                        for kind, _ in BookingReminder.KINDS],
+        }
+
+    def run(self, benchmark, warmup, iterations):
+        for _ in range(warmup):
+            self.check_result(benchmark())
+        times, queries = [], []
+        for _ in range(iterations):
+            with CaptureQueriesContext(connection) as context:
+                start = time.perf_counter()
+                result = benchmark()
+                times.append((time.perf_counter() - start) * 1000)
+            self.check_result(result)
+            queries.append(len(context))
+        return {
+            'p50_ms': round(percentile(times, 0.5), 3),
+            'p95_ms': round(percentile(times, 0.95), 3),
+            'mean_ms': round(sum(times) / len(times), 3),
+            'max_ms': round(max(times), 3),
+            'queries_p50': percentile(queries, 0.5),
+            'queries_max': max(queries),
+        }
+
+    @staticmethod
+    def check_result(result):
+        # Timing an error page would be misleading
+        status_code = getattr(result, 'status_code', 200)
+        if status_code != 200:
+            raise CommandError('{0} returned status {1}'.format(result.request['PATH_INFO'], status_code))
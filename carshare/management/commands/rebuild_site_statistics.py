@@ -0,0 +1,18 @@
+#
+#   Author(s): Huon Imberger
+#   Description: Recalculates the site statistics shown on the About Us page
+#
+
+from django.core.management.base import BaseCommand
+
+from carshare.models import SiteStatistics
+
+
+class Command(BaseCommand):
+    help = 'Recalculates the site statistics (vehicle, pod and booking counts, and completed booking costs)'
+
+    def handle(self, *args, **options):
+        stats = SiteStatistics.rebuild()
+        self.stdout.write('{0} vehicles, {1} pods, {2} bookings, ${3} of completed bookings'.format(
+            stats.num_vehicles, stats.num_pods, stats.num_bookings, stats.completed_cost
+        ))
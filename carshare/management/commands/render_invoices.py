@@ -0,0 +1,109 @@
+#
+#   Author(s): Huon Imberger
+#   Description: Worker that renders queued invoice PDFs and emails them to users
+#
+
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+
+import logging
+import multiprocessing
+import time
+
+from carshare.models import Invoice, InvoiceJob
+
+
+logger = logging.getLogger(__name__)
+
+
+def render_invoice(invoice_id):
+    """
+    Renders an invoice PDF. Runs in a pool process, so only the PDF is sent back.
+    """
+    invoice = Invoice.objects.select_related('booking__vehicle__type', 'booking__user').get(pk=invoice_id)
+    return invoice.build_pdf()
+
+
+class Command(BaseCommand):
+    help = 'Renders queued invoice PDFs in a pool of processes, and emails them to users'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=2,
+                            help='Number of rendering processes (0 renders in this process, for debugging)')
+        parser.add_argument('--batch-size', type=int, default=10, help='Number of jobs claimed at a time')
+        parser.add_argument('--timeout', type=int, default=60, help='Seconds allowed for rendering a batch')
+        parser.add_argument('--sleep', type=float, default=2, help='Seconds to wait when there are no jobs')
+        parser.add_argument('--once', action='store_true', help='Exit once there are no jobs due')
+
+    def handle(self, *args, **options):
+        self.processes = options['processes']
+        self.timeout = options['timeout']
+        self.pool = self.make_pool()
+        try:
+            while True:
+                jobs = InvoiceJob.objects.claim(options['batch_size'])
+                if jobs:
+                    self.run_jobs(jobs)
+                elif options['once']:
+                    break
+                else:
+                    time.sleep(options['sleep'])
+        finally:
+            if self.pool is not None:
+                self.pool.terminate()
+
+    def make_pool(self):
+        if not self.processes:
+            return None
+        # Pool processes are forked, and mustn't share this process's database connections
+        connections.close_all()
+        # wkhtmltopdf is hungry, so pool processes are replaced now and then to give memory back
+        return multiprocessing.Pool(self.processes, maxtasksperchild=50)
+
+    def run_jobs(self, jobs):
+        """
+        Renders the PDFs for a batch of jobs in parallel, then stores and emails each one
+        """
+        if self.pool is None:
+            renders = {job.pk: InlineResult(render_invoice, job.invoice_id)
+                       for job in jobs if not job.invoice.has_current_pdf()}
+        else:
+            renders = {job.pk: self.pool.apply_async(render_invoice, (job.invoice_id,))
+                       for job in jobs if not job.invoice.has_current_pdf()}
+        deadline = time.monotonic() + self.timeout
+        timed_out = False
+        for job in jobs:
+            try:
+                if job.pk in renders:
+                    job.invoice.store_pdf(renders[job.pk].get(max(deadline - time.monotonic(), 0)))
+                # Queue the email with the job's completion, so a retried job doesn't email the invoice twice
+                with transaction.atomic():
+                    job.invoice.send_to_user()
+                    job.finish()
+            except multiprocessing.TimeoutError:
+                timed_out = True
+                job.fail('Rendering timed out after {0} seconds'.format(self.timeout))
+            except Exception as e:
+                logger.exception('Invoice job %s failed', job.pk)
+                job.fail(repr(e))
+            self.stdout.write('Invoice {0}: {1}'.format(job.invoice_id, job.status))
+        if timed_out:
+            # A stuck render would hold on to its process, so start again with a fresh pool
+            self.pool.terminate()
+            self.pool = self.make_pool()
+
+
+class InlineResult(object):
+    """
+    Runs a function straight away, with the same get() as the pool's results
+    """
+    def __init__(self, func, *args):
+        try:
+            self.value, self.error = func(*args), None
+        except Exception as e:
+            self.value, self.error = None, e
+
+    def get(self, timeout=None):
+        if self.error is not None:
+            raise self.error
+        return self.value
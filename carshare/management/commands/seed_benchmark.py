@@ -0,0 +1,240 @@
+#
+#   Author(s): Huon Imberger
+#   Description: Fills the database with a large synthetic fleet, users and booking history for benchmarking
+#
+
+from django.contrib.auth.hashers import make_password
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from decimal import Decimal
+import datetime as dt
+import random
+import time
+
+from accounts.models import User
+from carshare.models import Booking, Invoice, Pod, SiteStatistics, Vehicle, VehicleType
+from carshare.pricing import cost_cents, from_cents, to_cents, vehicle_types
+from carshare.spatial import pod_tree
+
+
+# Seeded rows are named with these, so they can be found again (and aren't mistaken for real data)
+POD_PREFIX = 'Bench pod '
+VEHICLE_PREFIX = 'Bench '
+USER_EMAIL = 'bench{0}@bench.vroomcs.org'
+USER_EMAIL_DOMAIN = '@bench.vroomcs.org'
+
+# Used if there are no vehicle types yet: (description, hourly rate, daily rate)
+VEHICLE_TYPES = (
+    ('Economy', Decimal('8.50'), Decimal('60.00')),
+    ('Standard', Decimal('10.00'), Decimal('70.00')),
+    ('Premium', Decimal('12.50'), Decimal('80.00')),
+    ('SUV', Decimal('14.00'), Decimal('95.00')),
+)
+
+MAKES_MODELS = (
+    ('Toyota', 'Yaris'), ('Toyota', 'Corolla'), ('Mazda', '3'), ('Hyundai', 'i30'), ('Honda', 'Jazz'),
+    ('Volkswagen', 'Golf'), ('Kia', 'Sportage'), ('Subaru', 'Forester'), ('Tesla', 'Model 3'),
+)
+
+# Weights of the hour of day bookings start at: mostly during the day, peaking in the morning and after work
+START_HOUR_WEIGHTS = (1, 1, 1, 1, 1, 2, 4, 8, 10, 9, 8, 7, 7, 7, 7, 8, 9, 10, 8, 6, 4, 3, 2, 1)
+
+# Booking lengths in hours, and how often they are chosen: mostly a few hours, some a day or more
+LENGTH_HOURS = ((1, 20), (2, 25), (3, 15), (4, 10), (6, 8), (8, 6), (12, 4), (24, 6), (48, 4), (72, 2))
+
+
+class Command(BaseCommand):
+    help = ('Fills an empty database with a large synthetic fleet, users and booking history, for manage.py bench. '
+            'Don\'t run this against a production database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pods', type=int, default=3000, help='Number of pods')
+        parser.add_argument('--vehicles', type=int, default=2500, help='Number of vehicles (at most one per pod)')
+        parser.add_argument('--users', type=int, default=200000, help='Number of users')
+        parser.add_argument('--bookings', type=int, default=2000000, help='Approximate number of bookings')
+        parser.add_argument('--days-past', type=int, default=365, help='Days of booking history')
+        parser.add_argument('--days-ahead', type=int, default=30, help='Days of future bookings')
+        parser.add_argument('--cancelled', type=float, default=0.05, help='Fraction of bookings that are cancelled')
+        parser.add_argument('--paid', type=float, default=0.95, help='Fraction of finished bookings with an invoice')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows inserted per query')
+        parser.add_argument('--seed', type=int, default=1, help='Random seed, so runs can be repeated exactly')
+
+    def handle(self, *args, **options):
+        if options['vehicles'] > options['pods']:
+            raise CommandError('Each vehicle needs its own pod, so --vehicles can\'t be more than --pods')
+        if Pod.objects.filter(description__startswith=POD_PREFIX).exists():
+            raise CommandError('The database already has benchmark data. Seed a new database instead.')
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.now = timezone.now().replace(minute=0, second=0, microsecond=0)
+
+        self.step('Pods', self.create_pods, options['pods'])
+        self.step('Vehicles', self.create_vehicles, options['vehicles'])
+        self.step('Users', self.create_users, options['users'])
+        self.step('Bookings', self.create_bookings, options['bookings'], options['days_past'], options['days_ahead'],
+                  options['cancelled'])
+        self.step('Invoices', self.create_invoices, options['paid'])
+
+        # Bulk inserts skip the signals that keep these up to date
+        self.step('Statistics', SiteStatistics.rebuild)
+        vehicle_types.invalidate()
+        pod_tree.invalidate()
+        caches['availability'].clear()
+
+    def step(self, name, func, *args):
+        start = time.perf_counter()
+        func(*args)
+        self.stdout.write('{0}: done in {1:.1f}s'.format(name, time.perf_counter() - start))
+
+    def bulk_create(self, model, objects):
+        """
+        Inserts objects (which can be a generator) a batch at a time, without holding them all in memory
+        """
+        count = 0
+        batch = []
+        for obj in objects:
+            batch.append(obj)
+            if len(batch) == self.batch_size:
+                model.objects.bulk_create(batch)
+                count += len(batch)
+                batch = []
+        model.objects.bulk_create(batch)
+        return count + len(batch)
+
+    def create_pods(self, count):
+        """
+        Pods clustered around a few suburbs (and mostly the CBD), like a real city's fleet
+        """
+        centres = [(-37.8136, 144.9631, 0.02)] * 4 + [
+            (-37.8497, 144.9880, 0.02), (-37.7986, 144.9786, 0.015), (-37.8770, 145.0449, 0.03),
+            (-37.7678, 144.9614, 0.025), (-37.8183, 145.1226, 0.04), (-37.7000, 145.0000, 0.08),
+        ]
+        pods = []
+        for number in range(count):
+            latitude, longitude, spread = self.random.choice(centres)
+            pods.append(Pod(
+                latitude=Decimal('{0:.8f}'.format(self.random.gauss(latitude, spread))),
+                longitude=Decimal('{0:.8f}'.format(self.random.gauss(longitude, spread))),
+                description='{0}{1}'.format(POD_PREFIX, number),
+            ))
+        self.bulk_create(Pod, pods)
+
+    def create_vehicles(self, count):
+        if not VehicleType.objects.exists():
+            VehicleType.objects.bulk_create([
+                VehicleType(description=description, hourly_rate=hourly_rate, daily_rate=daily_rate)
+                for description, hourly_rate, daily_rate in VEHICLE_TYPES
+            ])
+        type_ids = list(VehicleType.objects.values_list('id', flat=True))
+        pod_ids = list(Pod.objects.filter(description__startswith=POD_PREFIX).values_list('id', flat=True))
+        self.random.shuffle(pod_ids)
+        vehicles = []
+        for number, pod_id in enumerate(pod_ids[:count]):
+            make, model = self.random.choice(MAKES_MODELS)
+            vehicles.append(Vehicle(
+                type_id=self.random.choice(type_ids),
+                pod_id=pod_id,
+                name='{0}{1}'.format(VEHICLE_PREFIX, number),
+                make=make,
+                model=model,
+                year=self.random.randint(2010, 2018),
+                # 'B' and five base 36 digits, enough for 60 million vehicles
+                registration='B' + to_base36(number).rjust(5, '0'),
+                active=self.random.random() > 0.02,
+            ))
+        self.bulk_create(Vehicle, vehicles)
+
+    def create_users(self, count):
+        # Hashing a password is slow on purpose, so every user gets the same one
+        password = make_password('bench')
+        self.bulk_create(User, (
+            User(
+                email=USER_EMAIL.format(number),
+                password=password,
+                first_name='Bench',
+                last_name='User {0}'.format(number),
+                date_of_birth=dt.date(1950, 1, 1) + dt.timedelta(days=self.random.randint(0, 365 * 50)),
+            )
+            for number in range(count)
+        ))
+
+    def create_bookings(self, count, days_past, days_ahead, cancelled_fraction):
+        """
+        Bookings for each vehicle, one after another without overlapping. Popular vehicles get many more bookings
+        than quiet ones, and a few heavy users make many more bookings than most.
+        Bookings by the same user can overlap (the booking form doesn't allow it), which doesn't matter for timing.
+        """
+        vehicles = list(Vehicle.objects.filter(name__startswith=VEHICLE_PREFIX).values_list('id', 'type_id'))
+        user_ids = list(User.objects.filter(email__endswith=USER_EMAIL_DOMAIN).values_list('id', flat=True))
+        if not vehicles or not user_ids:
+            return
+        rates = {vehicle_type.id: vehicle_type for vehicle_type in VehicleType.objects.all()}
+        popularity = [self.random.lognormvariate(0, 0.75) for _ in vehicles]
+        scale = count / sum(popularity)
+
+        def bookings():
+            start = self.now - dt.timedelta(days=days_past)
+            days = days_past + days_ahead
+            for (vehicle_id, type_id), weight in zip(vehicles, popularity):
+                vehicle_type = rates[type_id]
+                hourly_cents, daily_cents = to_cents(vehicle_type.hourly_rate), to_cents(vehicle_type.daily_rate)
+                starts = sorted(
+                    start + dt.timedelta(days=self.random.randrange(days),
+                                         hours=self.random.choices(range(24), START_HOUR_WEIGHTS)[0])
+                    for _ in range(round(weight * scale))
+                )
+                for schedule_start, next_start in zip(starts, starts[1:] + [None]):
+                    length = dt.timedelta(hours=self.random.choices(*zip(*LENGTH_HOURS))[0])
+                    if next_start is not None:
+                        # Cut short to fit before the next booking, or skip if they start together
+                        length = min(length, next_start - schedule_start)
+                    if not length:
+                        continue
+                    cancelled = None
+                    if self.random.random() < cancelled_fraction:
+                        cancelled = schedule_start - dt.timedelta(hours=self.random.randint(1, 72))
+                    yield Booking(
+                        # Squaring skews towards the first users, who become the heavy users
+                        user_id=user_ids[int(len(user_ids) * self.random.random() ** 2)],
+                        vehicle_id=vehicle_id,
+                        schedule_start=schedule_start,
+                        schedule_end=schedule_start + length,
+                        cancelled=cancelled,
+                        quoted_cost=cost_cents(length, hourly_cents, daily_cents),
+                        quoted_hourly_rate=vehicle_type.hourly_rate,
+                        quoted_daily_rate=vehicle_type.daily_rate,
+                    )
+
+        created = self.bulk_create(Booking, bookings())
+        self.stdout.write('Created {0} bookings'.format(created))
+
+    def create_invoices(self, paid_fraction):
+        finished = Booking.objects.filter(
+            user__email__endswith=USER_EMAIL_DOMAIN, cancelled__isnull=True, schedule_end__lte=self.now
+        ).values_list('id', 'schedule_end', 'quoted_cost').order_by('id')
+
+        def invoices():
+            # A batch of bookings at a time, by id, so they aren't all loaded at once
+            last_id = 0
+            while True:
+                batch = list(finished.filter(id__gt=last_id)[:self.batch_size])
+                if not batch:
+                    return
+                last_id = batch[-1][0]
+                for booking_id, schedule_end, quoted_cost in batch:
+                    if self.random.random() < paid_fraction:
+                        yield Invoice(booking_id=booking_id, date=schedule_end.date(), amount=from_cents(quoted_cost))
+
+        self.bulk_create(Invoice, invoices())
+
+
+def to_base36(number):
+    digits = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    result = ''
+    while True:
+        number, digit = divmod(number, 36)
+        result = digits[digit] + result
+        if not number:
+            return result
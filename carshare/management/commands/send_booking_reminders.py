@@ -0,0 +1,69 @@
+#
+#   Author(s): Huon Imberger
+#   Description: Scheduler that queues reminder emails for bookings about to start or end
+#
+
+from django.core.management.base import BaseCommand
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+import logging
+import time
+
+from carshare.models import Booking, BookingReminder
+from emails.models import EmailTemplate
+from emails.utils import build_templated_email, get_compiled_template, queue_emails
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Queues "starting soon" and "ending soon" emails for bookings, once a minute'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Most reminders of each kind queued in a run (the rest are queued by the next run)')
+        parser.add_argument('--interval', type=float, default=60, help='Seconds between runs')
+        parser.add_argument('--once', action='store_true', help='Queue the reminders due now, then exit')
+
+    def handle(self, *args, **options):
+        while True:
+            now = timezone.now()
+            for kind, _ in BookingReminder.KINDS:
+                self.queue_reminders(kind, now, options['batch_size'])
+            if options['once']:
+                break
+            time.sleep(max(options['interval'] - (timezone.now() - now).total_seconds(), 0))
+
+    def queue_reminders(self, kind, now, batch_size):
+        """
+        Queues one kind of reminder for all the bookings due it, along with the markers that stop it being sent again
+        """
+        bookings = list(
+            Booking.objects.needing_reminder(kind, now).select_related('user', 'vehicle__pod')[:batch_size]
+        )
+        if not bookings:
+            return
+        template_name = BookingReminder.TEMPLATES[kind]
+        try:
+            templates = get_compiled_template(template_name)
+        except EmailTemplate.DoesNotExist:
+            # Leave the reminders due, to be sent once the template has been added (e.g. in the admin)
+            logger.error('Skipping %s reminders: there is no "%s" email template', kind, template_name)
+            return
+        emails = [build_templated_email(template_name, {'booking': booking}, [booking.user.email], templates=templates)
+                  for booking in bookings]
+        try:
+            with transaction.atomic():
+                BookingReminder.objects.bulk_create([
+                    BookingReminder(booking=booking, kind=kind, time=booking.reminder_time, sent=now)
+                    for booking in bookings
+                ])
+                queue_emails(emails)
+        except IntegrityError:
+            # Another run queued some of the same reminders first. Nothing was queued, and the next run picks up any
+            # that are still missing.
+            logger.warning('%s reminders were queued by another run', kind)
+            return
+        self.stdout.write('{0} reminders: {1}'.format(kind, len(bookings)))
@@ -0,0 +1,44 @@
+#
+#   Author(s): Huon Imberger
+#   Description: Checks stored booking costs against their times and quoted rates
+#
+
+from django.core.management.base import BaseCommand, CommandError
+
+from carshare.models import Booking
+from carshare.pricing import cost_cents, from_cents, to_cents
+
+
+class Command(BaseCommand):
+    help = 'Compares the stored cost of each booking with the cost recalculated from its times and quoted rates'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Number of bookings fetched per query')
+
+    def handle(self, *args, **options):
+        bookings = Booking.objects.filter(quoted_cost__isnull=False).order_by('id').values_list(
+            'id', 'quoted_cost', 'schedule_start', 'schedule_end', 'quoted_hourly_rate', 'quoted_daily_rate'
+        )
+        last_id = 0
+        checked = 0
+        mismatches = 0
+        while True:
+            rows = list(bookings.filter(id__gt=last_id)[:options['chunk_size']])
+            if not rows:
+                break
+            for booking_id, quoted_cost, start, end, hourly_rate, daily_rate in rows:
+                expected = cost_cents(end - start, to_cents(hourly_rate), to_cents(daily_rate))
+                if quoted_cost != expected:
+                    mismatches += 1
+                    self.stdout.write('Booking {0}: stored ${1}, expected ${2}'.format(
+                        booking_id, from_cents(quoted_cost), from_cents(expected)
+                    ))
+            last_id = rows[-1][0]
+            checked += len(rows)
+
+        unquoted = Booking.objects.filter(quoted_cost__isnull=True).count()
+        if unquoted:
+            self.stdout.write('{0} bookings have no stored cost (run backfill_booking_costs)'.format(unquoted))
+        if mismatches:
+            raise CommandError('{0} of {1} stored costs do not match'.format(mismatches, checked))
+        self.stdout.write(self.style.SUCCESS('All {0} stored costs match'.format(checked)))
@@ -0,0 +1,248 @@
+#
+#   Author(s): Huon Imberger
+#   Description: Custom querysets for core models
+#
+
+from django.db import models, transaction, OperationalError
+from django.db.models import Case, Exists, F, OuterRef, Q, Value, When
+from django.utils import timezone
+
+import datetime as dt
+import random
+import time
+
+
+class BookingUnavailable(Exception):
+    """
+    Raised when a booking can't be created because it overlaps an existing booking
+    """
+    pass
+
+
+class PodQuerySet(models.QuerySet):
+    """
+    Pod queryset with location filters
+    """
+    def within_bounds(self, south, west, north, east):
+        """
+        Pods inside a latitude/longitude bounding box (uses the latitude, longitude index)
+        """
+        return self.filter(
+            latitude__gte=south, latitude__lte=north, longitude__gte=west, longitude__lte=east
+        )
+
+
+class VehicleQuerySet(models.QuerySet):
+    """
+    Vehicle queryset with fleet-wide availability
+    """
+    def with_availability(self, now=None):
+        """
+        Annotates each vehicle with currently_booked (whether a booking holds it right now), and loads its pod and
+        type in the same query. Vehicle.is_available() uses the annotation when it is present.
+        """
+        if now is None:
+            now = timezone.now()
+        bookings = self.model._meta.get_field('booking').related_model.objects
+        return self.select_related('pod', 'type').annotate(
+            currently_booked=Exists(bookings.active_at(now).filter(vehicle=OuterRef('pk')))
+        )
+
+
+class BookingQuerySet(models.QuerySet):
+    """
+    Booking queryset with common filters pushed down to the database
+    """
+    def overlapping(self, start, end):
+        """
+        Non-cancelled bookings that overlap the window [start, end). Bookings that only touch the window (e.g. one ends
+        exactly when the window starts) do not overlap it.
+        """
+        return self.filter(cancelled__isnull=True, schedule_start__lt=end, schedule_end__gt=start)
+
+    def active_at(self, datetime):
+        """
+        Non-cancelled bookings holding their vehicle at the given time
+        """
+        return self.filter(cancelled__isnull=True, schedule_start__lte=datetime, schedule_end__gt=datetime)
+
+    def current(self, now=None):
+        """
+        Non-cancelled bookings in progress (started before and ending after now), earliest first
+        """
+        if now is None:
+            now = timezone.now()
+        return self.filter(
+            cancelled__isnull=True, schedule_start__lt=now, schedule_end__gt=now
+        ).order_by('schedule_start', 'id')
+
+    def with_status(self, now=None):
+        """
+        Annotates each booking with status (as returned by Booking.get_base_status(), all judged against the same
+        time) and paid (whether it has an invoice), so that get_status() and is_paid() don't need further queries.
+        The annotations can also be filtered on, e.g. with_status().filter(status=Booking.ACTIVE, paid=False)
+        """
+        if now is None:
+            now = timezone.now()
+        invoices = self.model._meta.get_field('invoice').related_model.objects
+        return self.annotate(
+            status=Case(
+                When(cancelled__isnull=False, then=Value(self.model.CANCELLED)),
+                When(schedule_start__lt=now, schedule_end__gt=now, then=Value(self.model.ACTIVE)),
+                When(schedule_end__lt=now, then=Value(self.model.COMPLETE)),
+                When(schedule_start__gt=now, then=Value(self.model.CONFIRMED)),
+                default=Value(self.model.UNKNOWN),
+                output_field=models.CharField(),
+            ),
+            paid=Exists(invoices.filter(booking=OuterRef('pk'))),
+        )
+
+    def needing_reminder(self, kind, now=None):
+        """
+        Non-cancelled bookings due a reminder of the given kind (see BookingReminder) that haven't had it: those
+        starting, or active and ending, within the reminder's lead time. Each booking is annotated with
+        reminder_time, the start or end time the reminder is for.
+        This is one range scan over the schedule_start (or schedule_end) index, so it costs the same however many
+        bookings there are in total.
+        """
+        if now is None:
+            now = timezone.now()
+        reminders = self.model._meta.get_field('reminders').related_model
+        lead_time = reminders.LEAD_TIMES[kind]
+        if kind == reminders.STARTING:
+            bookings = self.filter(schedule_start__gt=now, schedule_start__lte=now + lead_time)
+            time = F('schedule_start')
+        else:
+            bookings = self.filter(schedule_end__gt=now, schedule_end__lte=now + lead_time, schedule_start__lte=now)
+            time = F('schedule_end')
+        return bookings.filter(cancelled__isnull=True).annotate(
+            reminder_time=time,
+            reminded=Exists(reminders.objects.filter(booking=OuterRef('pk'), kind=kind, time=OuterRef(time.name))),
+        ).filter(reminded=False).order_by('reminder_time', 'id')
+
+    def keyset_page(self, cursor=None, size=20):
+        """
+        Returns a page of bookings, newest first, and the cursor for the next page (None on the last page).
+        Each page carries on from the (schedule_start, id) of the previous one instead of an offset, so a page late
+        in a long history costs the same as the first.
+        :raises ValueError: if the cursor is invalid
+        """
+        bookings = self.order_by('-schedule_start', '-id')
+        if cursor:
+            start, pk = self.decode_cursor(cursor)
+            bookings = bookings.filter(Q(schedule_start__lt=start) | Q(schedule_start=start, id__lt=pk))
+        # Fetch one extra to find out if there is another page
+        page = list(bookings[:size + 1])
+        next_cursor = self.encode_cursor(page[size - 1]) if len(page) > size else None
+        return page[:size], next_cursor
+
+    @staticmethod
+    def encode_cursor(booking):
+        return '{0:%Y%m%d%H%M%S%f}-{1}'.format(timezone.localtime(booking.schedule_start, timezone.utc), booking.id)
+
+    @staticmethod
+    def decode_cursor(cursor):
+        start, pk = cursor.split('-')
+        return timezone.make_aware(dt.datetime.strptime(start, '%Y%m%d%H%M%S%f'), timezone.utc), int(pk)
+
+    def create_booking(self, user, vehicle, schedule_start, schedule_end, attempts=3, on_save=None):
+        """
+        Creates, quotes and saves a Booking, unless it would overlap an existing booking for the vehicle or the user.
+        Bookings for the same vehicle are written one at a time: the vehicle row is locked for the duration of the
+        transaction, and the overlap checks are repeated inside it. If the database aborts the transaction (deadlock,
+        lock timeout), it is retried up to the given number of attempts, so this must not be called inside another
+        transaction (the retry could never succeed).
+        :param on_save: function called with the saved booking inside the same transaction (e.g. to queue its
+        confirmation email), so it is only kept if the booking is
+        :raises BookingUnavailable: if the booking overlaps an existing booking
+        """
+        booking = self.model(user=user, vehicle=vehicle, schedule_start=schedule_start, schedule_end=schedule_end)
+        booking.quote()
+        for attempt in range(1, attempts + 1):
+            try:
+                with transaction.atomic(using=self.db):
+                    self._lock_vehicle(vehicle)
+                    if self.filter(vehicle=vehicle).overlapping(schedule_start, schedule_end).exists():
+                        raise BookingUnavailable('The selected vehicle is unavailable within the chosen times')
+                    if self.filter(user=user).overlapping(schedule_start, schedule_end).exists():
+                        raise BookingUnavailable('You already have a booking within the selected time frame')
+                    booking.save(force_insert=True, using=self.db)
+                    if on_save is not None:
+                        on_save(booking)
+                    return booking
+            except OperationalError:
+                # Rolled back, so the booking will be inserted again
+                booking.pk = None
+                if attempt == attempts:
+                    raise
+                # Back off for a short, random time so retries don't collide again
+                time.sleep(random.uniform(0, 0.05 * 2 ** attempt))
+
+    def extend_booking(self, booking, new_end, attempts=3, on_save=None):
+        """
+        Moves a booking's end to new_end, quotes it again and saves it, unless the longer booking would overlap another
+        booking for the vehicle or the user. Like create_booking, the vehicle row is locked for the duration of the
+        transaction and the overlap checks are repeated inside it, retrying up to the given number of attempts, and
+        on_save is called with the booking inside the transaction.
+        :raises BookingUnavailable: if the extended booking overlaps an existing booking
+        """
+        for attempt in range(1, attempts + 1):
+            try:
+                with transaction.atomic(using=self.db):
+                    self._lock_vehicle(booking.vehicle)
+                    others = self.exclude(pk=booking.pk).overlapping(booking.schedule_start, new_end)
+                    if others.filter(vehicle=booking.vehicle).exists():
+                        raise BookingUnavailable('The new end date overlaps with existing booking')
+                    if others.filter(user=booking.user).exists():
+                        raise BookingUnavailable('The new booking end overlaps with one of your existing bookings')
+                    booking.schedule_end = new_end
+                    booking.quote()
+                    booking.save(using=self.db)
+                    if on_save is not None:
+                        on_save(booking)
+                    return booking
+            except OperationalError:
+                if attempt == attempts:
+                    raise
+                time.sleep(random.uniform(0, 0.05 * 2 ** attempt))
+
+    def _lock_vehicle(self, vehicle):
+        """
+        Locks the vehicle's row until the end of the current transaction. SQLite ignores FOR UPDATE, but its
+        transactions are serialisable anyway (the losing writer gets an OperationalError and is retried).
+        """
+        vehicle_model = self.model._meta.get_field('vehicle').related_model
+        list(vehicle_model.objects.using(self.db).select_for_update().filter(pk=vehicle.pk).values_list('pk'))
+
+
+class InvoiceJobQuerySet(models.QuerySet):
+    """
+    Invoice job queue
+    """
+    def due(self, now=None):
+        """
+        Jobs ready to run: pending jobs whose retry time has come, and running jobs that have timed out
+        """
+        if now is None:
+            now = timezone.now()
+        return self.filter(
+            Q(status=self.model.PENDING, run_after__lte=now) |
+            Q(status=self.model.RUNNING, started__lt=now - self.model.TIMEOUT)
+        ).order_by('run_after', 'id')
+
+    def claim(self, limit, now=None):
+        """
+        Marks up to limit due jobs as running, and returns them. Each job is claimed with a conditional update, so
+        workers running side by side never run the same job.
+        """
+        if now is None:
+            now = timezone.now()
+        claimed = []
+        for job in self.due(now).select_related('invoice')[:limit]:
+            updated = self.filter(pk=job.pk, status=job.status, started=job.started).update(
+                status=self.model.RUNNING, started=now, attempts=F('attempts') + 1
+            )
+            if updated:
+                job.status, job.started, job.attempts = self.model.RUNNING, now, job.attempts + 1
+                claimed.append(job)
+        return claimed
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.1 on 2026-10-18 07:03
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carshare', '0012_booking_overlap_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='pod',
+            index=models.Index(fields=['latitude', 'longitude'], name='pod_location_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.1 on 2026-10-18 07:14
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carshare', '0013_pod_location_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SiteStatistics',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('num_vehicles', models.IntegerField(default=0)),
+                ('num_pods', models.IntegerField(default=0)),
+                ('num_bookings', models.IntegerField(default=0)),
+                ('completed_cost', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('completed_until', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name_plural': 'site statistics',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['schedule_end'], name='booking_end_idx'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.1 on 2026-10-18 07:31
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carshare', '0017_invoice_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookingReminder',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('Starting', 'Starting'), ('Ending', 'Ending')], max_length=10)),
+                ('time', models.DateTimeField()),
+                ('sent', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['schedule_start'], name='booking_start_idx'),
+        ),
+        migrations.AddField(
+            model_name='bookingreminder',
+            name='booking',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reminders', to='carshare.Booking'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='bookingreminder',
+            unique_together=set([('booking', 'kind', 'time')]),
+        ),
+    ]
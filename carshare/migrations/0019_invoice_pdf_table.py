@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.1 on 2026-10-18 07:52
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def move_pdfs(apps, schema_editor):
+    Invoice = apps.get_model('carshare', 'Invoice')
+    InvoicePdf = apps.get_model('carshare', 'InvoicePdf')
+    for invoice_id, pdf in Invoice.objects.filter(pdf__isnull=False).values_list('id', 'pdf').iterator():
+        InvoicePdf.objects.create(invoice_id=invoice_id, data=pdf)
+
+
+def restore_pdfs(apps, schema_editor):
+    Invoice = apps.get_model('carshare', 'Invoice')
+    InvoicePdf = apps.get_model('carshare', 'InvoicePdf')
+    for invoice_id, pdf in InvoicePdf.objects.values_list('invoice_id', 'data').iterator():
+        Invoice.objects.filter(pk=invoice_id).update(pdf=pdf)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carshare', '0018_booking_reminder'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoicePdf',
+            fields=[
+                ('invoice', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stored_pdf', serialize=False, to='carshare.Invoice')),
+                ('data', models.BinaryField()),
+            ],
+        ),
+        migrations.RunPython(move_pdfs, restore_pdfs),
+        migrations.RemoveField(
+            model_name='invoice',
+            name='pdf',
+        ),
+    ]
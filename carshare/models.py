@@ -3,13 +3,20 @@
 #   Description: Defines database models for core functionality
 #
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
+from django.template.loader import get_template
 from django.utils import timezone
 
-from decimal import Decimal
-from math import ceil
+from wkhtmltopdf.utils import render_pdf_from_template
+
+import datetime as dt
+import hashlib
 
 from accounts.models import User
+from .availability import find_free_slots
+from .managers import PodQuerySet, VehicleQuerySet, BookingQuerySet, InvoiceJobQuerySet
+from .pricing import billable_days_hours, cost, cost_cents, from_cents, get_vehicle_type, to_cents, total_cost
 
 
 class VehicleType(models.Model):
@@ -36,6 +43,13 @@ class Pod(models.Model):
     longitude = models.DecimalField(max_digits=11, decimal_places=8)
     description = models.CharField(max_length=200)
 
+    objects = PodQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['latitude', 'longitude'], name='pod_location_idx'),
+        ]
+
     def coordinates(self):
         return "{0},{1}".format(self.latitude, self.longitude)
 
@@ -59,6 +73,8 @@ class Vehicle(models.Model):
     active = models.BooleanField(default=True)
     registration = models.CharField(max_length=6, unique=True)
 
+    objects = VehicleQuerySet.as_manager()
+
     def is_active(self):
         return self.active
 
@@ -66,12 +82,10 @@ class Vehicle(models.Model):
         """
         Is the vehicle available for booking right now?
         """
-        current_bookings = self.booking_set.all()
-        active_bookings = [b for b in current_bookings if b.is_active()]
-        if not active_bookings:
-            return True
-        else:
-            return False
+        # Use annotation from VehicleQuerySet.with_availability() if present
+        if hasattr(self, 'currently_booked'):
+            return not self.currently_booked
+        return self.is_available_at(timezone.now())
 
     def is_available_at(self, datetime):
         """
@@ -79,19 +93,28 @@ class Vehicle(models.Model):
         :param datetime: when to check
         :return: Boolean
         """
-        for booking in self.booking_set.all():
-            if booking.schedule_start <= datetime < booking.schedule_end and not booking.is_cancelled():
-                return False
-        return True
+        return not self.booking_set.active_at(datetime).exists()
 
     def get_booking_at(self, datetime):
         """
         Returns the booking for this vehicle at the specified time, or None if it is not booked
         """
-        for booking in self.booking_set.all():
-            if booking.schedule_start <= datetime < booking.schedule_end and not booking.is_cancelled():
-                return booking
-        return None
+        return self.booking_set.active_at(datetime).order_by('schedule_start', 'id').first()
+
+    def get_free_slots(self, length, count=5, start=None):
+        """
+        Finds the earliest times this vehicle is free for at least the given length, up to the maximum booking length
+        ahead. Defaults to starting from the current hour, which can still be booked.
+        :param length: timedelta
+        :return: list of up to count (start, end) tuples
+        """
+        if start is None:
+            start = timezone.now().replace(minute=0, second=0, microsecond=0)
+        end = start + dt.timedelta(days=Booking.MAX_LENGTH_DAYS)
+        bookings = self.booking_set.overlapping(start, end).order_by('schedule_start').values_list(
+            'schedule_start', 'schedule_end'
+        )
+        return find_free_slots(bookings, start, end, length, count)
 
     def __str__(self):
         # E.g. 'Jackie - 2014 Toyota Corolla'
@@ -112,22 +135,70 @@ class Booking(models.Model):
     schedule_start = models.DateTimeField(verbose_name='Start time')
     schedule_end = models.DateTimeField(verbose_name='End time')
     cancelled = models.DateTimeField(null=True, blank=True)
+    # Cost in cents, and the rates it was worked out with. Set by quote() when the booking is confirmed or extended.
+    quoted_cost = models.PositiveIntegerField(null=True, blank=True)
+    quoted_hourly_rate = models.DecimalField(max_digits=6, decimal_places=2, null=True, blank=True)
+    quoted_daily_rate = models.DecimalField(max_digits=6, decimal_places=2, null=True, blank=True)
+
+    objects = BookingQuerySet.as_manager()
 
     MAX_LENGTH_DAYS = 90
 
+    # Statuses, as returned by BookingQuerySet.with_status()
+    ACTIVE = 'Active'
+    COMPLETE = 'Complete'
+    CONFIRMED = 'Confirmed'
+    CANCELLED = 'Cancelled'
+    UNKNOWN = 'Unknown'
+
+    class Meta:
+        indexes = [
+            # Overlap checks for a vehicle, and for a user
+            models.Index(fields=['vehicle', 'schedule_start', 'schedule_end'], name='booking_vehicle_schedule_idx'),
+            models.Index(fields=['user', 'schedule_start'], name='booking_user_start_idx'),
+            # Finding recently completed bookings, and bookings about to start or end (for reminders)
+            models.Index(fields=['schedule_end'], name='booking_end_idx'),
+            models.Index(fields=['schedule_start'], name='booking_start_idx'),
+        ]
+
+    def get_rates(self):
+        """
+        Returns the (hourly, daily) rates for this booking: those it was quoted at, or else the vehicle's current rates
+        """
+        if self.quoted_hourly_rate is not None and self.quoted_daily_rate is not None:
+            return self.quoted_hourly_rate, self.quoted_daily_rate
+        vehicle_type = get_vehicle_type(self.vehicle.type_id)
+        return vehicle_type.hourly_rate, vehicle_type.daily_rate
+
+    def quote(self):
+        """
+        Works out and sets (but doesn't save) the booking's cost. The rates are taken from the vehicle the first time,
+        then kept, so extending a booking doesn't change the rates it was booked at.
+        """
+        self.quoted_hourly_rate, self.quoted_daily_rate = self.get_rates()
+        self.quoted_cost = cost_cents(
+            self.schedule_end - self.schedule_start, to_cents(self.quoted_hourly_rate), to_cents(self.quoted_daily_rate)
+        )
+
+    def get_cost(self):
+        """
+        Returns the exact cost of the booking, as quoted if it has been quoted
+        :return: Decimal
+        """
+        if self.quoted_cost is not None:
+            return from_cents(self.quoted_cost)
+        hourly_rate, daily_rate = self.get_rates()
+        return cost(self.schedule_end - self.schedule_start, hourly_rate, daily_rate)
+
     def calculate_cost(self):
         """
         Calculates total cost of booking, taking into account hourly rate and daily rate of the vehicle.
         As soon as hourly cost reaches the daily rate, the daily rate is used instead.
         E.g. if hourly rate is $10 and daily rate $100, a booking lasting from 10 hours up to 24 hours will cost $100.
+        Use pricing.booking_costs() to price many bookings at once.
         :return: float
         """
-        booking_days, booking_hours = self.calculate_daily_hourly_billable_counts()
-        day_cost = booking_days * Decimal(self.vehicle.type.daily_rate)
-        hour_cost = booking_hours * Decimal(self.vehicle.type.hourly_rate)
-        if hour_cost > self.vehicle.type.daily_rate:
-            hour_cost = self.vehicle.type.daily_rate
-        return float(day_cost + hour_cost)
+        return float(self.get_cost())
 
     def calculate_daily_hourly_billable_counts(self):
         """
@@ -138,14 +209,8 @@ class Booking(models.Model):
         E.g. if hourly rate is $10 and daily rate $100, a booking lasting 40 hours would be days = 2 hours = 0
         :return: tuple
         """
-        booking_length = self.schedule_end - self.schedule_start
-        booking_length_hours_total = booking_length.days * 24 + booking_length.seconds / 60 / 60
-        booking_days = int(booking_length_hours_total / 24)
-        booking_hours = ceil(booking_length_hours_total % 24)
-        if booking_hours * Decimal(self.vehicle.type.hourly_rate) >= self.vehicle.type.daily_rate:
-            booking_days += 1
-            booking_hours = 0
-        return booking_days, booking_hours
+        hourly_rate, daily_rate = self.get_rates()
+        return billable_days_hours(self.schedule_end - self.schedule_start, to_cents(hourly_rate), to_cents(daily_rate))
 
     def is_active(self):
         return (
@@ -163,34 +228,39 @@ class Booking(models.Model):
         return self.schedule_start > timezone.now()
 
     def is_paid(self):
+        # Use annotation from BookingQuerySet.with_status() if present
+        if hasattr(self, 'paid'):
+            return self.paid
         return hasattr(self, 'invoice')
 
+    def get_base_status(self):
+        """
+        Returns the status without payment details (one of ACTIVE, COMPLETE, CONFIRMED, CANCELLED or UNKNOWN)
+        """
+        # Use annotation from BookingQuerySet.with_status() if present
+        if hasattr(self, 'status'):
+            return self.status
+        now = timezone.now()
+        if self.cancelled:
+            return self.CANCELLED
+        elif self.schedule_start < now < self.schedule_end:
+            return self.ACTIVE
+        elif self.schedule_end < now:
+            return self.COMPLETE
+        elif self.schedule_start > now:
+            return self.CONFIRMED
+        return self.UNKNOWN
+
     def get_status(self):
         """
         Returns a string indicating the status
         """
-        if self.cancelled:
-            return "Cancelled"
-        elif self.is_active():
-            s = "Active"
-            if self.is_paid():
-                return "{0} - Paid".format(s)
-            else:
-                return "{0} - Unpaid".format(s)
-        elif self.is_complete():
-            s = "Complete"
-            if self.is_paid():
-                return "{0} - Paid".format(s)
-            else:
-                return "{0} - Unpaid".format(s)
-        elif self.is_confirmed():
-            s = "Confirmed"
-            if self.is_paid():
-                return "{0} - Paid".format(s)
-            else:
-                return "{0} - Unpaid".format(s)
-        else:
+        status = self.get_base_status()
+        if status in (self.ACTIVE, self.COMPLETE, self.CONFIRMED):
+            return "{0} - {1}".format(status, "Paid" if self.is_paid() else "Unpaid")
+        elif status == self.UNKNOWN:
             return "Unknown - contact staff"
+        return status
 
     def __str__(self):
         return "{0} - {1}".format(self.id, self.get_status())
@@ -203,6 +273,242 @@ class Invoice(models.Model):
     booking = models.OneToOneField(Booking, related_name='invoice')
     date = models.DateField(default=timezone.now)
     amount = models.DecimalField(max_digits=7, decimal_places=2)
+    # SHA-256 of the rendered PDF (kept in InvoicePdf), used as its ETag, and the template version it was rendered with
+    pdf_hash = models.CharField(max_length=64, blank=True, editable=False)
+    pdf_version = models.PositiveIntegerField(null=True, blank=True, editable=False)
+
+    PDF_TEMPLATE = 'carshare/pdf/invoice.html'
+    # Increase when the PDF template changes, so stored PDFs are rendered again the next time they are needed
+    PDF_VERSION = 1
 
     def __str__(self):
         return '{0} - Booking {1}'.format(self.id, self.booking.id)
+
+    def has_current_pdf(self):
+        return bool(self.pdf_hash) and self.pdf_version == self.PDF_VERSION
+
+    def build_pdf(self):
+        """
+        Renders the invoice to PDF (without storing it)
+        :return: bytes
+        """
+        return render_pdf_from_template(get_template(self.PDF_TEMPLATE), None, None, context={'invoice': self})
+
+    def store_pdf(self, pdf):
+        self.pdf_hash, self.pdf_version = hashlib.sha256(pdf).hexdigest(), self.PDF_VERSION
+        with transaction.atomic():
+            InvoicePdf.objects.update_or_create(invoice_id=self.pk, defaults={'data': pdf})
+            Invoice.objects.filter(pk=self.pk).update(pdf_hash=self.pdf_hash, pdf_version=self.pdf_version)
+
+    def render_pdf(self):
+        """
+        Renders the invoice to PDF and stores it
+        """
+        self.store_pdf(self.build_pdf())
+
+    def get_pdf(self):
+        """
+        Returns the invoice as PDF, rendering it first if it hasn't been rendered with the current template
+        :return: bytes
+        """
+        if self.has_current_pdf():
+            pdf = InvoicePdf.objects.filter(invoice_id=self.pk).values_list('data', flat=True).first()
+            if pdf is not None:
+                # Some databases return binary fields as memoryview
+                return bytes(pdf)
+        pdf = self.build_pdf()
+        self.store_pdf(pdf)
+        return pdf
+
+    def send_to_user(self):
+        """
+        Emails the invoice (with the PDF attached) to the user who made the booking
+        """
+        self.booking.user.send_email(
+            template_name='Booking Invoice',
+            context={'invoice': self},
+            attachment_filename='invoice_{0}.pdf'.format(self.id),
+            attachment_data=self.get_pdf(),
+        )
+
+
+class InvoicePdf(models.Model):
+    """
+    The rendered PDF of an invoice (wkhtmltopdf is slow, so it is only run once per invoice). It is kept apart from
+    the invoice so that loading an invoice doesn't load the PDF.
+    """
+    invoice = models.OneToOneField(Invoice, primary_key=True, related_name='stored_pdf')
+    data = models.BinaryField()
+
+    def __str__(self):
+        return 'PDF of invoice {0}'.format(self.invoice_id)
+
+
+class InvoiceJob(models.Model):
+    """
+    Queued work for a new invoice: rendering its PDF and emailing it to the user, done by manage.py render_invoices
+    rather than while the user waits
+    """
+    PENDING = 'Pending'
+    RUNNING = 'Running'
+    DONE = 'Done'
+    FAILED = 'Failed'
+    STATUSES = (
+        (PENDING, PENDING),
+        (RUNNING, RUNNING),
+        (DONE, DONE),
+        (FAILED, FAILED),
+    )
+    MAX_ATTEMPTS = 5
+    # Failed attempts are retried after this, doubling each time
+    RETRY_DELAY = dt.timedelta(seconds=30)
+    # A job still running after this long is assumed to have died with its worker, and is run again
+    TIMEOUT = dt.timedelta(minutes=5)
+
+    invoice = models.OneToOneField(Invoice, related_name='job')
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    started = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    objects = InvoiceJobQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='invoicejob_due_idx'),
+        ]
+
+    def __str__(self):
+        return '{0} - Invoice {1} ({2})'.format(self.id, self.invoice_id, self.status)
+
+    def finish(self):
+        self.status = self.DONE
+        self.error = ''
+        self.save(update_fields=['status', 'error'])
+
+    def fail(self, error, now=None):
+        """
+        Records a failed attempt. The job is retried later, with exponential backoff, until it runs out of attempts.
+        """
+        if now is None:
+            now = timezone.now()
+        self.error = error
+        if self.attempts >= self.MAX_ATTEMPTS:
+            self.status = self.FAILED
+        else:
+            self.status = self.PENDING
+            self.run_after = now + self.RETRY_DELAY * 2 ** max(self.attempts - 1, 0)
+        self.save(update_fields=['status', 'error', 'run_after'])
+
+
+class BookingReminder(models.Model):
+    """
+    Records that a reminder email has been queued for a booking, so manage.py send_booking_reminders sends each one once
+    """
+    STARTING = 'Starting'
+    ENDING = 'Ending'
+    KINDS = (
+        (STARTING, STARTING),
+        (ENDING, ENDING),
+    )
+    # Email template for each kind of reminder, and how long before the booking starts or ends it is sent
+    TEMPLATES = {
+        STARTING: 'Booking Starting',
+        ENDING: 'Booking Ending',
+    }
+    LEAD_TIMES = {
+        STARTING: dt.timedelta(hours=1),
+        ENDING: dt.timedelta(minutes=30),
+    }
+
+    booking = models.ForeignKey(Booking, related_name='reminders')
+    kind = models.CharField(max_length=10, choices=KINDS)
+    # The start or end time the reminder was for. An extended booking gets another ending reminder.
+    time = models.DateTimeField()
+    sent = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = ('booking', 'kind', 'time')
+
+    def __str__(self):
+        return '{0} - Booking {1} ({2})'.format(self.id, self.booking_id, self.kind)
+
+
+class SiteStatistics(models.Model):
+    """
+    Running totals shown on the About Us page, so it doesn't need to count and price every booking ever made.
+    Counts are kept up to date by signals, and bookings are added to completed_cost as they complete. If the totals
+    drift (e.g. rates change), run manage.py rebuild_site_statistics.
+    """
+    num_vehicles = models.IntegerField(default=0)
+    num_pods = models.IntegerField(default=0)
+    num_bookings = models.IntegerField(default=0)
+    # Total cost of all bookings that ended before completed_until
+    completed_cost = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    completed_until = models.DateTimeField()
+
+    # Newly completed bookings are added at most this often
+    CATCH_UP_INTERVAL = dt.timedelta(minutes=15)
+
+    class Meta:
+        verbose_name_plural = 'site statistics'
+
+    @classmethod
+    def get(cls, now=None):
+        """
+        Returns the statistics, building them first if they don't exist yet
+        """
+        if now is None:
+            now = timezone.now()
+        stats = cls.objects.filter(pk=1).first()
+        if stats is None:
+            return cls.rebuild(now)
+        if stats.completed_until < now - cls.CATCH_UP_INTERVAL:
+            stats.catch_up(now)
+        return stats
+
+    @classmethod
+    def rebuild(cls, now=None):
+        """
+        Recalculates the statistics from scratch
+        """
+        if now is None:
+            now = timezone.now()
+        stats, _ = cls.objects.update_or_create(pk=1, defaults={
+            'num_vehicles': Vehicle.objects.count(),
+            'num_pods': Pod.objects.count(),
+            'num_bookings': Booking.objects.count(),
+            'completed_cost': total_cost(Booking.objects.filter(schedule_end__lt=now)),
+            'completed_until': now,
+        })
+        return stats
+
+    def catch_up(self, now):
+        """
+        Adds the cost of bookings that have completed since the last catch up
+        """
+        cost = total_cost(Booking.objects.filter(schedule_end__gte=self.completed_until, schedule_end__lt=now))
+        # Only move on from the window we priced, in case another process has already caught up
+        updated = SiteStatistics.objects.filter(pk=self.pk, completed_until=self.completed_until).update(
+            completed_cost=F('completed_cost') + cost, completed_until=now
+        )
+        if updated:
+            self.completed_cost += cost
+            self.completed_until = now
+        else:
+            self.refresh_from_db()
+
+    @classmethod
+    def add(cls, **amounts):
+        """
+        Adds to the counts, e.g. add(num_vehicles=1)
+        """
+        cls.objects.filter(pk=1).update(**{field: F(field) + amount for field, amount in amounts.items()})
+
+    @classmethod
+    def add_completed_cost(cls, schedule_end, cost):
+        """
+        Adds to completed_cost for a booking ending at schedule_end, if completed bookings up to then were counted
+        """
+        cls.objects.filter(pk=1, completed_until__gt=schedule_end).update(completed_cost=F('completed_cost') + cost)
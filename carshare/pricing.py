@@ -0,0 +1,155 @@
+#
+#   Author(s): Huon Imberger
+#   Description: Booking cost calculations, for single bookings or whole querysets at once
+#
+
+from decimal import Decimal, ROUND_HALF_UP
+
+from .cache import ProcessLocalCache
+
+
+SECONDS_PER_HOUR = 60 * 60
+SECONDS_PER_DAY = 24 * SECONDS_PER_HOUR
+
+
+def _build_vehicle_types():
+    from .models import VehicleType
+    return {vehicle_type.id: vehicle_type for vehicle_type in VehicleType.objects.all()}
+
+
+# Every vehicle type (there are only a handful), keyed by id. Rebuilt (in every process) after a type is saved or
+# deleted. The instances are shared, so treat them as read-only.
+vehicle_types = ProcessLocalCache('carshare:vehicle_types_version', _build_vehicle_types)
+
+
+def get_vehicle_type(type_id):
+    """
+    Looks up a vehicle type (and so its rates) without a query
+    :raises KeyError: if there is no such type
+    """
+    try:
+        return vehicle_types.get()[type_id]
+    except KeyError:
+        # Possibly created while the table was being built, before the new version was seen
+        return vehicle_types.reload()[type_id]
+
+
+def to_cents(amount):
+    """
+    Converts a dollar amount (Decimal, or float/int) to a whole number of cents
+    """
+    if not isinstance(amount, Decimal):
+        amount = Decimal(str(amount))
+    return int((amount * 100).to_integral_value(ROUND_HALF_UP))
+
+
+def from_cents(cents):
+    return Decimal(cents).scaleb(-2)
+
+
+def length_days_hours(length):
+    """
+    Splits a length (timedelta) into whole days and hours, with part hours rounded up. The cost of a booking only
+    depends on these.
+    :return: tuple
+    """
+    # Whole seconds, like timedelta.days and timedelta.seconds
+    seconds = length.days * SECONDS_PER_DAY + length.seconds
+    # Days are truncated towards zero, and hours are always taken from the positive remainder
+    days = seconds // SECONDS_PER_DAY if seconds >= 0 else -(-seconds // SECONDS_PER_DAY)
+    hours = -(-(seconds % SECONDS_PER_DAY) // SECONDS_PER_HOUR)
+    return days, hours
+
+
+def billable_days_hours(length, hourly_cents, daily_cents):
+    """
+    Calculates the number of days and hours billed for a booking of the given length (timedelta). Part hours are
+    rounded up, and once the hours would cost as much as a day, a day is billed instead.
+    :return: tuple
+    """
+    days, hours = length_days_hours(length)
+    if hours * hourly_cents >= daily_cents:
+        days += 1
+        hours = 0
+    return days, hours
+
+
+def cost_cents(length, hourly_cents, daily_cents):
+    """
+    Calculates the cost in cents of a booking of the given length (timedelta)
+    """
+    days, hours = billable_days_hours(length, hourly_cents, daily_cents)
+    return days * daily_cents + min(hours * hourly_cents, daily_cents)
+
+
+def cost(length, hourly_rate, daily_rate):
+    """
+    Calculates the exact cost of a booking of the given length (timedelta) at the given rates
+    :return: Decimal
+    """
+    return from_cents(cost_cents(length, to_cents(hourly_rate), to_cents(daily_rate)))
+
+
+def quote(length, hourly_rate, daily_rate):
+    """
+    Calculates the billable days and hours and the exact cost of a booking of the given length (timedelta)
+    :return: tuple of (days, hours, Decimal cost)
+    """
+    hourly_cents, daily_cents = to_cents(hourly_rate), to_cents(daily_rate)
+    days, hours = billable_days_hours(length, hourly_cents, daily_cents)
+    return days, hours, from_cents(days * daily_cents + min(hours * hourly_cents, daily_cents))
+
+
+# Quotes from quote_vehicle_type(), keyed by (type id, days, hours), and the vehicle types they were worked out from.
+# Emptied when the vehicle types are rebuilt, so rate changes are quoted straight away.
+_quotes = {}
+_quoted_types = None
+QUOTE_MEMO_SIZE = 10000
+
+
+def quote_vehicle_type(type_id, length):
+    """
+    Quotes a booking of the given length (timedelta) at a vehicle type's rates, like quote(). Quotes are remembered
+    by type and length in days and hours, as the booking form asks for the same few over and over.
+    :return: tuple of (days, hours, Decimal cost)
+    :raises KeyError: if there is no such type
+    """
+    global _quotes, _quoted_types
+    types = vehicle_types.get()
+    if types is not _quoted_types or len(_quotes) >= QUOTE_MEMO_SIZE:
+        _quotes, _quoted_types = {}, types
+    key = (type_id,) + length_days_hours(length)
+    if key not in _quotes:
+        vehicle_type = get_vehicle_type(type_id)
+        _quotes[key] = quote(length, vehicle_type.hourly_rate, vehicle_type.daily_rate)
+    return _quotes[key]
+
+
+def booking_costs(bookings):
+    """
+    Calculates the cost of every booking in a queryset, fetching only the stored costs, times and vehicle types in a
+    single query. Bookings with a stored cost (see Booking.quote()) use it, and the rest are priced at their vehicle's
+    rates.
+    :return: dict of booking id -> Decimal cost
+    """
+    rows = bookings.values_list('id', 'quoted_cost', 'schedule_start', 'schedule_end', 'vehicle__type_id')
+    # Most bookings share a handful of vehicle types, so only convert each type's rates once
+    cents = {}
+    costs = {}
+    for booking_id, quoted_cost, start, end, type_id in rows.iterator():
+        if quoted_cost is not None:
+            costs[booking_id] = quoted_cost
+            continue
+        if type_id not in cents:
+            vehicle_type = get_vehicle_type(type_id)
+            cents[type_id] = (to_cents(vehicle_type.hourly_rate), to_cents(vehicle_type.daily_rate))
+        costs[booking_id] = cost_cents(end - start, *cents[type_id])
+    return {booking_id: from_cents(cost) for booking_id, cost in costs.items()}
+
+
+def total_cost(bookings):
+    """
+    Calculates the total cost of all bookings in a queryset, in a single query
+    :return: Decimal
+    """
+    return sum(booking_costs(bookings).values(), Decimal('0.00'))
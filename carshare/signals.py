@@ -0,0 +1,115 @@
+#
+#   Author(s): Huon Imberger
+#   Description: Signal handlers for keeping cached data and statistics up to date
+#
+
+from django.db import DatabaseError, transaction
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+import logging
+
+from .availability import invalidate_bitmaps
+from .models import Pod, Vehicle, VehicleType, Booking, SiteStatistics
+from .pricing import cost, from_cents, get_vehicle_type, vehicle_types
+from .spatial import pod_tree
+
+
+logger = logging.getLogger(__name__)
+
+
+@receiver([post_save, post_delete], sender=Pod)
+def pod_changed(sender, **kwargs):
+    pod_tree.invalidate()
+
+
+@receiver([post_save, post_delete], sender=VehicleType)
+def vehicle_type_changed(sender, **kwargs):
+    vehicle_types.invalidate()
+
+
+@receiver(post_init, sender=Booking)
+def booking_loaded(sender, instance, **kwargs):
+    # Remember where the booking was, so moving it also clears the days it used to cover
+    instance._cached_schedule = (instance.vehicle_id, instance.schedule_start, instance.schedule_end)
+    instance._cached_quoted_cost = instance.quoted_cost
+
+
+@receiver(post_save, sender=Booking)
+def booking_saved(sender, instance, **kwargs):
+    """
+    Clears the cached availability for the days a booking covers (including when it is cancelled or extended), and
+    updates the site statistics if a completed booking changed.
+    Bookings changed with QuerySet.update() or bulk_create() don't send signals, so aren't cleared.
+    """
+    old_schedule = instance._cached_schedule
+    new_schedule = (instance.vehicle_id, instance.schedule_start, instance.schedule_end)
+    old_quoted_cost = instance._cached_quoted_cost
+    if None not in old_schedule:
+        invalidate_bitmaps(*old_schedule)
+    invalidate_bitmaps(*new_schedule)
+    if old_schedule != new_schedule or kwargs['created']:
+        now = timezone.now()
+        if None not in old_schedule and old_schedule[2] < now and not kwargs['created']:
+            update_statistics(lambda: SiteStatistics.add_completed_cost(
+                old_schedule[2], -booking_cost(*old_schedule, quoted_cost=old_quoted_cost)
+            ))
+        if instance.schedule_end < now:
+            new_quoted_cost = instance.quoted_cost
+            update_statistics(lambda: SiteStatistics.add_completed_cost(
+                new_schedule[2], booking_cost(*new_schedule, quoted_cost=new_quoted_cost)
+            ))
+    booking_loaded(sender, instance)
+
+
+@receiver(post_delete, sender=Booking)
+def booking_deleted(sender, instance, **kwargs):
+    invalidate_bitmaps(instance.vehicle_id, instance.schedule_start, instance.schedule_end)
+    if instance.schedule_end < timezone.now():
+        schedule = (instance.vehicle_id, instance.schedule_start, instance.schedule_end)
+        quoted_cost = instance.quoted_cost
+        update_statistics(lambda: SiteStatistics.add_completed_cost(
+            schedule[2], -booking_cost(*schedule, quoted_cost=quoted_cost)
+        ))
+
+
+def booking_cost(vehicle_id, start, end, quoted_cost=None):
+    # Bookings are charged what they were quoted, if they were quoted
+    if quoted_cost is not None:
+        return from_cents(quoted_cost)
+    vehicle_type = get_vehicle_type(Vehicle.objects.values_list('type_id', flat=True).get(pk=vehicle_id))
+    return cost(end - start, vehicle_type.hourly_rate, vehicle_type.daily_rate)
+
+
+def update_statistics(update):
+    """
+    Runs a site statistics update once the current transaction commits, so booking transactions don't all queue up
+    on the statistics row. The statistics can be rebuilt, so a failed update is logged rather than raised.
+    """
+    def run():
+        try:
+            update()
+        except (DatabaseError, Vehicle.DoesNotExist, KeyError):
+            logger.exception('Failed to update site statistics')
+    transaction.on_commit(run)
+
+
+# Site statistics field counting each model
+COUNTED_MODELS = {
+    Vehicle: 'num_vehicles',
+    Pod: 'num_pods',
+    Booking: 'num_bookings',
+}
+
+
+@receiver(post_save)
+def count_created(sender, instance, created, **kwargs):
+    if created and sender in COUNTED_MODELS:
+        update_statistics(lambda: SiteStatistics.add(**{COUNTED_MODELS[sender]: 1}))
+
+
+@receiver(post_delete)
+def count_deleted(sender, instance, **kwargs):
+    if sender in COUNTED_MODELS:
+        update_statistics(lambda: SiteStatistics.add(**{COUNTED_MODELS[sender]: -1}))
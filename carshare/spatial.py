@@ -0,0 +1,132 @@
+#
+#   Author(s): Huon Imberger
+#   Description: Spatial lookups for finding pods near a location
+#
+
+from heapq import heappush, heappushpop
+from math import asin, cos, pi, radians, sin, sqrt
+
+from .cache import ProcessLocalCache
+
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def to_unit_vector(latitude, longitude):
+    """
+    Converts a latitude/longitude to a point on the unit sphere. Straight line distance between these points
+    increases with distance along the earth's surface, so they can be indexed with an ordinary k-d tree.
+    """
+    lat, lng = radians(float(latitude)), radians(float(longitude))
+    return cos(lat) * cos(lng), cos(lat) * sin(lng), sin(lat)
+
+
+def chord_to_km(chord):
+    return 2 * EARTH_RADIUS_KM * asin(min(1.0, chord / 2))
+
+
+def km_to_chord(km):
+    return 2 * sin(min(km / EARTH_RADIUS_KM, pi) / 2)
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """
+    Great circle distance between two points, in kilometres
+    """
+    lat1, lng1, lat2, lng2 = map(radians, map(float, (lat1, lng1, lat2, lng2)))
+    a = sin((lat2 - lat1) / 2) ** 2 + cos(lat1) * cos(lat2) * sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * asin(sqrt(a))
+
+
+class PodTree(object):
+    """
+    In-memory k-d tree of pod locations
+    """
+    def __init__(self, pods):
+        """
+        :param pods: (pod_id, latitude, longitude) tuples
+        """
+        points = [(to_unit_vector(lat, lng), pod_id) for pod_id, lat, lng in pods]
+        self._size = len(points)
+        self._root = self._build(points, 0)
+
+    def __len__(self):
+        return self._size
+
+    def _build(self, points, depth):
+        if not points:
+            return None
+        axis = depth % 3
+        points.sort(key=lambda p: p[0][axis])
+        median = len(points) // 2
+        point, pod_id = points[median]
+        return (
+            point, pod_id, axis,
+            self._build(points[:median], depth + 1),
+            self._build(points[median + 1:], depth + 1),
+        )
+
+    @staticmethod
+    def _distance(a, b):
+        return sqrt((a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2 + (a[2] - b[2]) ** 2)
+
+    def nearest(self, latitude, longitude, k):
+        """
+        Returns the k nearest pods as (distance_km, pod_id) tuples, nearest first
+        """
+        target = to_unit_vector(latitude, longitude)
+        # Max-heap (by negated distance) of the best k found so far
+        best = []
+
+        def search(node):
+            if node is None:
+                return
+            point, pod_id, axis, left, right = node
+            distance = self._distance(point, target)
+            if len(best) < k:
+                heappush(best, (-distance, pod_id))
+            elif distance < -best[0][0]:
+                heappushpop(best, (-distance, pod_id))
+            diff = target[axis] - point[axis]
+            near, far = (left, right) if diff < 0 else (right, left)
+            search(near)
+            # Only cross the splitting plane if something closer could be on the other side
+            if len(best) < k or abs(diff) < -best[0][0]:
+                search(far)
+
+        if k > 0:
+            search(self._root)
+        return sorted((chord_to_km(-distance), pod_id) for distance, pod_id in best)
+
+    def within_radius(self, latitude, longitude, radius_km):
+        """
+        Returns all pods within the radius as (distance_km, pod_id) tuples, nearest first
+        """
+        target = to_unit_vector(latitude, longitude)
+        radius = km_to_chord(radius_km)
+        found = []
+
+        def search(node):
+            if node is None:
+                return
+            point, pod_id, axis, left, right = node
+            distance = self._distance(point, target)
+            if distance <= radius:
+                found.append((chord_to_km(distance), pod_id))
+            diff = target[axis] - point[axis]
+            if diff - radius <= 0:
+                search(left)
+            if diff + radius >= 0:
+                search(right)
+
+        search(self._root)
+        return sorted(found)
+
+
+def _build_pod_tree():
+    from .models import Pod
+    return PodTree(Pod.objects.values_list('id', 'latitude', 'longitude'))
+
+
+# Tree of all pods, rebuilt (in every process) after a pod is saved or deleted
+pod_tree = ProcessLocalCache('carshare:pod_tree_version', _build_pod_tree)
@@ -0,0 +1,252 @@
+from django.core.cache import caches
+from django.test import TestCase
+from django.utils import timezone
+
+import datetime as dt
+
+from ..availability import build_day_timeline, find_free_slots, get_bitmaps
+from ..models import Booking, User, Vehicle, Pod, VehicleType
+
+
+def at(hour, day=1):
+    return timezone.make_aware(dt.datetime(year=2999, month=1, day=day, hour=hour))
+
+
+class CarshareVehicleAvailabilityTests(TestCase):
+    def setUp(self):
+        vt = VehicleType.objects.create(description='Premium', hourly_rate=12.50, daily_rate=80.00)
+        p1 = Pod.objects.create(latitude='-39.34523453', longitude='139.53524344', description='Pod 1')
+        self.v1 = Vehicle.objects.create(pod=p1, type=vt, name='Vehicle1', make='Toyota', model='Yaris', year=2012,
+                                         registration='AAA222')
+        self.u1 = User.objects.create(email='test1@test.com', first_name='John', last_name='Doe',
+                                      date_of_birth='1980-01-01')
+        # 1 AM - 3 AM, 5 AM - 6 AM, and a cancelled booking 7 AM - 9 AM
+        self.b1 = self.create_booking(at(1), at(3))
+        self.b2 = self.create_booking(at(5), at(6))
+        self.b3 = self.create_booking(at(7), at(9), cancelled=timezone.now())
+
+    def create_booking(self, start, end, cancelled=None):
+        return Booking.objects.create(user=self.u1, vehicle=self.v1, schedule_start=start, schedule_end=end,
+                                      cancelled=cancelled)
+
+    def test_booking_at(self):
+        """
+        Returns the booking holding the vehicle, treating the end time as exclusive
+        """
+        self.assertIsNone(self.v1.get_booking_at(at(0)))
+        self.assertEqual(self.v1.get_booking_at(at(1)), self.b1)
+        self.assertEqual(self.v1.get_booking_at(at(2)), self.b1)
+        self.assertIsNone(self.v1.get_booking_at(at(3)))
+        self.assertEqual(self.v1.get_booking_at(at(5)), self.b2)
+
+    def test_cancelled_bookings_ignored(self):
+        """
+        Cancelled bookings never make the vehicle unavailable
+        """
+        self.assertTrue(self.v1.is_available_at(at(8)))
+        self.assertIsNone(self.v1.get_booking_at(at(7)))
+
+    def test_overlapping_bookings(self):
+        """
+        Bookings overlapping a long booking are still found
+        """
+        long_booking = self.create_booking(at(0), at(10))
+        self.assertEqual(self.v1.get_booking_at(at(4)), long_booking)
+        self.assertEqual(self.v1.get_booking_at(at(5)), long_booking)
+
+    def test_new_bookings_seen(self):
+        """
+        Availability is checked in the database each time, so a booking made after an earlier check is seen
+        """
+        self.assertTrue(self.v1.is_available_at(at(4)))
+        with self.assertNumQueries(1):
+            self.assertTrue(self.v1.is_available_at(at(12)))
+        self.create_booking(at(3), at(5))
+        self.assertFalse(self.v1.is_available_at(at(4)))
+
+
+class CarshareDayTimelineTests(TestCase):
+    def setUp(self):
+        caches['availability'].clear()
+        vt = VehicleType.objects.create(description='Premium', hourly_rate=12.50, daily_rate=80.00)
+        p1 = Pod.objects.create(latitude='-39.34523453', longitude='139.53524344', description='Pod 1')
+        self.v1 = Vehicle.objects.create(pod=p1, type=vt, name='Vehicle1', make='Toyota', model='Yaris', year=2012,
+                                         registration='AAA222')
+        self.u1 = User.objects.create(email='test1@test.com', first_name='John', last_name='Doe',
+                                      date_of_birth='1980-01-01')
+        self.u2 = User.objects.create(email='test2@test.com', first_name='Jane', last_name='Doly',
+                                      date_of_birth='1988-01-01')
+        self.now = timezone.make_aware(dt.datetime(year=2030, month=1, day=1))
+
+    def create_booking(self, user, start, end):
+        return Booking.objects.create(user=user, vehicle=self.v1, schedule_start=timezone.make_aware(start),
+                                      schedule_end=timezone.make_aware(end))
+
+    def test_day_grid(self):
+        """
+        Grid distinguishes free hours, the user's own bookings, and other users' bookings
+        """
+        day = dt.date(2030, 3, 1)
+        # Booking running over from the previous day
+        self.create_booking(self.u2, dt.datetime(2030, 2, 28, 22), dt.datetime(2030, 3, 1, 2))
+        self.create_booking(self.u1, dt.datetime(2030, 3, 1, 10), dt.datetime(2030, 3, 1, 12))
+        # Day's bitmap (read from the cache, built, and cached), then the user's own bookings
+        with self.assertNumQueries(4):
+            hours = build_day_timeline(self.v1, day, self.u1, now=self.now)
+        with self.assertNumQueries(2):
+            self.assertEqual(build_day_timeline(self.v1, day, self.u1, now=self.now), hours)
+        self.assertEqual(list(hours.keys()), list(range(0, 24)))
+        self.assertEqual(hours[0], 'unavailable')
+        self.assertEqual(hours[1], 'unavailable')
+        self.assertEqual(hours[2], 'available')
+        self.assertEqual(hours[10], 'booked_by_user')
+        self.assertEqual(hours[11], 'booked_by_user')
+        self.assertEqual(hours[12], 'available')
+
+    def test_past_hours_unavailable(self):
+        """
+        Hours more than an hour in the past can't be booked
+        """
+        now = timezone.make_aware(dt.datetime(2030, 3, 1, 12, 30))
+        hours = build_day_timeline(self.v1, dt.date(2030, 3, 1), self.u1, now=now)
+        self.assertEqual(hours[10], 'unavailable')
+        self.assertEqual(hours[11], 'unavailable')
+        self.assertEqual(hours[12], 'available')
+
+    def test_start_of_daylight_saving(self):
+        """
+        The hour skipped when daylight saving starts is never bookable
+        """
+        # Melbourne clocks go from 2 AM to 3 AM on the first Sunday of October
+        hours = build_day_timeline(self.v1, dt.date(2030, 10, 6), self.u1, now=self.now)
+        self.assertEqual(len(hours), 24)
+        self.assertEqual(hours[1], 'available')
+        self.assertEqual(hours[2], 'unavailable')
+        self.assertEqual(hours[3], 'available')
+
+    def test_end_of_daylight_saving(self):
+        """
+        Bookings during the repeated hour when daylight saving ends are shown
+        """
+        # Melbourne clocks go from 3 AM back to 2 AM on the first Sunday of April
+        start = timezone.make_aware(dt.datetime(2030, 4, 7, 1))
+        Booking.objects.create(user=self.u2, vehicle=self.v1, schedule_start=start,
+                               schedule_end=start + dt.timedelta(hours=3))
+        hours = build_day_timeline(self.v1, dt.date(2030, 4, 7), self.u1, now=self.now)
+        self.assertEqual(hours[1], 'unavailable')
+        self.assertEqual(hours[2], 'unavailable')
+        self.assertEqual(hours[3], 'available')
+
+
+class CarshareFreeSlotTests(TestCase):
+    def setUp(self):
+        vt = VehicleType.objects.create(description='Premium', hourly_rate=12.50, daily_rate=80.00)
+        p1 = Pod.objects.create(latitude='-39.34523453', longitude='139.53524344', description='Pod 1')
+        self.v1 = Vehicle.objects.create(pod=p1, type=vt, name='Vehicle1', make='Toyota', model='Yaris', year=2012,
+                                         registration='AAA222')
+        self.u1 = User.objects.create(email='test1@test.com', first_name='John', last_name='Doe',
+                                      date_of_birth='1980-01-01')
+        # Booked 1 AM - 3 AM, 4 AM - 5 AM, 8 AM - 9 AM, and a cancelled booking 5 AM - 8 AM
+        for start, end, cancelled in ((1, 3, None), (4, 5, None), (8, 9, None), (5, 8, timezone.now())):
+            Booking.objects.create(user=self.u1, vehicle=self.v1, schedule_start=at(start), schedule_end=at(end),
+                                   cancelled=cancelled)
+
+    def test_sweep(self):
+        """
+        Gaps shorter than the requested length are skipped
+        """
+        bookings = [(at(1), at(3)), (at(4), at(5)), (at(8), at(9))]
+        slots = find_free_slots(bookings, at(0), at(12), dt.timedelta(hours=2), count=5)
+        self.assertEqual(slots, [(at(5), at(8)), (at(9), at(12))])
+
+    def test_sweep_count(self):
+        """
+        Sweep stops once enough gaps are found
+        """
+        bookings = [(at(1), at(3)), (at(4), at(5)), (at(8), at(9))]
+        slots = find_free_slots(bookings, at(0), at(12), dt.timedelta(hours=1), count=2)
+        self.assertEqual(slots, [(at(0), at(1)), (at(3), at(4))])
+
+    def test_vehicle_free_slots(self):
+        """
+        Vehicle free slots ignore cancelled bookings, and run to the maximum booking length ahead
+        """
+        with self.assertNumQueries(1):
+            slots = self.v1.get_free_slots(dt.timedelta(hours=2), count=3, start=at(2))
+        horizon = at(2) + dt.timedelta(days=Booking.MAX_LENGTH_DAYS)
+        self.assertEqual(slots, [(at(5), at(8)), (at(9), horizon)])
+
+
+class CarshareAvailabilityBitmapTests(TestCase):
+    def setUp(self):
+        caches['availability'].clear()
+        vt = VehicleType.objects.create(description='Premium', hourly_rate=12.50, daily_rate=80.00)
+        p1 = Pod.objects.create(latitude='-39.34523453', longitude='139.53524344', description='Pod 1')
+        self.v1 = Vehicle.objects.create(pod=p1, type=vt, name='Vehicle1', make='Toyota', model='Yaris', year=2012,
+                                         registration='AAA222')
+        p2 = Pod.objects.create(latitude='-39.34523453', longitude='139.53524344', description='Pod 2')
+        self.v2 = Vehicle.objects.create(pod=p2, type=vt, name='Vehicle2', make='Toyota', model='Yaris', year=2012,
+                                         registration='AAA223')
+        self.u1 = User.objects.create(email='test1@test.com', first_name='John', last_name='Doe',
+                                      date_of_birth='1980-01-01')
+        self.day1 = dt.date(2999, 1, 1)
+        self.day2 = dt.date(2999, 1, 2)
+        # 10 PM on day 1 until 2 AM on day 2
+        self.booking = Booking.objects.create(user=self.u1, vehicle=self.v1, schedule_start=at(22),
+                                              schedule_end=at(2, day=2))
+
+    def bitmap(self, vehicle, date):
+        return get_bitmaps([vehicle.id], [date])[(vehicle.id, date)]
+
+    def test_bitmaps(self):
+        """
+        Bitmaps mark the hours of each day covered by a booking, and are built in one query then cached. Reading and
+        writing the cache take one query each, however many bitmaps there are.
+        """
+        with self.assertNumQueries(3):
+            bitmaps = get_bitmaps([self.v1.id, self.v2.id], [self.day1, self.day2])
+        self.assertEqual(bitmaps, {
+            (self.v1.id, self.day1): 0b11 << 22,
+            (self.v1.id, self.day2): 0b11,
+            (self.v2.id, self.day1): 0,
+            (self.v2.id, self.day2): 0,
+        })
+        with self.assertNumQueries(1):
+            self.assertEqual(get_bitmaps([self.v1.id, self.v2.id], [self.day1, self.day2]), bitmaps)
+
+    def test_partly_booked_hour(self):
+        """
+        An hour only partly covered by a booking is marked as booked
+        """
+        Booking.objects.create(user=self.u1, vehicle=self.v2, schedule_start=at(9) + dt.timedelta(minutes=30),
+                               schedule_end=at(10) + dt.timedelta(minutes=15))
+        self.assertEqual(self.bitmap(self.v2, self.day1), 0b11 << 9)
+
+    def test_saved_booking_clears_cache(self):
+        """
+        Creating, extending, cancelling and deleting bookings all update the cached bitmaps
+        """
+        self.assertEqual(self.bitmap(self.v2, self.day1), 0)
+        booking = Booking.objects.create(user=self.u1, vehicle=self.v2, schedule_start=at(9), schedule_end=at(10))
+        self.assertEqual(self.bitmap(self.v2, self.day1), 1 << 9)
+        booking.schedule_end = at(1, day=2)
+        booking.save()
+        self.assertEqual(self.bitmap(self.v2, self.day2), 1)
+        booking.cancelled = timezone.now()
+        booking.save()
+        self.assertEqual(self.bitmap(self.v2, self.day1), 0)
+        self.assertEqual(self.bitmap(self.v2, self.day2), 0)
+        self.booking.delete()
+        self.assertEqual(self.bitmap(self.v1, self.day1), 0)
+
+    def test_moved_booking_clears_old_days(self):
+        """
+        Moving a booking to another vehicle or day also clears the days it used to cover
+        """
+        self.assertEqual(self.bitmap(self.v1, self.day1), 0b11 << 22)
+        booking = Booking.objects.get(pk=self.booking.pk)
+        booking.vehicle = self.v2
+        booking.schedule_start, booking.schedule_end = at(5, day=3), at(6, day=3)
+        booking.save()
+        self.assertEqual(self.bitmap(self.v1, self.day1), 0)
+        self.assertEqual(self.bitmap(self.v1, self.day2), 0)
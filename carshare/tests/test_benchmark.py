@@ -0,0 +1,48 @@
+from django.core.management import call_command
+from django.test import TestCase
+
+from io import StringIO
+import json
+
+from accounts.models import User
+from ..management.commands.bench import percentile
+from ..models import Booking, Invoice, Pod, SiteStatistics, Vehicle
+
+
+class CarshareBenchmarkTests(TestCase):
+
+    def test_seed_and_bench(self):
+        """
+        seed_benchmark creates a (small) fleet with booking history, and bench reports on it as JSON
+        """
+        call_command('seed_benchmark', pods=30, vehicles=20, users=50, bookings=400, batch_size=100,
+                     stdout=StringIO())
+        self.assertEqual((Pod.objects.count(), Vehicle.objects.count(), User.objects.count()), (30, 20, 50))
+        # Roughly the number asked for (some are dropped where they would start with another booking)
+        self.assertGreater(Booking.objects.count(), 350)
+        self.assertLessEqual(Booking.objects.count(), 400)
+        for vehicle in Vehicle.objects.all():
+            bookings = list(vehicle.booking_set.order_by('schedule_start'))
+            for booking, next_booking in zip(bookings, bookings[1:]):
+                self.assertLessEqual(booking.schedule_end, next_booking.schedule_start)
+        self.assertTrue(Invoice.objects.exists())
+        self.assertEqual(SiteStatistics.objects.get().num_bookings, Booking.objects.count())
+
+        out = StringIO()
+        call_command('bench', iterations=2, warmup=0, stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['rows']['bookings'], Booking.objects.count())
+        self.assertIn('view:my_bookings', report['results'])
+        result = report['results']['view:find_a_car']
+        self.assertLessEqual(result['p50_ms'], result['p95_ms'])
+        self.assertGreater(result['queries_max'], 0)
+
+    def test_percentile(self):
+        """
+        Percentiles use the nearest rank
+        """
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 0.5), 50)
+        self.assertEqual(percentile(values, 0.95), 95)
+        self.assertEqual(percentile([3], 0.95), 3)
+        self.assertEqual(percentile([2, 1], 0.5), 1)
@@ -0,0 +1,82 @@
+from django.core.cache import cache, caches
+from django.test import TestCase, override_settings
+
+from unittest import mock
+
+from ..cache import ProcessLocalCache
+
+
+class CarshareBulkDatabaseCacheTests(TestCase):
+    def setUp(self):
+        self.cache = caches['availability']
+        self.cache.clear()
+
+    def test_many_keys_in_one_query(self):
+        """
+        Reading, writing and deleting many keys takes a single query for the keys
+        """
+        with self.assertNumQueries(1):
+            self.assertEqual(self.cache.get_many(['a', 'b']), {})
+        data = {str(i): i for i in range(500)}
+        self.cache.set_many(data)
+        with self.assertNumQueries(2):
+            # More keys than fit in one query are split
+            self.assertEqual(self.cache.get_many(list(data) + ['missing']), data)
+        with self.assertNumQueries(1):
+            self.cache.delete_many(['1', '2'])
+        self.assertEqual(self.cache.get_many(['0', '1', '2']), {'0': 0})
+
+    def test_set_many_replaces(self):
+        self.cache.set_many({'a': 1, 'b': 2})
+        self.cache.set_many({'b': 3, 'c': 4})
+        self.assertEqual(self.cache.get_many(['a', 'b', 'c']), {'a': 1, 'b': 3, 'c': 4})
+        self.assertEqual(self.cache.get('b'), 3)
+
+    def test_expired(self):
+        """
+        Expired entries aren't returned, and are culled by the read that finds them
+        """
+        self.cache.set_many({'a': 1}, timeout=-1)
+        self.cache.set('b', 2)
+        self.assertEqual(self.cache.get_many(['a', 'b']), {'b': 2})
+        with self.assertNumQueries(1):
+            self.assertEqual(self.cache.get_many(['a', 'b']), {'b': 2})
+
+
+@override_settings(PROCESS_LOCAL_CACHE_CHECK_INTERVAL=1)
+class CarshareProcessLocalCacheTests(TestCase):
+    def setUp(self):
+        cache.delete('test:version')
+        self.builds = 0
+
+    def build(self):
+        self.builds += 1
+        return self.builds
+
+    def test_invalidated_by_other_process(self):
+        """
+        Invalidating the value in one process makes another process rebuild it once its check interval has passed
+        """
+        first = ProcessLocalCache('test:version', self.build)
+        second = ProcessLocalCache('test:version', self.build)
+        with mock.patch('carshare.cache.time.monotonic', return_value=100):
+            self.assertEqual(first.get(), 1)
+            self.assertEqual(second.get(), 2)
+            first.invalidate()
+            self.assertEqual(first.get(), 3)
+            # Checked too recently
+            self.assertEqual(second.get(), 2)
+        with mock.patch('carshare.cache.time.monotonic', return_value=101):
+            self.assertEqual(second.get(), 4)
+            self.assertEqual(first.get(), 3)
+
+    def test_version_checked_once_per_interval(self):
+        """
+        The shared cache isn't read again until the check interval has passed
+        """
+        local = ProcessLocalCache('test:version', self.build)
+        with mock.patch('carshare.cache.time.monotonic', return_value=100):
+            local.get()
+            with mock.patch('carshare.cache.cache.get') as get:
+                local.get()
+        self.assertFalse(get.called)
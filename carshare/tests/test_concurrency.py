@@ -0,0 +1,141 @@
+from django.core.mail import EmailMessage
+from django.db import OperationalError, connection, models
+from django.test import TransactionTestCase
+from django.utils import timezone
+
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+import datetime as dt
+import logging
+import time
+
+from ..managers import BookingUnavailable
+from ..models import Booking, User, Vehicle, Pod, VehicleType
+from emails.models import OutboxEmail
+from emails.utils import queue_email
+
+
+logger = logging.getLogger(__name__)
+
+
+class CarshareConcurrentBookingTests(TransactionTestCase):
+    """
+    Stress tests for the booking commit path. These run real transactions on separate connections, so they use
+    TransactionTestCase rather than TestCase.
+    """
+    ATTEMPTS = 200
+    THREADS = 16
+
+    def setUp(self):
+        vt = VehicleType.objects.create(description='Premium', hourly_rate=12.50, daily_rate=80.00)
+        p1 = Pod.objects.create(latitude='-39.34523453', longitude='139.53524344', description='Pod 1')
+        self.v1 = Vehicle.objects.create(pod=p1, type=vt, name='Vehicle1', make='Toyota', model='Yaris', year=2012,
+                                         registration='AAA222')
+        User.objects.bulk_create([
+            User(email='user{0}@test.com'.format(i), first_name='Test', last_name='User',
+                 date_of_birth=dt.date(1980, 1, 1))
+            for i in range(self.ATTEMPTS)
+        ])
+        self.users = list(User.objects.all())
+        self.start = timezone.make_aware(dt.datetime(year=2999, month=1, day=1, hour=10))
+        self.end = timezone.make_aware(dt.datetime(year=2999, month=1, day=1, hour=12))
+
+    @staticmethod
+    def slow_save(booking, *args, **kwargs):
+        """
+        Widens the window between the overlap checks and the insert, so that unserialised writers would collide
+        """
+        time.sleep(0.002)
+        return models.Model.save(booking, *args, **kwargs)
+
+    def confirm(self, user, offset_hours=0):
+        """
+        Tries to book the vehicle for the user, on this thread's own database connection
+        """
+        offset = dt.timedelta(hours=offset_hours)
+        try:
+            Booking.objects.create_booking(user, self.v1, self.start + offset, self.end + offset, attempts=10)
+            return True
+        except BookingUnavailable:
+            return False
+        finally:
+            connection.close()
+
+    def test_parallel_confirms_for_same_slot(self):
+        """
+        Only one of many simultaneous bookings for the same slot succeeds
+        """
+        started = time.perf_counter()
+        with mock.patch.object(Booking, 'save', autospec=True, side_effect=self.slow_save):
+            with ThreadPoolExecutor(max_workers=self.THREADS) as executor:
+                results = list(executor.map(self.confirm, self.users))
+        elapsed = time.perf_counter() - started
+        logger.info('%d parallel confirms in %.2fs (%.0f/s)', self.ATTEMPTS, elapsed, self.ATTEMPTS / elapsed)
+
+        self.assertEqual(results.count(True), 1)
+        self.assertEqual(results.count(False), self.ATTEMPTS - 1)
+        self.assertEqual(Booking.objects.filter(vehicle=self.v1).count(), 1)
+
+    def test_parallel_confirms_for_different_slots(self):
+        """
+        Simultaneous bookings for back-to-back slots all succeed
+        """
+        slots = 20
+        with mock.patch.object(Booking, 'save', autospec=True, side_effect=self.slow_save):
+            with ThreadPoolExecutor(max_workers=self.THREADS) as executor:
+                results = list(executor.map(self.confirm, self.users[:slots], [i * 2 for i in range(slots)]))
+        self.assertEqual(results, [True] * slots)
+        self.assertEqual(Booking.objects.filter(vehicle=self.v1).count(), slots)
+
+    def extend(self, booking, new_end):
+        """
+        Tries to extend the booking, on this thread's own database connection
+        """
+        try:
+            Booking.objects.extend_booking(Booking.objects.get(pk=booking.pk), new_end, attempts=10)
+            return True
+        except BookingUnavailable:
+            return False
+        finally:
+            connection.close()
+
+    def test_parallel_extend_and_confirms(self):
+        """
+        Extending a booking while others book the slot after it leaves exactly one of them holding the slot
+        """
+        booking = Booking.objects.create_booking(self.users[0], self.v1, self.start, self.end)
+        new_end = self.end + dt.timedelta(hours=2)
+        with mock.patch.object(Booking, 'save', autospec=True, side_effect=self.slow_save):
+            with ThreadPoolExecutor(max_workers=self.THREADS) as executor:
+                extended = executor.submit(self.extend, booking, new_end)
+                results = list(executor.map(self.confirm, self.users[1:50], [2] * 49))
+        results.append(extended.result())
+
+        self.assertEqual(results.count(True), 1)
+        self.assertEqual(Booking.objects.filter(vehicle=self.v1).overlapping(self.end, new_end).count(), 1)
+        booking.refresh_from_db()
+        self.assertEqual(booking.schedule_end, new_end if extended.result() else self.end)
+
+    def test_retry_keeps_one_email(self):
+        """
+        A booking whose transaction is aborted is saved on the next attempt, and only the email queued in the
+        successful attempt is kept
+        """
+        attempts = []
+
+        def send_confirmation(booking):
+            queue_email(EmailMessage(subject='Booking {0}'.format(booking.pk), body='Body', to=['john@test.com']))
+            attempts.append(booking.pk)
+            if len(attempts) == 1:
+                raise OperationalError('database is locked')
+
+        with mock.patch('carshare.managers.time.sleep'):
+            booking = Booking.objects.create_booking(self.users[0], self.v1, self.start, self.end,
+                                                     on_save=send_confirmation)
+            self.assertEqual(len(attempts), 2)
+            self.assertEqual(list(Booking.objects.values_list('pk', flat=True)), [booking.pk])
+            self.assertEqual(list(OutboxEmail.objects.values_list('subject', flat=True)),
+                             ['Booking {0}'.format(booking.pk)])
+
+            Booking.objects.extend_booking(booking, self.end + dt.timedelta(hours=1), on_save=send_confirmation)
+            self.assertEqual(OutboxEmail.objects.count(), 2)
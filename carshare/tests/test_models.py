@@ -178,3 +178,115 @@ class CarshareVehicleModelTests(TestCase):
         """
         v = Vehicle.objects.get(name='Vehicle1')
         self.assertFalse(v.is_available())
+
+    def test_fleet_availability(self):
+        """
+        Availability of the whole fleet is annotated in a single query
+        """
+        with self.assertNumQueries(1):
+            vehicles = {v.name: v for v in Vehicle.objects.with_availability()}
+            self.assertFalse(vehicles['Vehicle1'].is_available())
+            self.assertTrue(vehicles['Vehicle2'].is_available())
+            self.assertEqual(vehicles['Vehicle1'].pod.description, 'Pod 1')
+            self.assertEqual(vehicles['Vehicle1'].type.description, 'Premium')
+
+
+class CarshareBookingQuerySetTests(TestCase):
+    def setUp(self):
+        vt = VehicleType.objects.create(description='Premium', hourly_rate='12.50', daily_rate='80.00')
+        p1 = Pod.objects.create(latitude='-39.34523453', longitude='139.53524344', description='Pod 1')
+        self.v1 = Vehicle.objects.create(pod=p1, type=vt, name='Vehicle1', make='Toyota', model='Yaris', year=2012, registration='AAA111')
+        self.u = User.objects.create(email='test@test.com', first_name='John', last_name='Doe', date_of_birth='2017-01-01')
+        self.start = timezone.make_aware(datetime(2999, 1, 1, 10))
+        self.end = timezone.make_aware(datetime(2999, 1, 1, 12))
+        self.booking = Booking.objects.create(user=self.u, vehicle=self.v1, schedule_start=self.start, schedule_end=self.end)
+
+    def assertOverlaps(self, start_hour, end_hour, expected):
+        start = timezone.make_aware(datetime(2999, 1, 1, start_hour))
+        end = timezone.make_aware(datetime(2999, 1, 1, end_hour))
+        self.assertEqual(Booking.objects.overlapping(start, end).exists(), expected)
+
+    def test_overlapping_windows(self):
+        """
+        Windows overlapping the start, the end, the middle, or the whole booking are detected
+        """
+        self.assertOverlaps(9, 11, True)
+        self.assertOverlaps(11, 13, True)
+        self.assertOverlaps(10, 11, True)
+        self.assertOverlaps(8, 14, True)
+
+    def test_touching_windows_do_not_overlap(self):
+        """
+        Windows ending when the booking starts, or starting when it ends, do not overlap
+        """
+        self.assertOverlaps(8, 10, False)
+        self.assertOverlaps(12, 14, False)
+
+    def test_cancelled_bookings_do_not_overlap(self):
+        """
+        Cancelled bookings are excluded from overlap checks
+        """
+        self.booking.cancelled = timezone.now()
+        self.booking.save()
+        self.assertOverlaps(9, 11, False)
+
+    def test_related_managers(self):
+        """
+        Overlap checks are available through a vehicle's or user's bookings
+        """
+        self.assertTrue(self.v1.booking_set.overlapping(self.start, self.end).exists())
+        self.assertTrue(self.u.booking_set.overlapping(self.start, self.end).exists())
+
+
+    def test_keyset_page_ties(self):
+        """
+        Pages split bookings with the same start time without skipping or repeating any
+        """
+        bookings = [self.booking] + [
+            Booking.objects.create(user=self.u, vehicle=self.v1, schedule_start=self.start, schedule_end=self.end)
+            for _ in range(4)
+        ]
+        page1, cursor = Booking.objects.keyset_page(size=3)
+        page2, last_cursor = Booking.objects.keyset_page(cursor, size=3)
+        self.assertEqual(page1 + page2, list(reversed(bookings)))
+        self.assertIsNone(last_cursor)
+
+class CarshareBookingStatusTests(TestCase):
+    def setUp(self):
+        vt = VehicleType.objects.create(description='Premium', hourly_rate=12.50, daily_rate=80.00)
+        p1 = Pod.objects.create(latitude='-39.34523453', longitude='139.53524344', description='Pod 1')
+        v1 = Vehicle.objects.create(pod=p1, type=vt, name='Vehicle1', make='Toyota', model='Yaris', year=2012, registration='AAA111')
+        u = User.objects.create(email='test@test.com', first_name='John', last_name='Doe', date_of_birth='2017-01-01')
+        for start, end, cancelled, paid in ((yesterday, tomorrow, None, True), (yesterday, tomorrow, None, False),
+                                            (two_days_ago, yesterday, None, True), (tomorrow, two_days_from_now, None, False),
+                                            (tomorrow, two_days_from_now, timezone.now(), False)):
+            b = Booking.objects.create(user=u, vehicle=v1, schedule_start=start, schedule_end=end, cancelled=cancelled)
+            if paid:
+                Invoice.objects.create(booking=b, amount=b.calculate_cost())
+
+    def test_annotated_status_matches(self):
+        """
+        Statuses worked out in the database match those worked out in Python
+        """
+        expected = [b.get_status() for b in Booking.objects.order_by('id')]
+        with self.assertNumQueries(1):
+            statuses = [b.get_status() for b in Booking.objects.with_status().order_by('id')]
+        self.assertEqual(statuses, expected)
+        self.assertEqual(statuses, ['Active - Paid', 'Active - Unpaid', 'Complete - Paid', 'Confirmed - Unpaid',
+                                    'Cancelled'])
+
+    def test_filter_by_status(self):
+        """
+        Bookings can be filtered by status and payment in the database
+        """
+        bookings = Booking.objects.with_status()
+        self.assertEqual(bookings.filter(status=Booking.ACTIVE).count(), 2)
+        self.assertEqual(bookings.filter(status=Booking.ACTIVE, paid=False).count(), 1)
+        self.assertEqual(bookings.filter(status__in=[Booking.COMPLETE, Booking.CANCELLED]).count(), 2)
+
+    def test_status_at_time(self):
+        """
+        Statuses can be worked out for a given time
+        """
+        bookings = Booking.objects.with_status(now=two_days_from_now + timedelta(hours=1))
+        self.assertEqual(bookings.filter(status=Booking.COMPLETE).count(), 4)
@@ -0,0 +1,209 @@
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from decimal import Decimal
+from math import ceil
+from io import StringIO
+from unittest import mock
+import datetime as dt
+import random
+
+from ..models import Booking, User, Vehicle, Pod, VehicleType
+from ..pricing import (billable_days_hours, booking_costs, cost_cents, get_vehicle_type, quote, quote_vehicle_type,
+                       to_cents, total_cost, vehicle_types)
+
+
+def reference_cost(length, hourly_rate, daily_rate):
+    """
+    The original float/Decimal implementation of Booking.calculate_cost()
+    """
+    booking_length_hours_total = length.days * 24 + length.seconds / 60 / 60
+    booking_days = int(booking_length_hours_total / 24)
+    booking_hours = ceil(booking_length_hours_total % 24)
+    if booking_hours * Decimal(hourly_rate) >= daily_rate:
+        booking_days += 1
+        booking_hours = 0
+    day_cost = booking_days * Decimal(daily_rate)
+    hour_cost = booking_hours * Decimal(hourly_rate)
+    if hour_cost > daily_rate:
+        hour_cost = daily_rate
+    return (booking_days, booking_hours), float(day_cost + hour_cost)
+
+
+class CarsharePricingTests(TestCase):
+    def setUp(self):
+        self.vt1 = VehicleType.objects.create(description='Premium', hourly_rate=12.50, daily_rate=80.00)
+        self.vt2 = VehicleType.objects.create(description='Budget', hourly_rate=7.35, daily_rate=59.99)
+        self.u1 = User.objects.create(email='test1@test.com', first_name='John', last_name='Doe',
+                                      date_of_birth='1980-01-01')
+        self.start = timezone.make_aware(dt.datetime(2017, 1, 1, 10))
+        rng = random.Random(1)
+        for i, vt in enumerate((self.vt1, self.vt2, self.vt1)):
+            pod = Pod.objects.create(latitude='-37.8', longitude='144.9', description='Pod {0}'.format(i))
+            vehicle = Vehicle.objects.create(pod=pod, type=vt, name='Vehicle{0}'.format(i), make='Toyota',
+                                             model='Yaris', year=2012, registration='AAA22{0}'.format(i))
+            for _ in range(20):
+                length = dt.timedelta(minutes=rng.randint(1, 60 * 24 * 10))
+                Booking.objects.create(user=self.u1, vehicle=vehicle, schedule_start=self.start,
+                                       schedule_end=self.start + length)
+
+    def test_matches_reference(self):
+        """
+        Integer cents give the same days, hours and costs as the original calculation
+        """
+        rng = random.Random(2)
+        rates = [(Decimal('12.50'), Decimal('80.00')), (Decimal('7.35'), Decimal('59.99')),
+                 (Decimal('0.29'), Decimal('5.00')), (Decimal('10.00'), Decimal('100.00'))]
+        lengths = [dt.timedelta(hours=h) for h in range(0, 100)]
+        lengths += [dt.timedelta(seconds=rng.randint(1, 90 * 24 * 60 * 60)) for _ in range(2000)]
+        for hourly_rate, daily_rate in rates:
+            hourly_cents, daily_cents = to_cents(hourly_rate), to_cents(daily_rate)
+            for length in lengths:
+                counts, cost = reference_cost(length, hourly_rate, daily_rate)
+                self.assertEqual(billable_days_hours(length, hourly_cents, daily_cents), counts)
+                self.assertEqual(cost_cents(length, hourly_cents, daily_cents) / 100, cost)
+
+    def test_batch_matches_scalar(self):
+        """
+        Batch costs match Booking.calculate_cost() and are worked out in one query
+        """
+        vehicle_types.get()
+        with self.assertNumQueries(1):
+            costs = booking_costs(Booking.objects.all())
+        self.assertEqual(len(costs), 60)
+        for booking in Booking.objects.all():
+            self.assertEqual(float(costs[booking.id]), booking.calculate_cost())
+        with self.assertNumQueries(1):
+            total = total_cost(Booking.objects.all())
+        self.assertEqual(total, sum(costs.values()))
+
+    def test_to_cents(self):
+        self.assertEqual(to_cents(Decimal('12.50')), 1250)
+        self.assertEqual(to_cents(0.29), 29)
+        self.assertEqual(to_cents(80), 8000)
+
+
+class CarshareVehicleTypeTableTests(TestCase):
+    def setUp(self):
+        self.vt = VehicleType.objects.create(description='Premium', hourly_rate=12.50, daily_rate=80.00)
+        self.u1 = User.objects.create(email='test1@test.com', first_name='John', last_name='Doe',
+                                      date_of_birth='1980-01-01')
+        pod = Pod.objects.create(latitude='-37.8', longitude='144.9', description='Pod 1')
+        self.v1 = Vehicle.objects.create(pod=pod, type=self.vt, name='Vehicle1', make='Toyota', model='Yaris',
+                                         year=2012, registration='AAA221')
+        start = timezone.make_aware(dt.datetime(2017, 1, 1, 10))
+        self.booking = Booking.objects.create(user=self.u1, vehicle=self.v1, schedule_start=start,
+                                              schedule_end=start + dt.timedelta(hours=3))
+
+    def test_cost_without_rate_query(self):
+        """
+        Once the table is loaded, pricing a booking with its vehicle loaded runs no queries
+        """
+        booking = Booking.objects.select_related('vehicle').get(pk=self.booking.pk)
+        vehicle_types.get()
+        with self.assertNumQueries(0):
+            self.assertEqual(booking.calculate_cost(), 37.50)
+            self.assertEqual(booking.calculate_daily_hourly_billable_counts(), (0, 3))
+
+    def test_invalidated_on_save(self):
+        """
+        Saving a vehicle type reloads the table
+        """
+        self.assertEqual(get_vehicle_type(self.vt.id).hourly_rate, Decimal('12.50'))
+        self.vt.hourly_rate = Decimal('15.00')
+        self.vt.save()
+        self.assertEqual(get_vehicle_type(self.vt.id).hourly_rate, Decimal('15.00'))
+
+    def test_quotes_memoised(self):
+        """
+        Quotes are worked out once per type and length in days and hours, until the type's rates change
+        """
+        with mock.patch('carshare.pricing.quote', wraps=quote) as quote_mock:
+            self.assertEqual(quote_vehicle_type(self.vt.id, dt.timedelta(hours=2, minutes=10)),
+                             (0, 3, Decimal('37.50')))
+            self.assertEqual(quote_vehicle_type(self.vt.id, dt.timedelta(hours=2, minutes=50)),
+                             (0, 3, Decimal('37.50')))
+            self.assertEqual(quote_mock.call_count, 1)
+            self.vt.hourly_rate = Decimal('15.00')
+            self.vt.save()
+            self.assertEqual(quote_vehicle_type(self.vt.id, dt.timedelta(hours=3)), (0, 3, Decimal('45.00')))
+            self.assertEqual(quote_mock.call_count, 2)
+
+    def test_missing_type_reloads(self):
+        """
+        A type missing from the table (e.g. created while it was being built) is found by reloading it
+        """
+        vehicle_types.get()
+        VehicleType.objects.bulk_create([VehicleType(description='Budget', hourly_rate=7.35, daily_rate=59.99)])
+        vt_id = VehicleType.objects.get(description='Budget').id
+        self.assertEqual(get_vehicle_type(vt_id).description, 'Budget')
+        with self.assertRaises(KeyError):
+            get_vehicle_type(999)
+
+
+class CarshareQuotedCostTests(TestCase):
+    def setUp(self):
+        self.vt = VehicleType.objects.create(description='Premium', hourly_rate=12.50, daily_rate=80.00)
+        self.u1 = User.objects.create(email='test1@test.com', first_name='John', last_name='Doe',
+                                      date_of_birth='1980-01-01')
+        pod = Pod.objects.create(latitude='-37.8', longitude='144.9', description='Pod 1')
+        self.v1 = Vehicle.objects.create(pod=pod, type=self.vt, name='Vehicle1', make='Toyota', model='Yaris',
+                                         year=2012, registration='AAA221')
+        self.start = timezone.make_aware(dt.datetime(2017, 1, 1, 10))
+
+    def change_rates(self):
+        self.vt.hourly_rate, self.vt.daily_rate = Decimal('20.00'), Decimal('150.00')
+        self.vt.save()
+
+    def test_create_booking_quotes(self):
+        """
+        Bookings made through create_booking() store their cost and rates
+        """
+        booking = Booking.objects.create_booking(self.u1, self.v1, self.start, self.start + dt.timedelta(hours=3))
+        booking = Booking.objects.get(pk=booking.pk)
+        self.assertEqual(booking.quoted_cost, 3750)
+        self.assertEqual(booking.quoted_hourly_rate, Decimal('12.50'))
+        self.assertEqual(booking.get_cost(), Decimal('37.50'))
+
+    def test_quoted_cost_survives_rate_change(self):
+        """
+        Changing the vehicle type's rates doesn't change the cost of existing bookings, even when they are extended
+        """
+        booking = Booking.objects.create_booking(self.u1, self.v1, self.start, self.start + dt.timedelta(hours=3))
+        self.change_rates()
+        booking = Booking.objects.select_related('vehicle__type').get(pk=booking.pk)
+        self.assertEqual(booking.calculate_cost(), 37.50)
+        self.assertEqual(booking_costs(Booking.objects.filter(pk=booking.pk)), {booking.pk: Decimal('37.50')})
+        booking.schedule_end += dt.timedelta(hours=1)
+        booking.quote()
+        self.assertEqual(booking.get_cost(), Decimal('50.00'))
+
+    def test_backfill(self):
+        """
+        The backfill command quotes unquoted bookings at the current rates, a chunk per query
+        """
+        for hours in range(1, 6):
+            start = self.start + dt.timedelta(days=hours)
+            Booking.objects.create(user=self.u1, vehicle=self.v1, schedule_start=start,
+                                   schedule_end=start + dt.timedelta(hours=hours))
+        # 3 selects (the last one empty) and 2 updates
+        with self.assertNumQueries(5):
+            call_command('backfill_booking_costs', chunk_size=3, stdout=StringIO())
+        self.assertFalse(Booking.objects.filter(quoted_cost__isnull=True).exists())
+        for booking in Booking.objects.all():
+            self.assertEqual(booking.quoted_hourly_rate, Decimal('12.50'))
+            hours = (booking.schedule_end - booking.schedule_start).seconds // 3600
+            self.assertEqual(booking.quoted_cost, min(hours * 1250, 8000))
+
+    def test_verify(self):
+        """
+        The verify command reports stored costs that don't match their times and rates
+        """
+        booking = Booking.objects.create_booking(self.u1, self.v1, self.start, self.start + dt.timedelta(hours=3))
+        call_command('verify_booking_costs', stdout=StringIO())
+        Booking.objects.filter(pk=booking.pk).update(quoted_cost=100)
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('verify_booking_costs', stdout=out)
+        self.assertIn('Booking {0}'.format(booking.pk), out.getvalue())
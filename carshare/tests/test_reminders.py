@@ -0,0 +1,117 @@
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from io import StringIO
+import datetime as dt
+
+from emails.models import EmailTemplate, OutboxEmail
+from ..models import Booking, BookingReminder, User, Vehicle, Pod, VehicleType
+
+
+class CarshareBookingReminderTests(TestCase):
+    fixtures = ['email_templates']
+
+    def setUp(self):
+        self.vt = VehicleType.objects.create(description='Premium', hourly_rate=12.50, daily_rate=80.00)
+        self.u1 = User.objects.create(email='test1@test.com', first_name='John', last_name='Doe',
+                                      date_of_birth='1980-01-01')
+        pod = Pod.objects.create(latitude='-37.8', longitude='144.9', description='Pod 1')
+        self.v1 = Vehicle.objects.create(pod=pod, type=self.vt, name='Vehicle1', make='Toyota', model='Yaris',
+                                         year=2012, registration='AAA221')
+        self.now = timezone.now()
+
+    def create_booking(self, start_minutes, length_minutes):
+        start = self.now + dt.timedelta(minutes=start_minutes)
+        return Booking.objects.create(user=self.u1, vehicle=self.v1, schedule_start=start,
+                                      schedule_end=start + dt.timedelta(minutes=length_minutes))
+
+    def send_reminders(self):
+        call_command('send_booking_reminders', once=True, stdout=StringIO())
+
+    def test_needing_reminder(self):
+        """
+        Bookings starting within an hour need a starting reminder, and active bookings ending within 30 minutes need
+        an ending reminder
+        """
+        starting = self.create_booking(30, 120)
+        ending = self.create_booking(-60, 80)
+        self.create_booking(90, 60)             # Starts too late
+        self.create_booking(-120, 60)           # Already over
+        self.create_booking(-60, 120)           # Ends too late
+        short = self.create_booking(10, 10)     # Ends soon, but hasn't started (so only starting)
+        cancelled = self.create_booking(20, 60)
+        cancelled.cancelled = self.now
+        cancelled.save()
+        self.assertEqual(list(Booking.objects.needing_reminder(BookingReminder.STARTING, self.now)), [short, starting])
+        self.assertEqual(list(Booking.objects.needing_reminder(BookingReminder.ENDING, self.now)), [ending])
+
+    def test_sent_once(self):
+        """
+        Reminders are queued in the outbox, and not again by later runs
+        """
+        starting = self.create_booking(30, 120)
+        ending = self.create_booking(-60, 80)
+        self.send_reminders()
+        self.assertEqual(
+            sorted(BookingReminder.objects.values_list('booking_id', 'kind')),
+            sorted([(starting.id, BookingReminder.STARTING), (ending.id, BookingReminder.ENDING)])
+        )
+        self.assertEqual(sorted(OutboxEmail.objects.values_list('subject', flat=True)),
+                         ['Vroom Booking Ending Soon', 'Vroom Booking Starting Soon'])
+        self.assertEqual(OutboxEmail.objects.filter(to='test1@test.com').count(), 2)
+        self.send_reminders()
+        self.assertEqual(BookingReminder.objects.count(), 2)
+        self.assertEqual(OutboxEmail.objects.count(), 2)
+
+    def test_extended(self):
+        """
+        An extended booking gets another ending reminder when its new end time comes close
+        """
+        booking = self.create_booking(-60, 80)
+        self.send_reminders()
+        booking.schedule_end += dt.timedelta(minutes=10)
+        booking.save()
+        self.send_reminders()
+        self.assertEqual(BookingReminder.objects.filter(booking=booking, kind=BookingReminder.ENDING).count(), 2)
+
+    def test_cost_independent_of_table_size(self):
+        """
+        A run takes the same queries (a scan, the template and two bulk inserts for each kind) however many bookings are
+        due or exist
+        """
+        for minutes in range(0, 3000, 60):
+            self.create_booking(minutes + 120, 30)
+            self.create_booking(-minutes - 120, 30)
+        self.create_booking(30, 120)
+        self.create_booking(-60, 80)
+        # Each kind: select, template, savepoint, insert reminders, insert emails, release savepoint
+        with self.assertNumQueries(12):
+            self.send_reminders()
+        # Many more due: still one insert of each, and only a select for the kind with none due
+        for minutes in range(1, 40):
+            self.create_booking(minutes, 120)
+        with self.assertNumQueries(7):
+            self.send_reminders()
+        self.assertEqual(OutboxEmail.objects.count(), 41)
+
+    def test_templates_added_by_migration(self):
+        """
+        The reminder templates are added by a migration, so existing databases don't need the fixture loaded again
+        """
+        self.assertTrue(EmailTemplate.objects.filter(name=BookingReminder.TEMPLATES[BookingReminder.STARTING]).exists())
+        self.assertTrue(EmailTemplate.objects.filter(name=BookingReminder.TEMPLATES[BookingReminder.ENDING]).exists())
+        # Loading the fixture updates them by name, rather than adding copies
+        self.assertEqual(EmailTemplate.objects.filter(name='Booking Starting').count(), 1)
+
+    def test_missing_template_skipped(self):
+        """
+        Without its template, a kind of reminder is skipped (and still due) rather than stopping the scheduler
+        """
+        starting = self.create_booking(30, 120)
+        ending = self.create_booking(-60, 80)
+        EmailTemplate.objects.filter(name=BookingReminder.TEMPLATES[BookingReminder.STARTING]).delete()
+        with self.assertLogs('carshare.management.commands.send_booking_reminders', 'ERROR'):
+            self.send_reminders()
+        self.assertEqual(list(BookingReminder.objects.values_list('booking_id', flat=True)), [ending.id])
+        self.assertEqual(list(Booking.objects.needing_reminder(BookingReminder.STARTING)), [starting])
@@ -0,0 +1,83 @@
+from django.core.cache import caches
+from django.test import TestCase
+from django.urls import reverse
+
+import json
+import random
+
+from ..models import Pod, Vehicle, VehicleType
+from ..spatial import PodTree, haversine_km
+
+
+class CarshareSpatialTests(TestCase):
+    def setUp(self):
+        # Random pods around Melbourne
+        rng = random.Random(42)
+        self.pods = [(i, -37.8 + rng.uniform(-0.5, 0.5), 144.9 + rng.uniform(-0.5, 0.5)) for i in range(500)]
+        self.tree = PodTree(self.pods)
+        self.target = (-37.81, 144.96)
+
+    def brute_force(self):
+        return sorted((haversine_km(self.target[0], self.target[1], lat, lng), pod_id)
+                      for pod_id, lat, lng in self.pods)
+
+    def test_nearest_matches_brute_force(self):
+        """
+        k nearest pods from the tree match a full scan
+        """
+        nearest = self.tree.nearest(self.target[0], self.target[1], 10)
+        expected = self.brute_force()[:10]
+        self.assertEqual([pod_id for _, pod_id in nearest], [pod_id for _, pod_id in expected])
+        for (distance, _), (expected_distance, _) in zip(nearest, expected):
+            self.assertAlmostEqual(distance, expected_distance, places=6)
+
+    def test_within_radius_matches_brute_force(self):
+        """
+        Pods within a radius from the tree match a full scan
+        """
+        within = self.tree.within_radius(self.target[0], self.target[1], 5)
+        expected = [pod_id for distance, pod_id in self.brute_force() if distance <= 5]
+        self.assertEqual([pod_id for _, pod_id in within], expected)
+
+    def test_empty_tree(self):
+        tree = PodTree([])
+        self.assertEqual(tree.nearest(0, 0, 5), [])
+        self.assertEqual(tree.within_radius(0, 0, 5), [])
+
+
+class CarshareNearbyVehiclesViewTests(TestCase):
+    def setUp(self):
+        caches['availability'].clear()
+        vt = VehicleType.objects.create(description='Premium', hourly_rate=12.50, daily_rate=80.00)
+        # Flinders St, Southern Cross, and Geelong
+        for i, (lat, lng) in enumerate([('-37.8183', '144.9671'), ('-37.8184', '144.9526'), ('-38.1499', '144.3617')]):
+            pod = Pod.objects.create(latitude=lat, longitude=lng, description='Pod {0}'.format(i))
+            Vehicle.objects.create(pod=pod, type=vt, name='Vehicle{0}'.format(i), make='Toyota', model='Yaris',
+                                   year=2012, registration='AAA22{0}'.format(i))
+
+    def get_vehicles(self, **params):
+        response = self.client.get(reverse('carshare:nearby_vehicles'), dict(lat=-37.8170, lng=144.9660, **params))
+        return [v['name'] for v in json.loads(response.content.decode())['vehicles']]
+
+    def test_nearest(self):
+        self.assertEqual(self.get_vehicles(k=2), ['Vehicle0', 'Vehicle1'])
+
+    def test_radius(self):
+        self.assertEqual(self.get_vehicles(radius=10), ['Vehicle0', 'Vehicle1'])
+
+    def test_bounds(self):
+        self.assertEqual(self.get_vehicles(south=-38.2, west=144.3, north=-38.1, east=144.4), ['Vehicle2'])
+
+    def test_tree_rebuilt_when_pod_moves(self):
+        """
+        Moving a pod is reflected in the next nearby search
+        """
+        self.assertEqual(self.get_vehicles(k=1), ['Vehicle0'])
+        pod = Pod.objects.get(description='Pod 2')
+        pod.latitude, pod.longitude = '-37.8171', '144.9661'
+        pod.save()
+        self.assertEqual(self.get_vehicles(k=1), ['Vehicle2'])
+
+    def test_missing_location(self):
+        response = self.client.get(reverse('carshare:nearby_vehicles'))
+        self.assertIn('error', json.loads(response.content.decode()))
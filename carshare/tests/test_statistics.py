@@ -0,0 +1,100 @@
+from django.core.management import call_command
+from django.test import TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from decimal import Decimal
+from io import StringIO
+import datetime as dt
+
+from ..models import Booking, User, Vehicle, Pod, VehicleType, SiteStatistics
+from ..pricing import total_cost
+from .test_views import STATICFILES_STORAGE_FOR_TESTS
+
+
+@override_settings(STATICFILES_STORAGE=STATICFILES_STORAGE_FOR_TESTS)
+class CarshareSiteStatisticsTests(TransactionTestCase):
+    """
+    Statistics are updated when transactions commit, so these tests use TransactionTestCase rather than TestCase
+    """
+    def setUp(self):
+        self.vt = VehicleType.objects.create(description='Premium', hourly_rate=12.50, daily_rate=80.00)
+        self.u1 = User.objects.create(email='test1@test.com', first_name='John', last_name='Doe',
+                                      date_of_birth='1980-01-01')
+        self.v1 = self.create_vehicle(1)
+        self.now = timezone.now()
+        # A completed booking, a current one and an upcoming one
+        self.create_booking(-48, 5)
+        self.create_booking(-24, 30)
+        self.create_booking(24, 2)
+
+    def create_vehicle(self, number):
+        pod = Pod.objects.create(latitude='-37.8', longitude='144.9', description='Pod {0}'.format(number))
+        return Vehicle.objects.create(pod=pod, type=self.vt, name='Vehicle{0}'.format(number), make='Toyota',
+                                      model='Yaris', year=2012, registration='AAA22{0}'.format(number))
+
+    def create_booking(self, start_hours, length_hours, vehicle=None):
+        start = self.now + dt.timedelta(hours=start_hours)
+        return Booking.objects.create(user=self.u1, vehicle=vehicle or self.v1, schedule_start=start,
+                                      schedule_end=start + dt.timedelta(hours=length_hours))
+
+    def assertMatchesRebuild(self):
+        stats = SiteStatistics.objects.get()
+        rebuilt = SiteStatistics.rebuild(now=stats.completed_until)
+        self.assertEqual(
+            (stats.num_vehicles, stats.num_pods, stats.num_bookings, stats.completed_cost),
+            (rebuilt.num_vehicles, rebuilt.num_pods, rebuilt.num_bookings, rebuilt.completed_cost),
+        )
+
+    def test_rebuild(self):
+        """
+        Rebuilding counts everything and prices completed bookings
+        """
+        stats = SiteStatistics.rebuild(now=self.now)
+        self.assertEqual((stats.num_vehicles, stats.num_pods, stats.num_bookings), (1, 1, 3))
+        self.assertEqual(stats.completed_cost, Decimal('62.50'))
+        self.assertEqual(stats.completed_cost, total_cost(Booking.objects.filter(schedule_end__lt=self.now)))
+
+    def test_incremental_updates(self):
+        """
+        Creating, changing and deleting vehicles, pods and bookings keeps the totals up to date
+        """
+        SiteStatistics.rebuild()
+        v2 = self.create_vehicle(2)
+        past = self.create_booking(-10, 3, vehicle=v2)
+        self.create_booking(10, 3, vehicle=v2)
+        self.assertMatchesRebuild()
+        past.schedule_end += dt.timedelta(hours=2)
+        past.save()
+        self.assertMatchesRebuild()
+        past.delete()
+        self.assertMatchesRebuild()
+        v2.pod.delete()
+        self.assertMatchesRebuild()
+
+    def test_catch_up(self):
+        """
+        Bookings are added to the completed cost once they end
+        """
+        SiteStatistics.rebuild(now=self.now)
+        later = self.now + dt.timedelta(days=2)
+        stats = SiteStatistics.get(now=later)
+        self.assertEqual(stats.completed_until, later)
+        self.assertEqual(stats.completed_cost, total_cost(Booking.objects.filter(schedule_end__lt=later)))
+        self.assertEqual(SiteStatistics.objects.get().completed_cost, stats.completed_cost)
+
+    def test_about_us_single_query(self):
+        """
+        About Us reads the statistics in one query
+        """
+        SiteStatistics.rebuild()
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('carshare:about_us'))
+        self.assertEqual(response.context['num_shares'], 3)
+        self.assertEqual(response.context['estimated_savings'], int(75 * 3 - 62.50))
+
+    def test_rebuild_command(self):
+        out = StringIO()
+        call_command('rebuild_site_statistics', stdout=out)
+        self.assertIn('3 bookings', out.getvalue())
+        self.assertEqual(SiteStatistics.objects.get().num_bookings, 3)
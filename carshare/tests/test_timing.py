@@ -0,0 +1,73 @@
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+import re
+
+from vroom_car_share.timing import QueryBudgetExceeded
+from ..models import SiteStatistics
+from .test_views import STATICFILES_STORAGE_FOR_TESTS
+
+
+@override_settings(STATICFILES_STORAGE=STATICFILES_STORAGE_FOR_TESTS)
+class CarshareRequestTimingTests(TestCase):
+    def setUp(self):
+        # The statistics are built on first use, which takes more queries than the view normally does
+        SiteStatistics.get()
+
+    def test_server_timing_header(self):
+        """
+        Responses have a Server-Timing header with the queries, database time, template time and total time
+        """
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('carshare:about_us'))
+        match = re.match(r'db;dur=([\d.]+);desc="(\d+) queries", tpl;dur=([\d.]+), total;dur=([\d.]+)$',
+                         response['Server-Timing'])
+        self.assertIsNotNone(match)
+        self.assertEqual(match.group(2), '1')
+        self.assertGreater(float(match.group(3)), 0)
+        self.assertGreaterEqual(float(match.group(4)), float(match.group(3)))
+        self.assertFalse(connection.force_debug_cursor)
+
+    def test_logged(self):
+        """
+        Each request is logged with its URL name and timings
+        """
+        with self.assertLogs('vroom_car_share.timing', 'INFO') as logs:
+            self.client.get(reverse('carshare:about_us'))
+        self.assertEqual(len(logs.records), 1)
+        self.assertTrue(logs.output[0].startswith(
+            'INFO:vroom_car_share.timing:view=carshare:about_us method=GET status=200 queries=1 db_ms='
+        ))
+        self.assertEqual(logs.records[0].queries, 1)
+
+    def test_queries_not_logged(self):
+        """
+        Queries are counted and timed without turning on the debug cursor, so they aren't kept in queries_log
+        """
+        queries_before = len(connection.queries_log)
+        with self.assertLogs('vroom_car_share.timing', 'INFO') as logs:
+            self.client.get(reverse('carshare:about_us'))
+        self.assertEqual(len(connection.queries_log), queries_before)
+        self.assertEqual(logs.records[0].queries, 1)
+        # Timed exactly, rather than summing the rounded times in queries_log
+        self.assertGreater(logs.records[0].db_ms, 0)
+
+    @override_settings(QUERY_BUDGETS={'carshare:about_us': 0})
+    def test_over_budget_raises(self):
+        """
+        A view making more queries than its budget fails loudly in tests
+        """
+        with self.assertRaisesMessage(QueryBudgetExceeded, 'carshare:about_us made 1 queries, over its budget of 0'):
+            self.client.get(reverse('carshare:about_us'))
+
+    @override_settings(QUERY_BUDGETS={'carshare:about_us': 0}, QUERY_BUDGETS_RAISE=False)
+    def test_over_budget_logged(self):
+        """
+        Outside of tests, a view over budget is logged as a warning rather than failing the request
+        """
+        with self.assertLogs('vroom_car_share.timing', 'WARNING') as logs:
+            response = self.client.get(reverse('carshare:about_us'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(logs.output, ['WARNING:vroom_car_share.timing:carshare:about_us made 1 queries, '
+                                       'over its budget of 0'])
@@ -1,11 +1,21 @@
 from django.core import mail
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 
+from io import StringIO
+from unittest import mock
 import datetime as dt
+import json
 
-from ..models import Booking, User, Vehicle, Pod, VehicleType, Invoice
+from ..admin import retry_jobs
+from ..models import Booking, User, Vehicle, Pod, VehicleType, Invoice, InvoiceJob
+from ..pricing import vehicle_types
+from emails.models import EmailTemplate
 
 
 # Tests do not work with whitenoise static file storage, so we use the default storage for tests
@@ -45,6 +55,9 @@ class CarshareContactUsViewTests(TestCase):
         response = self.client.post(reverse('carshare:contact_us'), data=form)
         self.assertEqual(response.status_code, 200)
 
+        # Emails are queued, and sent by the outbox worker
+        self.assertEqual(len(mail.outbox), 0)
+        call_command('send_emails', once=True, stdout=StringIO())
         self.assertEqual(len(mail.outbox), 1)
         self.assertEqual(mail.outbox[0].subject, 'New Contact Us from Contact Name')
         self.assertEqual(mail.outbox[0].body, 'This is the message.')
@@ -58,6 +71,7 @@ class CarshareBookingViewTests(TestCase):
     fixtures = ['email_templates']
 
     def setUp(self):
+        caches['availability'].clear()
         # Create user to log in as
         User.objects.create_user(email='user@test.com', password='bigbadtestuser', first_name='Test', last_name='User', date_of_birth=dt.date(1980, 1, 1))
 
@@ -166,6 +180,35 @@ class CarshareBookingViewTests(TestCase):
         self.assertEqual(post_response.status_code, 200)
         self.assertContains(post_response, 'You already have a booking within the selected time frame')
 
+    def test_booking_confirm_rechecks_availability(self):
+        """
+        Vehicle booked by someone else while the booking was being reviewed is not double booked on confirm
+        """
+        form = {
+            'booking_start_date': '01/01/3000',
+            'booking_start_time': '00:00',
+            'booking_end_date': '01/01/3000',
+            'booking_end_time': '02:00',
+        }
+        self.client.login(email='user@test.com', password='bigbadtestuser')
+        # Construct URL with fake data because it's only there to provide initial form values
+        kwargs = {
+            'vehicle_id': self.v1.id,
+            'year': '2000',
+            'month': '1',
+            'day': '1',
+            'hour': '0',
+        }
+        post_response = self.client.post(reverse('carshare:booking_create_final', kwargs=kwargs), data=form)
+        self.assertEqual(post_response.status_code, 200)
+        # Another user books an overlapping slot before this user confirms
+        Booking.objects.create(user=User.objects.get(email='test2@test.com'), vehicle=self.v1,
+                               schedule_start=timezone.make_aware(dt.datetime(year=3000, month=1, day=1, hour=1)),
+                               schedule_end=timezone.make_aware(dt.datetime(year=3000, month=1, day=1, hour=3)))
+        confirm_response = self.client.get(reverse('carshare:booking_confirm'))
+        self.assertRedirects(confirm_response, reverse('carshare:booking_create', kwargs={'vehicle_id': self.v1.id}))
+        self.assertFalse(User.objects.get(email='user@test.com').booking_set.exists())
+
     def test_booking_detail_with_existing_id(self):
         """
         Booking detail page shows correct booking details for an existing booking
@@ -202,6 +245,206 @@ class CarshareBookingViewTests(TestCase):
         self.assertContains(response, str(booking.vehicle.pod.description))
 
 
+@override_settings(STATICFILES_STORAGE=STATICFILES_STORAGE_FOR_TESTS)
+class CarshareFindACarViewTests(TestCase):
+    def setUp(self):
+        caches['availability'].clear()
+        self.vt = VehicleType.objects.create(description='Premium', hourly_rate=12.50, daily_rate=80.00)
+        self.u1 = User.objects.create(email='test1@test.com', first_name='John', last_name='Doe',
+                                      date_of_birth='1980-01-01')
+
+    def create_vehicles(self, count):
+        now = timezone.now()
+        for i in range(Vehicle.objects.count(), Vehicle.objects.count() + count):
+            pod = Pod.objects.create(latitude='-37.8', longitude='144.9', description='Pod {0}'.format(i))
+            vehicle = Vehicle.objects.create(pod=pod, type=self.vt, name='Vehicle{0}'.format(i), make='Toyota',
+                                             model='Yaris', year=2012, registration='A{0:05d}'.format(i))
+            # Every second vehicle is currently booked
+            if i % 2:
+                Booking.objects.create(user=self.u1, vehicle=vehicle, schedule_start=now - dt.timedelta(hours=1),
+                                       schedule_end=now + dt.timedelta(hours=1))
+
+    def get_map(self):
+        # Vehicle types are loaded once per process, not per request
+        vehicle_types.get()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('carshare:find_a_car'))
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_map_shows_availability(self):
+        """
+        Map marks booked vehicles as unavailable
+        """
+        self.create_vehicles(2)
+        response, _ = self.get_map()
+        self.assertContains(response, "type: 'available'", count=1)
+        self.assertContains(response, "type: 'unavailable'", count=1)
+
+    def test_map_query_count_independent_of_fleet_size(self):
+        """
+        Map runs the same number of queries no matter how many vehicles there are
+        """
+        self.create_vehicles(2)
+        _, small_fleet_queries = self.get_map()
+        self.create_vehicles(20)
+        _, large_fleet_queries = self.get_map()
+        self.assertEqual(small_fleet_queries, large_fleet_queries)
+
+
+@override_settings(STATICFILES_STORAGE=STATICFILES_STORAGE_FOR_TESTS)
+class CarshareBookingTimelineViewTests(TestCase):
+    def setUp(self):
+        caches['availability'].clear()
+        vt = VehicleType.objects.create(description='Premium', hourly_rate=12.50, daily_rate=80.00)
+        p1 = Pod.objects.create(latitude='-39.34523453', longitude='139.53524344', description='Pod 1')
+        self.v1 = Vehicle.objects.create(pod=p1, type=vt, name='Vehicle1', make='Toyota', model='Yaris', year=2012,
+                                         registration='AAA222')
+        self.u1 = User.objects.create_user(email='user@test.com', password='bigbadtestuser', first_name='Test',
+                                           last_name='User', date_of_birth=dt.date(1980, 1, 1))
+        self.kwargs = {'vehicle_id': self.v1.id, 'year': '2999', 'month': '1', 'day': '2'}
+
+    def create_bookings(self, count):
+        # One hour bookings on consecutive days, ending on the day shown by the timeline
+        end = timezone.make_aware(dt.datetime(year=2999, month=1, day=2, hour=1))
+        Booking.objects.bulk_create([
+            Booking(user=self.u1, vehicle=self.v1, schedule_start=end - dt.timedelta(days=i, hours=1),
+                    schedule_end=end - dt.timedelta(days=i))
+            for i in range(count)
+        ])
+
+    def get_timeline(self):
+        # bulk_create() doesn't send the signals that clear cached availability
+        caches['availability'].clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('carshare:booking_create_date', kwargs=self.kwargs))
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_timeline_shows_booking(self):
+        """
+        Timeline marks the user's own booking and leaves the rest of the day available
+        """
+        self.create_bookings(1)
+        self.client.login(email='user@test.com', password='bigbadtestuser')
+        response, _ = self.get_timeline()
+        self.assertEqual(response.context['hours'][0], 'booked_by_user')
+        self.assertEqual(response.context['hours'][1], 'available')
+
+    def test_timeline_query_count_independent_of_history(self):
+        """
+        Timeline runs the same number of queries no matter how many bookings the vehicle has had
+        """
+        self.client.login(email='user@test.com', password='bigbadtestuser')
+        self.create_bookings(1)
+        _, few_bookings_queries = self.get_timeline()
+        self.create_bookings(50)
+        _, many_bookings_queries = self.get_timeline()
+        self.assertEqual(few_bookings_queries, many_bookings_queries)
+
+
+@override_settings(STATICFILES_STORAGE=STATICFILES_STORAGE_FOR_TESTS)
+class CarshareFreeSlotsViewTests(TestCase):
+    def setUp(self):
+        vt = VehicleType.objects.create(description='Premium', hourly_rate=12.50, daily_rate=80.00)
+        p1 = Pod.objects.create(latitude='-39.34523453', longitude='139.53524344', description='Pod 1')
+        self.v1 = Vehicle.objects.create(pod=p1, type=vt, name='Vehicle1', make='Toyota', model='Yaris', year=2012,
+                                         registration='AAA222')
+        self.u1 = User.objects.create(email='test1@test.com', first_name='John', last_name='Doe',
+                                      date_of_birth='1980-01-01')
+        self.url = reverse('carshare:ajax_vehicle_free_slots', kwargs={'vehicle_id': self.v1.id})
+
+    def test_free_slots(self):
+        """
+        Free slots start after the current booking, and link to the booking form
+        """
+        now = timezone.localtime().replace(minute=0, second=0, microsecond=0)
+        Booking.objects.create(user=self.u1, vehicle=self.v1, schedule_start=now - dt.timedelta(hours=1),
+                               schedule_end=now + dt.timedelta(hours=3))
+        response = self.client.get(self.url, {'length': 2, 'count': 1})
+        slots = json.loads(response.content.decode())['slots']
+        self.assertEqual(len(slots), 1)
+        free_from = now + dt.timedelta(hours=3)
+        self.assertEqual(slots[0]['start'], free_from.isoformat())
+        self.assertEqual(slots[0]['url'], reverse('carshare:booking_create_final_length', args=[
+            self.v1.id, free_from.year, free_from.month, free_from.day, free_from.hour, 2
+        ]))
+
+    def test_invalid_length(self):
+        """
+        Invalid parameters return an error
+        """
+        response = self.client.get(self.url, {'length': 'abc'})
+        self.assertIn('error', json.loads(response.content.decode()))
+        response = self.client.get(self.url, {'length': 0})
+        self.assertIn('error', json.loads(response.content.decode()))
+
+
+@override_settings(STATICFILES_STORAGE=STATICFILES_STORAGE_FOR_TESTS)
+class CarshareBookingQuoteViewTests(TestCase):
+    def setUp(self):
+        self.vt1 = VehicleType.objects.create(description='Premium', hourly_rate=12.50, daily_rate=80.00)
+        self.vt2 = VehicleType.objects.create(description='Budget', hourly_rate=7.35, daily_rate=59.99)
+        self.vehicles = []
+        for i, vt in enumerate((self.vt1, self.vt1, self.vt2)):
+            pod = Pod.objects.create(latitude='-37.8', longitude='144.9', description='Pod {0}'.format(i))
+            self.vehicles.append(Vehicle.objects.create(pod=pod, type=vt, name='Vehicle{0}'.format(i), make='Toyota',
+                                                        model='Yaris', year=2012, registration='AAA22{0}'.format(i)))
+        # 1 day and 3 hours, starting tomorrow
+        start = timezone.localtime() + dt.timedelta(days=1)
+        end = start + dt.timedelta(days=1, hours=3)
+        self.window = {
+            'booking_start_date': start.strftime('%d/%m/%Y'), 'booking_start_time': '10:00',
+            'booking_end_date': end.strftime('%d/%m/%Y'), 'booking_end_time': '13:00',
+        }
+
+    def get_quote(self, **params):
+        response = self.client.get(reverse('carshare:ajax_booking_quote'), dict(self.window, **params))
+        return json.loads(response.content.decode())
+
+    def test_quote_vehicles_and_types(self):
+        """
+        Many vehicles and types are quoted at once, with one query for the vehicles and none for the rates
+        """
+        vehicle_types.get()
+        with self.assertNumQueries(1):
+            quotes = self.get_quote(vehicle=[v.id for v in self.vehicles], type=[self.vt2.id])
+        premium = {'total': '$117.50', 'days': 1, 'hours': 3}
+        budget = {'total': '$82.04', 'days': 1, 'hours': 3}
+        self.assertEqual(quotes['vehicles'], {
+            str(self.vehicles[0].id): premium, str(self.vehicles[1].id): premium, str(self.vehicles[2].id): budget,
+        })
+        self.assertEqual(quotes['types'], {str(self.vt2.id): budget})
+
+    def test_quote_matches_calculate_cost(self):
+        """
+        Quotes match the single vehicle cost calculation
+        """
+        vehicle = self.vehicles[2]
+        response = self.client.post(reverse('carshare:ajax_booking_calculate_cost', args=[vehicle.id]), self.window)
+        self.assertEqual(json.loads(response.content.decode()), self.get_quote(vehicle=vehicle.id)['vehicles'][
+            str(vehicle.id)])
+
+    def test_quote_types_without_query(self):
+        vehicle_types.get()
+        with self.assertNumQueries(0):
+            quotes = self.get_quote(type=[self.vt1.id, 999])
+        self.assertEqual(list(quotes['types']), [str(self.vt1.id)])
+
+    def test_quote_is_cacheable(self):
+        response = self.client.get(reverse('carshare:ajax_booking_quote'), dict(self.window, type=self.vt1.id))
+        self.assertIn('max-age=', response['Cache-Control'])
+
+    def test_invalid_quote(self):
+        """
+        Invalid windows and ids return an error
+        """
+        self.assertIn('error', self.get_quote(vehicle='abc'))
+        self.window['booking_end_time'] = '09:00'
+        self.window['booking_end_date'] = self.window['booking_start_date']
+        self.assertIn('error', self.get_quote(vehicle=self.vehicles[0].id))
+
+
 @override_settings(STATICFILES_STORAGE=STATICFILES_STORAGE_FOR_TESTS)
 class CarshareBookingListViewTests(TestCase):
     def setUp(self):
@@ -224,6 +467,72 @@ class CarshareBookingListViewTests(TestCase):
         self.assertContains(response, 'You have no upcoming bookings')
         self.assertContains(response, 'You have no past bookings')
 
+    def test_query_count_independent_of_bookings(self):
+        """
+        My Bookings runs the same number of queries no matter how many bookings are listed
+        """
+        self.client.login(email='user@test.com', password='bigbadtestuser')
+        start = timezone.now() - dt.timedelta(days=30)
+        self.create_booking(start, start + dt.timedelta(hours=1))
+        with CaptureQueriesContext(connection) as few_bookings:
+            self.client.get(reverse('carshare:my_bookings'))
+        for i in range(1, 20):
+            self.create_booking(start + dt.timedelta(days=i), start + dt.timedelta(days=i, hours=1))
+        with CaptureQueriesContext(connection) as many_bookings:
+            response = self.client.get(reverse('carshare:my_bookings'))
+        self.assertContains(response, 'Complete - Unpaid', count=2 * 20)
+        self.assertEqual(len(few_bookings), len(many_bookings))
+
+    def test_past_bookings_pages(self):
+        """
+        Past bookings are split into pages, newest first, which each run the same number of queries
+        """
+        self.client.login(email='user@test.com', password='bigbadtestuser')
+        start = timezone.now() - dt.timedelta(days=100)
+        bookings = [self.create_booking(start + dt.timedelta(days=i), start + dt.timedelta(days=i, hours=1))
+                    for i in range(45)]
+        seen = []
+        query_counts = []
+        cursor = None
+        for expected_size in (20, 20, 5):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse('carshare:my_bookings'), {'before': cursor} if cursor else {})
+            query_counts.append(len(queries))
+            self.assertEqual(len(response.context['past_bookings']), expected_size)
+            seen += response.context['past_bookings']
+            cursor = response.context['past_bookings_next_cursor']
+        self.assertIsNone(cursor)
+        self.assertEqual(seen, list(reversed(bookings)))
+        self.assertEqual(len(set(query_counts)), 1)
+
+    def test_past_bookings_invalid_cursor(self):
+        """
+        An invalid cursor shows the newest past bookings
+        """
+        self.client.login(email='user@test.com', password='bigbadtestuser')
+        start = timezone.now() - dt.timedelta(days=2)
+        b = self.create_booking(start, start + dt.timedelta(hours=1))
+        response = self.client.get(reverse('carshare:my_bookings'), {'before': 'abc'})
+        self.assertEqual(response.context['past_bookings'], [b])
+        response = self.client.get(reverse('carshare:ajax_past_bookings'), {'before': 'abc'})
+        self.assertIn('error', json.loads(response.content.decode()))
+
+    def test_past_bookings_json(self):
+        """
+        JSON pages of past bookings follow on from the cursor
+        """
+        self.client.login(email='user@test.com', password='bigbadtestuser')
+        start = timezone.now() - dt.timedelta(days=100)
+        bookings = [self.create_booking(start + dt.timedelta(days=i), start + dt.timedelta(days=i, hours=1))
+                    for i in range(25)]
+        response = self.client.get(reverse('carshare:my_bookings'))
+        cursor = response.context['past_bookings_next_cursor']
+        response = self.client.get(reverse('carshare:ajax_past_bookings'), {'before': cursor})
+        data = json.loads(response.content.decode())
+        self.assertEqual([b['id'] for b in data['bookings']], [b.id for b in reversed(bookings[:5])])
+        self.assertEqual(data['bookings'][0]['status'], 'Complete - Unpaid')
+        self.assertIsNone(data['next'])
+
     def test_current_booking(self):
         """
         User with current booking is displayed on the My Bookings page
@@ -377,3 +686,154 @@ class CarshareBookingDetailViewTests(TestCase):
         self.assertNotContains(response, '>Extend<')
         self.assertNotContains(response, '>Cancel<')
         self.assertContains(response, '>View Invoice<')
+
+
+@override_settings(STATICFILES_STORAGE=STATICFILES_STORAGE_FOR_TESTS)
+@mock.patch('carshare.models.render_pdf_from_template', return_value=b'%PDF-1.4 invoice')
+class CarshareInvoiceViewTests(TestCase):
+    """
+    wkhtmltopdf is replaced by a mock, which also counts how many times PDFs are rendered
+    """
+    def setUp(self):
+        vt = VehicleType.objects.create(description='Premium', hourly_rate=12.50, daily_rate=80.00)
+        p1 = Pod.objects.create(latitude='-39.34523453', longitude='139.53524344', description='Pod 1')
+        v1 = Vehicle.objects.create(pod=p1, type=vt, name='Vehicle1', make='Toyota', model='Yaris', year=2012,
+                                    registration='AAA222')
+        self.u1 = User.objects.create_user(email='test1@test.com', password='flippleflopple', first_name='John',
+                                           last_name='Doe', date_of_birth='1980-01-01')
+        start = timezone.now() + dt.timedelta(days=1)
+        self.booking = Booking.objects.create(user=self.u1, vehicle=v1, schedule_start=start,
+                                              schedule_end=start + dt.timedelta(hours=2))
+        EmailTemplate.objects.create(name='Booking Invoice', subject='Your invoice', body='Invoice {{ invoice.id }}')
+        self.client.login(email='test1@test.com', password='flippleflopple')
+        self.url = reverse('carshare:booking_invoice', args=[self.booking.id])
+
+    def run_worker(self):
+        call_command('render_invoices', processes=0, once=True, stdout=StringIO())
+        call_command('send_emails', once=True, stdout=StringIO())
+
+    def pay(self):
+        self.client.get(reverse('carshare:booking_pay', args=[self.booking.id]))
+        self.run_worker()
+
+    def test_pdf_rendered_once(self, render_pdf):
+        """
+        Paying queues the invoice. The worker renders and stores the PDF, which is then attached to the email and
+        served without rendering again.
+        """
+        self.client.get(reverse('carshare:booking_pay', args=[self.booking.id]))
+        self.assertEqual(render_pdf.call_count, 0)
+        self.assertEqual(len(mail.outbox), 0)
+        self.run_worker()
+        self.assertEqual(render_pdf.call_count, 1)
+        self.assertEqual(mail.outbox[0].attachments[0][1], b'%PDF-1.4 invoice')
+        invoice = Invoice.objects.get(booking=self.booking)
+        self.assertEqual(bytes(invoice.stored_pdf.data), b'%PDF-1.4 invoice')
+        response = self.client.get(self.url)
+        self.assertEqual(response.content, b'%PDF-1.4 invoice')
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertEqual(response['ETag'], '"{0}"'.format(invoice.pdf_hash))
+        self.assertEqual(render_pdf.call_count, 1)
+
+    def test_pdf_not_loaded_with_invoice(self, render_pdf):
+        """
+        Whether an invoice has a current PDF is known without loading the PDF, which is only read when it is needed
+        """
+        Invoice.objects.create(booking=self.booking, amount=self.booking.get_cost()).render_pdf()
+        invoice = Booking.objects.select_related('invoice').get(pk=self.booking.pk).invoice
+        with self.assertNumQueries(0):
+            self.assertTrue(invoice.has_current_pdf())
+        with self.assertNumQueries(1):
+            self.assertEqual(invoice.get_pdf(), b'%PDF-1.4 invoice')
+        self.assertEqual(render_pdf.call_count, 1)
+
+    def test_conditional_get(self, render_pdf):
+        """
+        A matching If-None-Match gets a 304 without the PDF
+        """
+        self.pay()
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_rerendered_after_template_change(self, render_pdf):
+        """
+        PDFs rendered with an older template version are rendered again when next downloaded
+        """
+        invoice = Invoice.objects.create(booking=self.booking, amount=self.booking.get_cost())
+        invoice.get_pdf()
+        Invoice.objects.filter(pk=invoice.pk).update(pdf_version=Invoice.PDF_VERSION - 1)
+        render_pdf.return_value = b'%PDF-1.4 new invoice'
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH='"{0}"'.format(invoice.pdf_hash))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'%PDF-1.4 new invoice')
+        self.assertEqual(Invoice.objects.get(pk=invoice.pk).pdf_version, Invoice.PDF_VERSION)
+
+    def test_other_users_invoice(self, render_pdf):
+        Invoice.objects.create(booking=self.booking, amount=self.booking.get_cost()).get_pdf()
+        User.objects.create_user(email='test2@test.com', password='flippleflopple', first_name='Jane',
+                                 last_name='Doe', date_of_birth='1980-01-01')
+        self.client.login(email='test2@test.com', password='flippleflopple')
+        response = self.client.get(self.url)
+        self.assertRedirects(response, reverse('carshare:index'))
+
+    def test_status(self, render_pdf):
+        """
+        The booking page waits on the invoice until the worker has run
+        """
+        status_url = reverse('carshare:ajax_invoice_status', args=[self.booking.id])
+        self.assertIn('error', json.loads(self.client.get(status_url).content.decode()))
+        self.client.get(reverse('carshare:booking_pay', args=[self.booking.id]))
+        self.assertEqual(json.loads(self.client.get(status_url).content.decode())['status'], InvoiceJob.PENDING)
+        response = self.client.get(reverse('carshare:booking_detail', args=[self.booking.id]))
+        self.assertContains(response, 'Preparing Invoice...')
+        self.run_worker()
+        self.assertEqual(json.loads(self.client.get(status_url).content.decode())['status'], InvoiceJob.DONE)
+        response = self.client.get(reverse('carshare:booking_detail', args=[self.booking.id]))
+        self.assertContains(response, '>View Invoice<')
+
+    def test_failed_job_retried(self, render_pdf):
+        """
+        A failed render is retried later with backoff, and given up on after MAX_ATTEMPTS
+        """
+        render_pdf.side_effect = OSError('wkhtmltopdf crashed')
+        with self.assertLogs('carshare.management.commands.render_invoices', 'ERROR'):
+            self.pay()
+        job = InvoiceJob.objects.get(invoice__booking=self.booking)
+        self.assertEqual((job.status, job.attempts), (InvoiceJob.PENDING, 1))
+        self.assertIn('wkhtmltopdf crashed', job.error)
+        self.assertGreater(job.run_after, timezone.now())
+        for attempt in range(2, InvoiceJob.MAX_ATTEMPTS + 1):
+            InvoiceJob.objects.filter(pk=job.pk).update(run_after=timezone.now())
+            with self.assertLogs('carshare.management.commands.render_invoices', 'ERROR'):
+                self.run_worker()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (InvoiceJob.FAILED, InvoiceJob.MAX_ATTEMPTS))
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_timed_out_job_reclaimed(self, render_pdf):
+        """
+        A job left running by a worker that died is claimed again once it times out
+        """
+        self.client.get(reverse('carshare:booking_pay', args=[self.booking.id]))
+        now = timezone.now()
+        self.assertEqual(len(InvoiceJob.objects.claim(10, now)), 1)
+        self.assertEqual(InvoiceJob.objects.claim(10, now + dt.timedelta(minutes=1)), [])
+        self.assertEqual(len(InvoiceJob.objects.claim(10, now + InvoiceJob.TIMEOUT + dt.timedelta(minutes=1))), 1)
+
+    def test_retry_only_unfinished_jobs(self, render_pdf):
+        """
+        The admin's retry action leaves finished and running jobs alone, so invoices aren't emailed twice
+        """
+        self.pay()
+        job = InvoiceJob.objects.get(invoice__booking=self.booking)
+        retry_jobs(None, None, InvoiceJob.objects.all())
+        job.refresh_from_db()
+        self.assertEqual(job.status, InvoiceJob.DONE)
+        InvoiceJob.objects.filter(pk=job.pk).update(status=InvoiceJob.FAILED)
+        retry_jobs(None, None, InvoiceJob.objects.all())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (InvoiceJob.PENDING, 0))
@@ -18,6 +18,7 @@ urlpatterns = [
     url(r'privacy/$', views.privacy, name='privacy'),
     url(r'about-us/$', views.about_us, name='about_us'),
     url(r'find-a-car/$', views.find_a_car, name='find_a_car'),
+    url(r'find-a-car/nearby/$', views.nearby_vehicles, name='nearby_vehicles'),
     url(r'bookings/new/(?P<vehicle_id>[0-9]+)/$', views.booking_timeline, name='booking_create'),
     url(r'bookings/new/(?P<vehicle_id>[0-9]+)/(?P<year>[0-9]{4})/(?P<month>[0-9]{1,2})/(?P<day>[0-9]{1,2})/$',
         views.booking_timeline, name='booking_create_date'),
@@ -34,6 +35,10 @@ urlpatterns = [
     url(r'bookings/(?P<booking_id>[0-9]+)/invoice/$', views.booking_invoice, name='booking_invoice'),
     # AJAX
     url(r'bookings/new/(?P<vehicle_id>[0-9]+)/calculate-cost/', views.booking_calculate_cost, name='ajax_booking_calculate_cost'),
+    url(r'bookings/new/(?P<vehicle_id>[0-9]+)/free-slots/', views.vehicle_free_slots, name='ajax_vehicle_free_slots'),
+    url(r'bookings/(?P<booking_id>[0-9]+)/invoice/status/$', views.invoice_status, name='ajax_invoice_status'),
+    url(r'bookings/quote/$', views.booking_quote, name='ajax_booking_quote'),
+    url(r'bookings/past/$', views.past_bookings_page, name='ajax_past_bookings'),
 ]
 
 
@@ -7,17 +7,34 @@ from django.contrib import messages
 from django.core.mail import EmailMessage, BadHeaderError
 from django.http import HttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
 from django.contrib.auth.decorators import login_required
+from django.views.decorators.http import condition
 from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.utils.formats import date_format
+from django.utils.http import quote_etag
+from django.db import transaction
 from django.db.models import Q
 
-from wkhtmltopdf.views import PDFTemplateResponse
-
 import datetime as dt
 import json
 
-from .forms import ContactForm, BookingForm, ExtendBookingForm
-from .models import Vehicle, Booking, Invoice, Pod
+from .availability import build_day_timeline
+from .forms import ContactForm, BookingForm, BookingWindowForm, ExtendBookingForm
+from .managers import BookingUnavailable
+from .spatial import haversine_km, pod_tree
+from .models import Vehicle, Booking, Invoice, InvoiceJob, Pod, SiteStatistics
+from .pricing import quote_vehicle_type, vehicle_types
+from emails.utils import queue_email
+
+
+# Number of past bookings shown at a time on My Bookings
+PAST_BOOKINGS_PAGE_SIZE = 20
+
+# Most vehicles and vehicle types that can be quoted in one request, and how long (in seconds) quotes can be cached
+MAX_QUOTES = 100
+QUOTE_MAX_AGE = 60
 
 
 def index(request):
@@ -50,15 +67,13 @@ def about_us(request):
     """
     # Owner cost: $75 per trip, calculated using values from GoGet (10,000 kms per annum, car is used 20
     # hours per week, petrol $1.44 per litre). Assuming 20 hours is two trips on average.
-    owner_cost = 75 * Booking.objects.count()
-    vroom_cost = 0.0
-    for b in Booking.objects.filter(schedule_end__lt=timezone.now()):
-        vroom_cost += b.calculate_cost()
-    estimated_savings = owner_cost - vroom_cost
+    stats = SiteStatistics.get()
+    owner_cost = 75 * stats.num_bookings
+    estimated_savings = owner_cost - stats.completed_cost
     context = {
-        'num_vehicles': Vehicle.objects.count(),
-        'num_locations': Pod.objects.count(),
-        'num_shares': Booking.objects.count(),
+        'num_vehicles': stats.num_vehicles,
+        'num_locations': stats.num_pods,
+        'num_shares': stats.num_bookings,
         'estimated_savings': int(estimated_savings),
     }
     return render(request, 'carshare/about_us.html', context)
@@ -85,7 +100,7 @@ def contact_us(request):
                     to=['admin@vroomcs.org'],
                     reply_to=[contact_email],
                 )
-                email.send()
+                queue_email(email)
             except BadHeaderError:
                 return HttpResponse('Invalid header found.')
             return render(request, "carshare/contact_us_success.html")
@@ -100,19 +115,58 @@ def find_a_car(request):
     Interactive map page
     """
     # Get all active vehicles that have been assigned to a pod
-    active_vehicles_with_pods = Vehicle.objects.filter(active=True).exclude(pod__isnull=True)
+    active_vehicles_with_pods = Vehicle.objects.with_availability().filter(active=True).exclude(pod__isnull=True)
     context = {
         'vehicles': active_vehicles_with_pods
     }
     return render(request, "carshare/find_a_car.html", context)
 
 
+def nearby_vehicles(request):
+    """
+    Finds active vehicles near a location (from GET). Either the k nearest (default 10), all within a radius in km, or
+    all within a bounding box, ordered by distance.
+    """
+    try:
+        latitude = float(request.GET['lat'])
+        longitude = float(request.GET['lng'])
+        if 'north' in request.GET:
+            bounds = [float(request.GET[b]) for b in ('south', 'west', 'north', 'east')]
+            pods = Pod.objects.within_bounds(*bounds).values_list('id', 'latitude', 'longitude')
+            nearby = sorted((haversine_km(latitude, longitude, lat, lng), pod_id) for pod_id, lat, lng in pods)
+        elif 'radius' in request.GET:
+            nearby = pod_tree.get().within_radius(latitude, longitude, min(float(request.GET['radius']), 50))
+        else:
+            nearby = pod_tree.get().nearest(latitude, longitude, min(int(request.GET.get('k', 10)), 50))
+    except (KeyError, ValueError):
+        return HttpResponse(json.dumps({'error': 'A valid lat and lng are required'}))
+
+    distances = {pod_id: distance for distance, pod_id in nearby}
+    vehicles = Vehicle.objects.with_availability().filter(active=True, pod_id__in=distances)
+    results = []
+    for vehicle in sorted(vehicles, key=lambda v: distances[v.pod_id]):
+        results.append({
+            'id': vehicle.id,
+            'name': vehicle.name,
+            'make': vehicle.make,
+            'model': vehicle.model,
+            'car_type': vehicle.type.description,
+            'available': vehicle.is_available(),
+            'lat': float(vehicle.pod.latitude),
+            'lng': float(vehicle.pod.longitude),
+            'pod_description': vehicle.pod.description,
+            'distance_km': round(distances[vehicle.pod_id], 3),
+            'booking_url': reverse('carshare:booking_create', args=[vehicle.id]),
+        })
+    return HttpResponse(json.dumps({'vehicles': results}))
+
+
 @login_required
 def booking_timeline(request, vehicle_id, year=None, month=None, day=None):
     """
     The booking timeline view, showing availability of selected vehicle and allowing user to choose a booking start time
     """
-    vehicle = get_object_or_404(Vehicle, id=vehicle_id)
+    vehicle = get_object_or_404(Vehicle.objects.select_related('pod', 'type'), id=vehicle_id)
 
     # Redirect if vehicle is inactive
     if not vehicle.is_active():
@@ -124,15 +178,7 @@ def booking_timeline(request, vehicle_id, year=None, month=None, day=None):
     else:
         date = timezone.localtime().date()
     # Build dict of hours and whether that hour is available
-    hours = {}
-    for i in range(0, 24):
-        datetime = timezone.make_aware(dt.datetime.combine(date, dt.time(hour=i, minute=0)), timezone.get_current_timezone())
-        if vehicle.is_available_at(datetime=datetime) and datetime > timezone.localtime() - dt.timedelta(hours=1):
-            hours[i] = 'available'
-        elif not vehicle.get_booking_at(datetime=datetime) is None and vehicle.get_booking_at(datetime=datetime).user == request.user:
-            hours[i] = 'booked_by_user'
-        else:
-            hours[i] = 'unavailable'
+    hours = build_day_timeline(vehicle, date, request.user)
     context = {
         'vehicle': vehicle,
         'hours': hours,
@@ -165,23 +211,13 @@ def booking_create(request, vehicle_id, year=None, month=None, day=None, hour=No
             # Custom validation
             is_valid_booking = True
             # Prevent booking overlapping with existing booking
-            existing_bookings = Booking.objects.filter(vehicle=vehicle, cancelled__isnull=True)
-            for b in existing_bookings:
-                if (b.schedule_start <= booking_start < b.schedule_end or
-                        b.schedule_start < booking_end <= b.schedule_end or
-                        booking_start <= b.schedule_start and booking_end >= b.schedule_end):
-                    is_valid_booking = False
-                    booking_form.add_error(None, "The selected vehicle is unavailable within the chosen times")
-                    break
+            if vehicle.booking_set.overlapping(booking_start, booking_end).exists():
+                is_valid_booking = False
+                booking_form.add_error(None, "The selected vehicle is unavailable within the chosen times")
             # Prevent multiple bookings for the same user during the same time period
-            user_bookings = request.user.booking_set.filter(cancelled__isnull=True)
-            for b in user_bookings:
-                if (b.schedule_start <= booking_start < b.schedule_end or
-                        b.schedule_start < booking_end <= b.schedule_end or
-                        booking_start <= b.schedule_start and booking_end >= b.schedule_end):
-                    is_valid_booking = False
-                    booking_form.add_error(None, "You already have a booking within the selected time frame")
-                    break
+            if request.user.booking_set.overlapping(booking_start, booking_end).exists():
+                is_valid_booking = False
+                booking_form.add_error(None, "You already have a booking within the selected time frame")
 
             if is_valid_booking:
                 # Save details in session, but also provide to template context. When confirmed, we'll create the
@@ -236,22 +272,29 @@ def booking_confirm(request):
     except KeyError:
         return redirect('carshare:index')
 
-    booking = Booking(
-        user=request.user,
-        vehicle=vehicle,
-        schedule_start=schedule_start,
-        schedule_end=schedule_end,
-    )
-    booking.save()
-
-    # Send confirmation email
-    request.user.send_email(
-       template_name='Booking Confirmation',
-       context={
-          'user': request.user,
-          'booking': booking,
-        },
-     )
+    def send_confirmation(booking):
+        # Queued in the booking's transaction, so it is only sent if the booking is saved
+        request.user.send_email(
+            template_name='Booking Confirmation',
+            context={
+                'user': request.user,
+                'booking': booking,
+            },
+        )
+
+    # Availability is checked again while saving, since someone else may have booked the vehicle while this booking
+    # was being reviewed
+    try:
+        booking = Booking.objects.create_booking(
+            user=request.user,
+            vehicle=vehicle,
+            schedule_start=schedule_start,
+            schedule_end=schedule_end,
+            on_save=send_confirmation,
+        )
+    except BookingUnavailable as e:
+        messages.error(request, str(e))
+        return redirect('carshare:booking_create', vehicle.id)
     messages.success(request, 'Booking created successfully')
     return redirect('carshare:booking_detail', booking.id)
 
@@ -268,26 +311,55 @@ def booking_detail(request, booking_id):
         return redirect('carshare:index')
     context = {
         'booking': booking,
+        'invoice_status': get_invoice_status(booking),
     }
     return render(request, "carshare/bookings/detail.html", context)
 
 
+def get_invoice_status(booking):
+    """
+    Returns the status of the booking's invoice job (InvoiceJob.DONE for invoices made before there were jobs), or
+    None if the booking has no invoice
+    """
+    statuses = list(Invoice.objects.filter(booking=booking).values_list('job__status', flat=True))
+    if not statuses:
+        return None
+    return statuses[0] or InvoiceJob.DONE
+
+
+def get_past_bookings(user, now):
+    """
+    Returns the user's finished and cancelled bookings, with everything the bookings table needs in the same query
+    """
+    return user.booking_set.filter(
+        Q(schedule_end__lte=now) | Q(cancelled__isnull=False)
+    ).with_status(now).select_related('vehicle', 'invoice')
+
+
 @login_required
 def my_bookings(request):
     """
-    Page displaying all of a user's bookings, split into logical groups
+    Page displaying all of a user's bookings, split into logical groups. Past bookings are shown a page at a time.
     """
     # Get list past and upcoming bookings, as well as the current booking
     now = timezone.localtime()
     current_booking = request.user.get_current_booking()
-    upcoming_bookings = request.user.booking_set.filter(
+    # Statuses are worked out in the same query, so the table doesn't need a query per row
+    upcoming_bookings = request.user.booking_set.with_status(now).select_related('vehicle').filter(
         schedule_start__gt=now).filter(cancelled__isnull=True).order_by('schedule_start')
-    past_bookings = request.user.booking_set.filter(
-        Q(schedule_end__lte=now) | Q(cancelled__isnull=False)).order_by('-schedule_start')
+    cursor = request.GET.get('before')
+    try:
+        past_bookings, next_cursor = get_past_bookings(request.user, now).keyset_page(cursor, PAST_BOOKINGS_PAGE_SIZE)
+    except ValueError:
+        # Bad cursor, so start again from the newest
+        cursor = None
+        past_bookings, next_cursor = get_past_bookings(request.user, now).keyset_page(size=PAST_BOOKINGS_PAGE_SIZE)
     context = {
         'current_booking': current_booking,
         'upcoming_bookings': upcoming_bookings,
         'past_bookings': past_bookings,
+        'past_bookings_cursor': cursor,
+        'past_bookings_next_cursor': next_cursor,
     }
     return render(request, "carshare/bookings/my_bookings.html", context)
 
@@ -314,45 +386,44 @@ def booking_extend(request, booking_id):
             # Custom validation
             is_valid_booking = True
             # Make sure new end date doesn't clash with existing booking
-            existing_bookings = Booking.objects.filter(
-                vehicle=booking.vehicle, cancelled__isnull=True
-            ).exclude(user=request.user)
-            for b in existing_bookings:
-                if (b.schedule_start <= booking.schedule_start <= b.schedule_end or
-                        b.schedule_start <= new_schedule_end <= b.schedule_end or
-                        booking.schedule_start <= b.schedule_start and new_schedule_end >= b.schedule_end):
-                    is_valid_booking = False
-                    extend_booking_form.add_error(None, "The new end date overlaps with existing booking. "
-                                                        "The latest date you can choose is {0}".format(b.schedule_start))
-                    break
-            user_bookings = request.user.booking_set.filter(cancelled__isnull=True).exclude(id__exact=booking.id)
-            for b in user_bookings:
-                if (b.schedule_start <= booking.schedule_start <= b.schedule_end or
-                        b.schedule_start <= new_schedule_end <= b.schedule_end or
-                        booking.schedule_start <= b.schedule_start and new_schedule_end >= b.schedule_end):
-                    is_valid_booking = False
-                    extend_booking_form.add_error(
-                        None, "The new booking end overlaps with one of your existing bookings"
-                    )
-                    break
+            clashing_booking = booking.vehicle.booking_set.overlapping(
+                booking.schedule_start, new_schedule_end
+            ).exclude(user=request.user).order_by('schedule_start').first()
+            if clashing_booking:
+                is_valid_booking = False
+                extend_booking_form.add_error(None, "The new end date overlaps with existing booking. "
+                                                    "The latest date you can choose is {0}".format(
+                                                        clashing_booking.schedule_start))
+            user_bookings = request.user.booking_set.overlapping(
+                booking.schedule_start, new_schedule_end
+            ).exclude(id__exact=booking.id)
+            if user_bookings.exists():
+                is_valid_booking = False
+                extend_booking_form.add_error(
+                    None, "The new booking end overlaps with one of your existing bookings"
+                )
 
-            # New booking end is valid? Save booking send email
+            # New booking end is valid? Save booking send email (the checks are repeated while saving, in case
+            # another booking was made in the meantime)
             if is_valid_booking:
-                booking.schedule_end = new_schedule_end
-                booking.save()
-
-                # Send confirmation email
-                request.user.send_email(
-                    template_name='Booking Extended',
-                    context={
-                        'booking': booking,
-                    },
-                )
+                def send_confirmation(booking):
+                    # Queued in the booking's transaction, so it is only sent if the extension is saved
+                    request.user.send_email(
+                        template_name='Booking Extended',
+                        context={
+                            'booking': booking,
+                        },
+                    )
 
-                messages.success(
-                    request, "Your current booking has been extended. You will receive email confirmation shortly."
-                )
-                return redirect('carshare:booking_detail', booking_id)
+                try:
+                    Booking.objects.extend_booking(booking, new_schedule_end, on_save=send_confirmation)
+                except BookingUnavailable as e:
+                    extend_booking_form.add_error(None, str(e))
+                else:
+                    messages.success(
+                        request, "Your current booking has been extended. You will receive email confirmation shortly."
+                    )
+                    return redirect('carshare:booking_detail', booking_id)
     else:
         extend_booking_form = ExtendBookingForm(current_booking_end=booking.schedule_end)
 
@@ -384,14 +455,15 @@ def booking_cancel(request, booking_id):
 
     # Cancel booking
     booking.cancelled = timezone.now()
-    booking.save()
-    # Send email confirmation
-    request.user.send_email(
-        template_name='Booking Cancelled',
-        context={
-            'booking': booking,
-        },
-    )
+    with transaction.atomic():
+        booking.save()
+        # Send email confirmation
+        request.user.send_email(
+            template_name='Booking Cancelled',
+            context={
+                'booking': booking,
+            },
+        )
     messages.success(request, 'Successfully cancelled booking for {0} the {1} {2}'.format(booking.vehicle.name,
                                                                                           booking.vehicle.make,
                                                                                           booking.vehicle.model))
@@ -416,66 +488,172 @@ def booking_pay(request, booking_id):
         messages.info(request, 'This booking has already been paid')
         return redirect('carshare:booking_detail', booking.id)
 
-    # Create invoice and email it to user
-    invoice = Invoice(booking=booking, amount=booking.calculate_cost())
-    invoice.save()
-    context = {'invoice': invoice}
-    invoice_filename = 'invoice_{0}.pdf'.format(invoice.id)
-    response = PDFTemplateResponse(
-        request=request,
-        template='carshare/pdf/invoice.html',
-        context=context,
-    )
-    request.user.send_email(
-        template_name='Booking Invoice',
-        context=context,
-        attachment_filename=invoice_filename,
-        attachment_data=response.rendered_content,
-    )
-    messages.success(request, 'Thank you for your booking. An invoice has been emailed to you.')
+    # Create invoice, and leave rendering and emailing it to the invoice worker (manage.py render_invoices)
+    with transaction.atomic():
+        invoice = Invoice.objects.create(booking=booking, amount=booking.get_cost())
+        InvoiceJob.objects.create(invoice=invoice)
+    messages.success(request, 'Thank you for your booking. An invoice will be emailed to you shortly.')
     return redirect('carshare:booking_detail', booking.id)
 
 
+def invoice_etag(request, booking_id):
+    """
+    ETag for a booking's invoice PDF: the hash of the stored PDF, if it is up to date
+    """
+    stored = Invoice.objects.filter(booking_id=booking_id, booking__user_id=request.user.id).values_list(
+        'pdf_hash', 'pdf_version').first()
+    if stored and stored[0] and stored[1] == Invoice.PDF_VERSION:
+        return stored[0]
+    return None
+
+
+@condition(etag_func=invoice_etag)
 def booking_invoice(request, booking_id):
     """
-    Creates and displays an invoice as PDF for a booking
+    Displays the invoice for a booking as PDF. The PDF is rendered once and then served from the database, and
+    browsers that already have it (If-None-Match) get a 304.
     """
     booking = get_object_or_404(Booking, pk=booking_id)
     if request.user != booking.user:
         messages.error(request, 'You do not have permission to view that invoice')
         return redirect('carshare:index')
-    # Render PDF invoice
-    return PDFTemplateResponse(
-        request=request,
-        template='carshare/pdf/invoice.html',
-        context={'invoice': booking.invoice},
-    )
+    invoice = booking.invoice
+    response = HttpResponse(invoice.get_pdf(), content_type='application/pdf')
+    # The PDF may have just been rendered, after the ETag was worked out
+    response['ETag'] = quote_etag(invoice.pdf_hash)
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
 
 
 #
 # AJAX views
 #
+def invoice_status(request, booking_id):
+    """
+    Returns the status of a booking's invoice (from the invoice worker), for the booking page to poll
+    """
+    booking = get_object_or_404(Booking, pk=booking_id)
+    if request.user != booking.user:
+        return HttpResponse(json.dumps({'error': 'You do not have permission to view that invoice'}))
+    status = get_invoice_status(booking)
+    if status is None:
+        return HttpResponse(json.dumps({'error': 'This booking has not been paid'}))
+    return HttpResponse(json.dumps({
+        'status': status,
+        'url': reverse('carshare:booking_invoice', args=[booking.id]),
+    }))
+
+
 def booking_calculate_cost(request, vehicle_id):
     """
     Calculates booking cost given start and end times (from POST)
     """
     vehicle = get_object_or_404(Vehicle, id=vehicle_id)
     if request.method == 'POST':
-        booking_form = BookingForm(request.POST)
-        if booking_form.is_valid():
-            # Create booking object using provided data and use its method
-            data = booking_form.cleaned_data
-            booking_start = data['schedule_start']
-            booking_end = data['schedule_end']
-            booking = Booking(user=request.user, vehicle=vehicle, schedule_start=booking_start, schedule_end=booking_end)
-            # DO NOT SAVE BOOKING!
-            days, hours = booking.calculate_daily_hourly_billable_counts()
-            cost = {
-                'total': '${0:.2f}'.format(booking.calculate_cost()),
-                'days': days,
-                'hours': hours,
-            }
+        window_form = BookingWindowForm(request.POST)
+        if window_form.is_valid():
+            length = window_form.cleaned_data['schedule_end'] - window_form.cleaned_data['schedule_start']
             # Return calculated cost as string
-            return HttpResponse(json.dumps(cost))
+            return HttpResponse(json.dumps(get_quote(length, vehicle.type_id)))
         else:
-            return HttpResponse(json.dumps({'error': booking_form.errors}))
+            return HttpResponse(json.dumps({'error': window_form.errors}))
+
+
+def booking_quote(request):
+    """
+    Calculates the cost of a booking window (from GET) for several vehicles and/or vehicle types at once, given as
+    e.g. ?vehicle=1&vehicle=2&type=3. Rates come from the vehicle type table, so only the vehicles need a query.
+    Only the window and rates go into the response, so it can be cached briefly.
+    """
+    window_form = BookingWindowForm(request.GET)
+    if not window_form.is_valid():
+        return HttpResponse(json.dumps({'error': window_form.errors}))
+    try:
+        vehicle_ids = {int(vehicle_id) for vehicle_id in request.GET.getlist('vehicle')}
+        type_ids = {int(type_id) for type_id in request.GET.getlist('type')}
+    except ValueError:
+        return HttpResponse(json.dumps({'error': 'Vehicles and types must be given by id'}))
+    if len(vehicle_ids) + len(type_ids) > MAX_QUOTES:
+        return HttpResponse(json.dumps({'error': 'Too many vehicles or types (at most {0})'.format(MAX_QUOTES)}))
+
+    length = window_form.cleaned_data['schedule_end'] - window_form.cleaned_data['schedule_start']
+    types_by_vehicle = {}
+    if vehicle_ids:
+        types_by_vehicle = dict(Vehicle.objects.filter(id__in=vehicle_ids).values_list('id', 'type_id'))
+    # The cost only depends on the rates, so each type is priced once however many of its vehicles were asked for.
+    # Unknown type ids are left out rather than looked up.
+    known_type_ids = type_ids.intersection(vehicle_types.get())
+    quotes = {}
+    for type_id in known_type_ids | set(types_by_vehicle.values()):
+        quotes[type_id] = get_quote(length, type_id)
+    response = HttpResponse(json.dumps({
+        'vehicles': {vehicle_id: quotes[type_id] for vehicle_id, type_id in types_by_vehicle.items()},
+        'types': {type_id: quotes[type_id] for type_id in known_type_ids},
+    }))
+    patch_cache_control(response, max_age=QUOTE_MAX_AGE)
+    return response
+
+
+def get_quote(length, type_id):
+    """
+    Returns the cost of a booking of the given length for a vehicle type, with the billable days and hours it is made
+    up of
+    """
+    days, hours, cost = quote_vehicle_type(type_id, length)
+    return {
+        'total': '${0:.2f}'.format(cost),
+        'days': days,
+        'hours': hours,
+    }
+
+
+def vehicle_free_slots(request, vehicle_id):
+    """
+    Finds the next times a vehicle is free (from GET), so users don't have to step through the timeline day by day
+    """
+    vehicle = get_object_or_404(Vehicle, id=vehicle_id)
+    try:
+        length = int(request.GET.get('length', 1))
+        count = int(request.GET.get('count', 5))
+    except ValueError:
+        return HttpResponse(json.dumps({'error': 'Length and count must be whole numbers'}))
+    if not 1 <= length <= Booking.MAX_LENGTH_DAYS * 24 or not 1 <= count <= 20:
+        return HttpResponse(json.dumps({'error': 'Length or count is out of range'}))
+
+    slots = []
+    for start, end in vehicle.get_free_slots(dt.timedelta(hours=length), count=count):
+        local_start = timezone.localtime(start)
+        slots.append({
+            'start': local_start.isoformat(),
+            'end': timezone.localtime(end).isoformat(),
+            'url': reverse('carshare:booking_create_final_length', args=[
+                vehicle.id, local_start.year, local_start.month, local_start.day, local_start.hour, length
+            ]),
+        })
+    return HttpResponse(json.dumps({'slots': slots}))
+
+
+@login_required
+def past_bookings_page(request):
+    """
+    Returns a page of the user's past bookings (from GET cursor), for loading more history on My Bookings
+    """
+    try:
+        bookings, next_cursor = get_past_bookings(request.user, timezone.now()).keyset_page(
+            request.GET.get('before'), PAST_BOOKINGS_PAGE_SIZE
+        )
+    except ValueError:
+        return HttpResponse(json.dumps({'error': 'Invalid cursor'}))
+    results = []
+    for booking in bookings:
+        results.append({
+            'id': booking.id,
+            'url': reverse('carshare:booking_detail', args=[booking.id]),
+            'vehicle': str(booking.vehicle),
+            'vehicle_name': booking.vehicle.name,
+            'schedule_start': date_format(timezone.localtime(booking.schedule_start), 'DATETIME_FORMAT'),
+            'schedule_start_date': date_format(timezone.localtime(booking.schedule_start), 'd M Y'),
+            'schedule_end': date_format(timezone.localtime(booking.schedule_end), 'DATETIME_FORMAT'),
+            'status': booking.get_status(),
+        })
+    return HttpResponse(json.dumps({'bookings': results, 'next': next_cursor}))
@@ -4,12 +4,33 @@
 #
 
 from django.contrib import admin
+from django.utils import timezone
 
-from .models import EmailTemplate
+from .models import EmailTemplate, OutboxEmail
+
+
+# Bulk action for sending dead emails again. Sent emails would be delivered twice, and sending emails are still held by
+# a worker (they are sent again anyway if they time out).
+def retry_emails(modeladmin, request, queryset):
+    queryset.exclude(status__in=[OutboxEmail.SENT, OutboxEmail.SENDING]).update(
+        status=OutboxEmail.PENDING, attempts=0, run_after=timezone.now()
+    )
+
+
+retry_emails.short_description = "Retry selected emails"
 
 
 class EmailTemplateAdmin(admin.ModelAdmin):
     list_display = ['name', 'subject']
 
 
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = ['id', 'subject', 'to', 'status', 'attempts', 'created', 'sent']
+    list_filter = ['status']
+    ordering = ['-id']
+    exclude = ['attachment_data']
+    actions = [retry_emails]
+
+
 admin.site.register(EmailTemplate, EmailTemplateAdmin)
+admin.site.register(OutboxEmail, OutboxEmailAdmin)
@@ -0,0 +1,157 @@
+#
+#   Author(s): Huon Imberger
+#   Description: SendGrid email backend that sends emails with the same content in one API request
+#
+
+from django.conf import settings
+
+from collections import OrderedDict
+import json
+import logging
+import time
+
+from python_http_client.exceptions import HTTPError
+from sgbackend import SendGridBackend
+
+
+logger = logging.getLogger(__name__)
+
+
+class BatchingSendGridBackend(SendGridBackend):
+    """
+    Sends emails with the SendGrid v3 API, grouping emails that only differ by recipients, subject and substitutions
+    (e.g. the same notification going to many users) into one request with a personalization for each email.
+
+    Settings (all optional):
+    SENDGRID_API_HOST: base URL of the API, e.g. a local stub for testing
+    SENDGRID_MAX_RECIPIENTS: recipients allowed in one request (SendGrid's limit is 1000)
+    SENDGRID_MAX_RETRIES: times a request is retried after a rate limit, server or connection error
+    SENDGRID_RETRY_DELAY: seconds before the first retry, doubled for each retry after it
+    SENDGRID_TIMEOUT: seconds to wait for a response
+
+    Emails can have a substitutions attribute, a dict of tags in the subject and body to replace with a recipient's
+    values (see emails.utils.build_substituted_emails), so personalised emails can be batched too.
+    """
+    supports_substitutions = True
+
+    def __init__(self, fail_silently=False, **kwargs):
+        super(BatchingSendGridBackend, self).__init__(fail_silently=fail_silently, **kwargs)
+        self.host = getattr(settings, 'SENDGRID_API_HOST', 'https://api.sendgrid.com')
+        self.max_recipients = getattr(settings, 'SENDGRID_MAX_RECIPIENTS', 1000)
+        self.max_retries = getattr(settings, 'SENDGRID_MAX_RETRIES', 3)
+        self.retry_delay = getattr(settings, 'SENDGRID_RETRY_DELAY', 1)
+        self.timeout = getattr(settings, 'SENDGRID_TIMEOUT', 30)
+        self.sg.client.host = self.host
+
+    def send_messages(self, emails):
+        """
+        Sends the emails, returning the number sent. Raises the first error unless fail_silently is set.
+        """
+        if not emails:
+            return 0
+        errors = self.send_batch(emails)
+        for error in errors:
+            if error is not None and not self.fail_silently:
+                raise error
+        return errors.count(None)
+
+    def send_batch(self, emails):
+        """
+        Sends the emails in as few requests as possible, and never raises
+        :return: list with an error (or None if it was sent) for each email, in the same order as the emails
+        """
+        errors = [None] * len(emails)
+        for request_body, indexes in self.build_requests(emails):
+            error = self.post(request_body)
+            if error is not None and len(indexes) > 1 and not self.is_retryable(error):
+                # The whole request was rejected (e.g. one bad address), so send each email on its own to find out
+                # which ones are at fault, rather than failing them all
+                for index in indexes:
+                    errors[index] = self.post(self.build_mail(emails[index]))
+            else:
+                for index in indexes:
+                    errors[index] = error
+        return errors
+
+    def build_requests(self, emails):
+        """
+        Groups the emails by content (everything but recipients, subject and substitutions) into request bodies, each
+        with at most max_recipients recipients
+        :return: list of (request body, indexes of the emails in it)
+        """
+        groups = OrderedDict()
+        for index, email in enumerate(emails):
+            mail = self.build_mail(email)
+            personalizations = mail.pop('personalizations')
+            # The subject is set on each personalization as well, so it doesn't need to match
+            mail.pop('subject', None)
+            key = json.dumps(mail, sort_keys=True)
+            if key not in groups:
+                groups[key] = (mail, [])
+            groups[key][1].append((index, personalizations[0]))
+
+        requests = []
+        for mail, personalizations in groups.values():
+            batch, recipients = [], 0
+            for index, personalization in personalizations:
+                count = sum(len(personalization.get(field, ())) for field in ('to', 'cc', 'bcc'))
+                if batch and recipients + count > self.max_recipients:
+                    requests.append(self.make_request_body(mail, batch))
+                    batch, recipients = [], 0
+                batch.append((index, personalization))
+                recipients += count
+            requests.append(self.make_request_body(mail, batch))
+        return requests
+
+    def build_mail(self, email):
+        """
+        Builds the request body for a single email, with its substitutions (the base backend only sends them for
+        SendGrid templates)
+        """
+        mail = self._build_sg_mail(email)
+        substitutions = getattr(email, 'substitutions', None)
+        if substitutions and not hasattr(email, 'template_id'):
+            mail['personalizations'][0]['substitutions'] = dict(substitutions)
+        return mail
+
+    @staticmethod
+    def make_request_body(mail, batch):
+        request_body = dict(mail)
+        request_body['subject'] = batch[0][1].get('subject')
+        request_body['personalizations'] = [personalization for _, personalization in batch]
+        return request_body, [index for index, _ in batch]
+
+    def post(self, request_body):
+        """
+        Posts a request body to the mail send endpoint, retrying with backoff after a retryable error
+        :return: the error, or None if the request succeeded
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.sg.client.mail.send.post(request_body=request_body, timeout=self.timeout)
+                return None
+            except (HTTPError, OSError) as e:
+                # OSError includes URLError, timeouts and dropped connections
+                if attempt == self.max_retries or not self.is_retryable(e):
+                    return e
+                logger.warning('SendGrid request failed (%r), retrying', e)
+                time.sleep(self.get_retry_delay(e, attempt))
+
+    @staticmethod
+    def is_retryable(error):
+        """
+        Rate limits, server errors and connection errors are worth retrying. Other errors will happen again.
+        """
+        if isinstance(error, HTTPError):
+            return error.status_code == 429 or error.status_code >= 500
+        return True
+
+    def get_retry_delay(self, error, attempt):
+        """
+        Waits as long as a rate limit response asks, otherwise backs off exponentially
+        """
+        if isinstance(error, HTTPError) and error.headers is not None:
+            retry_after = error.headers.get('Retry-After')
+            if retry_after and retry_after.isdigit():
+                return int(retry_after)
+        return self.retry_delay * 2 ** attempt
@@ -0,0 +1,55 @@
+#
+#   Author(s): Huon Imberger
+#   Description: Compares the cost of rendering an email with and without the compiled template cache
+#
+
+from django.core.management.base import BaseCommand, CommandError
+from django.template import Engine, Context
+from django.template.loader import render_to_string
+
+import time
+
+from emails.models import EmailTemplate
+from emails.utils import render_templated_email
+
+
+def render_uncached(template_name, context):
+    """
+    Renders an email the way it was done before templates were cached: a new engine, query and compile every time
+    """
+    template_engine = Engine()
+    email_template = EmailTemplate.objects.get(name=template_name)
+    subject_template = template_engine.from_string(email_template.subject)
+    body_template = template_engine.from_string(email_template.body)
+    email_context = Context(context)
+    email_body = body_template.render(email_context)
+    return subject_template.render(email_context), render_to_string(
+        'emails/default.html',
+        context={'rendered_email_body': email_body}
+    )
+
+
+class Command(BaseCommand):
+    help = 'Times rendering an email template with and without the compiled template cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--template', help='Name of the email template (default: the first one)')
+        parser.add_argument('--count', type=int, default=500, help='Number of emails rendered each way')
+
+    def handle(self, *args, **options):
+        template_name = options['template']
+        if template_name is None:
+            template_name = EmailTemplate.objects.order_by('id').values_list('name', flat=True).first()
+        if template_name is None or not EmailTemplate.objects.filter(name=template_name).exists():
+            raise CommandError('No email template to render (load the email_templates fixture)')
+
+        # Missing variables render as empty strings, which is fine for timing
+        context = {}
+        for label, render in (('Uncached', render_uncached), ('Cached', render_templated_email)):
+            # Warm up (fills the cache, and the template loader's cache for the wrapper)
+            render(template_name, context)
+            start = time.perf_counter()
+            for _ in range(options['count']):
+                render(template_name, context)
+            per_email = (time.perf_counter() - start) / options['count'] * 1000
+            self.stdout.write('{0}: {1:.3f} ms per email'.format(label, per_email))
@@ -0,0 +1,72 @@
+#
+#   Author(s): Huon Imberger
+#   Description: Worker that sends the emails waiting in the outbox
+#
+
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+
+import logging
+import time
+
+from emails.models import OutboxEmail
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Sends the emails waiting in the outbox, retrying failures with backoff'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50, help='Number of emails claimed at a time')
+        parser.add_argument('--sleep', type=float, default=2, help='Seconds to wait when there are no emails')
+        parser.add_argument('--once', action='store_true', help='Exit once there are no emails due')
+
+    def handle(self, *args, **options):
+        while True:
+            emails = OutboxEmail.objects.claim(options['batch_size'])
+            if emails:
+                self.send_batch(emails)
+            elif options['once']:
+                break
+            else:
+                time.sleep(options['sleep'])
+
+    def send_batch(self, emails):
+        """
+        Sends a batch of emails over a single connection to the email backend
+        """
+        connection = get_connection()
+        try:
+            connection.open()
+        except Exception as e:
+            logger.exception('Could not connect to the email backend')
+            for email in emails:
+                email.fail(repr(e))
+            return
+        try:
+            if hasattr(connection, 'send_batch'):
+                # The backend can send many emails in one request, and reports the error for each email
+                errors = connection.send_batch([email.to_message(connection) for email in emails])
+                for email, error in zip(emails, errors):
+                    if error is None:
+                        email.mark_sent()
+                    else:
+                        email.fail(repr(error))
+                    self.stdout.write('Email {0}: {1}'.format(email.pk, email.status))
+                return
+            for email in emails:
+                try:
+                    sent = connection.send_messages([email.to_message(connection)])
+                except Exception as e:
+                    logger.exception('Email %s failed', email.pk)
+                    email.fail(repr(e))
+                else:
+                    if sent:
+                        email.mark_sent()
+                    else:
+                        email.fail('The email backend did not send the email')
+                self.stdout.write('Email {0}: {1}'.format(email.pk, email.status))
+        finally:
+            connection.close()
@@ -0,0 +1,50 @@
+#
+#   Author(s): Huon Imberger
+#   Description: Custom email-related querysets
+#
+
+from django.db import models
+from django.db.models import F, Q
+from django.utils import timezone
+
+
+class EmailTemplateManager(models.Manager):
+    """
+    Templates are looked up by name, which lets the email_templates fixture update existing templates rather than
+    overwriting whichever templates have the same ids
+    """
+    def get_by_natural_key(self, name):
+        return self.get(name=name)
+
+
+class OutboxEmailQuerySet(models.QuerySet):
+    """
+    Email outbox queue
+    """
+    def due(self, now=None):
+        """
+        Emails ready to send: pending emails whose retry time has come, and emails left sending by a worker that died
+        """
+        if now is None:
+            now = timezone.now()
+        return self.filter(
+            Q(status=self.model.PENDING, run_after__lte=now) |
+            Q(status=self.model.SENDING, started__lt=now - self.model.TIMEOUT)
+        ).order_by('run_after', 'id')
+
+    def claim(self, limit, now=None):
+        """
+        Marks up to limit due emails as sending, and returns them. Each email is claimed with a conditional update, so
+        workers running side by side never send the same email.
+        """
+        if now is None:
+            now = timezone.now()
+        claimed = []
+        for email in self.due(now)[:limit]:
+            updated = self.filter(pk=email.pk, status=email.status, started=email.started).update(
+                status=self.model.SENDING, started=now, attempts=F('attempts') + 1
+            )
+            if updated:
+                email.status, email.started, email.attempts = self.model.SENDING, now, email.attempts + 1
+                claimed.append(email)
+        return claimed
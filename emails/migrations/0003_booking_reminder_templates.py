@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+# Templates for manage.py send_booking_reminders, as in the email_templates fixture. Existing databases don't load the
+# fixture again (it would overwrite templates edited by staff), so they are added here.
+TEMPLATES = (
+    {
+        'name': 'Booking Starting',
+        'subject': 'Vroom Booking Starting Soon',
+        'body': (
+            '<h1><span style="font-size:36px"><strong><span style="color:#2980b9">Booking Starting Soon</span></strong></span></h1>\r\n'
+            '\r\n'
+            '<p>Your booking starts in less than an hour.<br />\r\n'
+            'If you need to cancel this booking, please <a href="https://vroom-car-share.herokuapp.com/" rel="noreferrer nofollow noopener" style="color: #006599; text-decoration: none;" target="_blank"><strong>login</strong></a> to the website.</p>\r\n'
+            '\r\n'
+            '<p>&nbsp;</p>\r\n'
+            '\r\n'
+            '<h2><span style="color:#2980b9">Vehicle</span></h2>\r\n'
+            '\r\n'
+            '<p>{{ booking.vehicle }}</p>\r\n'
+            '\r\n'
+            '<h2><span style="color:#2980b9">Location</span></h2>\r\n'
+            '\r\n'
+            '<p>{{ booking.vehicle.pod.description }}</p>\r\n'
+            '\r\n'
+            '<h2><span style="color:#2980b9">Booking start</span></h2>\r\n'
+            '\r\n'
+            '<p>{{ booking.schedule_start }}</p>\r\n'
+            '\r\n'
+            '<h2><span style="color:#2980b9">Booking end</span></h2>\r\n'
+            '\r\n'
+            '<p>{{ booking.schedule_end }}</p>'
+        ),
+    },
+    {
+        'name': 'Booking Ending',
+        'subject': 'Vroom Booking Ending Soon',
+        'body': (
+            '<h1><span style="font-size:36px"><strong><span style="color:#2980b9">Booking Ending Soon</span></strong></span></h1>\r\n'
+            '\r\n'
+            '<p>Your booking ends in less than 30 minutes. Please return the vehicle to its pod by the end time.<br />\r\n'
+            'If you need more time, <a href="https://vroom-car-share.herokuapp.com/" rel="noreferrer nofollow noopener" style="color: #006599; text-decoration: none;" target="_blank"><strong>login</strong></a> to the website to extend your booking.</p>\r\n'
+            '\r\n'
+            '<p>&nbsp;</p>\r\n'
+            '\r\n'
+            '<h2><span style="color:#2980b9">Vehicle</span></h2>\r\n'
+            '\r\n'
+            '<p>{{ booking.vehicle }}</p>\r\n'
+            '\r\n'
+            '<h2><span style="color:#2980b9">Location</span></h2>\r\n'
+            '\r\n'
+            '<p>{{ booking.vehicle.pod.description }}</p>\r\n'
+            '\r\n'
+            '<h2><span style="color:#2980b9">Booking start</span></h2>\r\n'
+            '\r\n'
+            '<p>{{ booking.schedule_start }}</p>\r\n'
+            '\r\n'
+            '<h2><span style="color:#2980b9">Booking end</span></h2>\r\n'
+            '\r\n'
+            '<p>{{ booking.schedule_end }}</p>'
+        ),
+    },
+)
+
+
+def add_templates(apps, schema_editor):
+    EmailTemplate = apps.get_model('emails', 'EmailTemplate')
+    for template in TEMPLATES:
+        EmailTemplate.objects.get_or_create(name=template['name'], defaults=template)
+
+
+def remove_templates(apps, schema_editor):
+    EmailTemplate = apps.get_model('emails', 'EmailTemplate')
+    EmailTemplate.objects.filter(name__in=[template['name'] for template in TEMPLATES]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emails', '0002_outbox_email'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_templates, remove_templates),
+    ]
@@ -3,10 +3,16 @@
 #   Description: Defines email-related database models for
 #
 
+from django.core.mail import EmailMultiAlternatives
 from django.db import models
+from django.utils import timezone
 
 from ckeditor.fields import RichTextField
 
+import datetime as dt
+
+from .managers import EmailTemplateManager, OutboxEmailQuerySet
+
 
 class EmailTemplate(models.Model):
     """
@@ -18,3 +24,127 @@ class EmailTemplate(models.Model):
     )
     subject = models.CharField(max_length=30, help_text='Please refer to the code to determine the context available')
     body = RichTextField( help_text='Please refer to the code to determine the context available')
+
+    objects = EmailTemplateManager()
+
+    def natural_key(self):
+        return (self.name,)
+
+
+class OutboxEmail(models.Model):
+    """
+    A rendered email waiting to be sent. Emails are written here, in the same transaction as the change they are about,
+    and sent by manage.py send_emails, so requests never wait on (or fail because of) the email provider.
+    """
+    PENDING = 'Pending'
+    SENDING = 'Sending'
+    SENT = 'Sent'
+    DEAD = 'Dead'
+    STATUSES = (
+        (PENDING, PENDING),
+        (SENDING, SENDING),
+        (SENT, SENT),
+        (DEAD, DEAD),
+    )
+    # Attempts before an email is given up on (left as DEAD for staff to look at)
+    MAX_ATTEMPTS = 8
+    # Failed attempts are retried after this, doubling each time
+    RETRY_DELAY = dt.timedelta(minutes=1)
+    # An email still sending after this long is assumed to have died with its worker, and is sent again
+    TIMEOUT = dt.timedelta(minutes=5)
+
+    # Addresses are stored one per line
+    to = models.TextField()
+    reply_to = models.TextField(blank=True)
+    from_email = models.CharField(max_length=255)
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    html_body = models.TextField(blank=True)
+    attachment_filename = models.CharField(max_length=255, blank=True)
+    attachment_data = models.BinaryField(null=True)
+    attachment_mimetype = models.CharField(max_length=100, blank=True)
+
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+    run_after = models.DateTimeField(default=timezone.now)
+    started = models.DateTimeField(null=True, blank=True)
+    sent = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    objects = OutboxEmailQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='outboxemail_due_idx'),
+        ]
+
+    def __str__(self):
+        return '{0} - {1} ({2})'.format(self.id, self.subject, self.status)
+
+    @classmethod
+    def from_message(cls, message, save=True):
+        """
+        Creates an outbox email from an (unsent) EmailMessage, which may have HTML alternatives and one attachment.
+        Pass save=False to bulk_create() many at once.
+        """
+        # Checks the headers, raising BadHeaderError as sending would
+        message.message()
+        if len(message.attachments) > 1:
+            raise ValueError('Emails in the outbox can have at most one attachment')
+        email = cls(
+            to='\n'.join(message.to),
+            reply_to='\n'.join(message.reply_to),
+            from_email=message.from_email,
+            subject=message.subject,
+            body=message.body,
+            html_body=next((content for content, mimetype in getattr(message, 'alternatives', [])
+                            if mimetype == 'text/html'), ''),
+        )
+        if message.attachments:
+            filename, data, mimetype = message.attachments[0]
+            email.attachment_filename = filename or ''
+            email.attachment_data = data.encode() if isinstance(data, str) else data
+            email.attachment_mimetype = mimetype or ''
+        if save:
+            email.save()
+        return email
+
+    def to_message(self, connection=None):
+        """
+        Builds the EmailMessage to send
+        """
+        message = EmailMultiAlternatives(
+            to=self.to.split('\n'),
+            reply_to=self.reply_to.split('\n') if self.reply_to else None,
+            from_email=self.from_email,
+            subject=self.subject,
+            body=self.body,
+            connection=connection,
+        )
+        if self.html_body:
+            message.attach_alternative(self.html_body, 'text/html')
+        if self.attachment_data is not None:
+            message.attach(self.attachment_filename or 'attachment', bytes(self.attachment_data),
+                           self.attachment_mimetype or None)
+        return message
+
+    def mark_sent(self, now=None):
+        self.status = self.SENT
+        self.sent = now or timezone.now()
+        self.error = ''
+        self.save(update_fields=['status', 'sent', 'error'])
+
+    def fail(self, error, now=None):
+        """
+        Records a failed attempt. The email is retried later, with exponential backoff, until it runs out of attempts.
+        """
+        if now is None:
+            now = timezone.now()
+        self.error = error
+        if self.attempts >= self.MAX_ATTEMPTS:
+            self.status = self.DEAD
+        else:
+            self.status = self.PENDING
+            self.run_after = now + self.RETRY_DELAY * 2 ** max(self.attempts - 1, 0)
+        self.save(update_fields=['status', 'error', 'run_after'])
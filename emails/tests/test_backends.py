@@ -0,0 +1,196 @@
+from django.core.mail import EmailMessage, EmailMultiAlternatives
+from django.test import TestCase, override_settings
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+import json
+import threading
+import time
+
+from python_http_client.exceptions import HTTPError
+
+from ..backends import BatchingSendGridBackend
+from ..utils import send_bulk_templated_email
+from ..models import EmailTemplate
+
+
+class SendGridStubHandler(BaseHTTPRequestHandler):
+    """
+    Records each request body, and responds with the next queued status (202 once the queue is empty), after the next
+    queued delay in seconds if there is one
+    """
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+        self.server.requests.append((self.path, body))
+        if self.server.delays:
+            time.sleep(self.server.delays.pop(0))
+        status = self.server.statuses.pop(0) if self.server.statuses else 202
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SendGridStubServer(ThreadingMixIn, HTTPServer):
+    # Handles a retry while the request before it is still being delayed
+    daemon_threads = True
+
+    def __init__(self):
+        super(SendGridStubServer, self).__init__(('127.0.0.1', 0), SendGridStubHandler)
+        self.requests = []
+        self.statuses = []
+        self.delays = []
+
+    def handle_error(self, request, client_address):
+        # Responses to requests that timed out have nowhere to go
+        pass
+
+
+class EmailsBatchingSendGridBackendTests(TestCase):
+    def setUp(self):
+        self.server = SendGridStubServer()
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        settings = override_settings(
+            SENDGRID_API_KEY='test',
+            SENDGRID_API_HOST='http://127.0.0.1:{0}'.format(self.server.server_address[1]),
+            SENDGRID_RETRY_DELAY=0,
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def make_email(self, recipient, subject='Notice', body='Vehicle 1 is being repaired'):
+        email = EmailMultiAlternatives(to=[recipient], from_email='admin@vroomcs.org', subject=subject, body=body)
+        email.attach_alternative('<p>{0}</p>'.format(body), 'text/html')
+        return email
+
+    def personalization_recipients(self, body):
+        return [[to['email'] for to in personalization['to']] for personalization in body['personalizations']]
+
+    def test_same_content_one_request(self):
+        """
+        Emails that only differ by recipient and subject are sent in one request, with a personalization each
+        """
+        emails = [self.make_email('user{0}@example.com'.format(i), subject='Notice {0}'.format(i)) for i in range(5)]
+        sent = BatchingSendGridBackend().send_messages(emails)
+        self.assertEqual(sent, 5)
+        self.assertEqual(len(self.server.requests), 1)
+        path, body = self.server.requests[0]
+        self.assertEqual(path, '/v3/mail/send')
+        self.assertEqual(self.personalization_recipients(body), [['user{0}@example.com'.format(i)] for i in range(5)])
+        self.assertEqual([p['subject'] for p in body['personalizations']], ['Notice {0}'.format(i) for i in range(5)])
+
+    def test_different_content_separate_requests(self):
+        """
+        Emails with different bodies can't share a request
+        """
+        emails = [self.make_email('a@example.com'), self.make_email('b@example.com', body='Something else'),
+                  self.make_email('c@example.com')]
+        BatchingSendGridBackend().send_messages(emails)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(self.personalization_recipients(self.server.requests[0][1]),
+                         [['a@example.com'], ['c@example.com']])
+        self.assertEqual(self.personalization_recipients(self.server.requests[1][1]), [['b@example.com']])
+
+    @override_settings(SENDGRID_MAX_RECIPIENTS=3)
+    def test_recipient_limit(self):
+        """
+        Requests are split so that none has more than the recipient limit
+        """
+        emails = [self.make_email('user{0}@example.com'.format(i)) for i in range(7)]
+        emails.append(EmailMessage(to=['x@example.com', 'y@example.com'], cc=['z@example.com'],
+                                   from_email='admin@vroomcs.org', subject='Notice', body='Other'))
+        self.assertEqual(BatchingSendGridBackend().send_messages(emails), 8)
+        self.assertEqual([len(body['personalizations']) for _, body in self.server.requests], [3, 3, 1, 1])
+
+    def test_retry_server_error(self):
+        """
+        A request that fails with a server error or rate limit is retried
+        """
+        self.server.statuses = [500, 429]
+        with self.assertLogs('emails.backends', 'WARNING'):
+            errors = BatchingSendGridBackend().send_batch([self.make_email('a@example.com'),
+                                                           self.make_email('b@example.com')])
+        self.assertEqual(errors, [None, None])
+        self.assertEqual(len(self.server.requests), 3)
+
+    @override_settings(SENDGRID_MAX_RETRIES=1)
+    def test_retries_exhausted(self):
+        """
+        Emails fail once their request has run out of retries, and send_messages() raises the error
+        """
+        backend = BatchingSendGridBackend()
+        with self.assertLogs('emails.backends', 'WARNING'):
+            self.server.statuses = [503, 503]
+            errors = backend.send_batch([self.make_email('a@example.com')])
+            self.assertEqual(errors[0].status_code, 503)
+            self.assertEqual(len(self.server.requests), 2)
+            self.server.statuses = [503, 503]
+            with self.assertRaises(HTTPError):
+                backend.send_messages([self.make_email('a@example.com')])
+            self.server.statuses = [503, 503]
+            backend.fail_silently = True
+            self.assertEqual(backend.send_messages([self.make_email('a@example.com')]), 0)
+
+    @override_settings(SENDGRID_TIMEOUT=0.1, SENDGRID_MAX_RETRIES=1)
+    def test_timeout(self):
+        """
+        A request that times out is retried, and the emails fail (rather than send_batch() raising) once it has run
+        out of retries
+        """
+        backend = BatchingSendGridBackend()
+        with self.assertLogs('emails.backends', 'WARNING'):
+            self.server.delays = [0.3]
+            self.assertEqual(backend.send_batch([self.make_email('a@example.com')]), [None])
+            self.server.delays = [0.3, 0.3]
+            errors = backend.send_batch([self.make_email('a@example.com'), self.make_email('b@example.com')])
+        self.assertIsInstance(errors[0], OSError)
+        self.assertIs(errors[1], errors[0])
+        self.assertEqual(len(self.server.requests), 4)
+
+    def test_rejected_batch_split(self):
+        """
+        If a batch is rejected (e.g. one bad address), its emails are sent on their own so the others still go
+        """
+        self.server.statuses = [400, 202, 400, 202]
+        errors = BatchingSendGridBackend().send_batch([self.make_email('a@example.com'), self.make_email('bad'),
+                                                       self.make_email('c@example.com')])
+        self.assertIsNone(errors[0])
+        self.assertEqual(errors[1].status_code, 400)
+        self.assertIsNone(errors[2])
+        self.assertEqual(len(self.server.requests), 4)
+
+    def test_bulk_send(self):
+        """
+        A bulk notification without per-recipient content is sent in a request per chunk
+        """
+        EmailTemplate.objects.create(name='Repair', subject='Repairs', body='<p>Vehicle 1 is being repaired</p>')
+        recipients = [('user{0}@example.com'.format(i), {}) for i in range(250)]
+        results = send_bulk_templated_email('Repair', recipients, connection=BatchingSendGridBackend())
+        self.assertTrue(all(result.sent for result in results))
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(sum(len(body['personalizations']) for _, body in self.server.requests), 250)
+
+    def test_bulk_send_personalised(self):
+        """
+        Personalised emails are rendered once with substitution tags, and sent in a single request with each
+        recipient's values
+        """
+        EmailTemplate.objects.create(name='Repair', subject='{{ vehicle }} is being repaired',
+                                     body='<p>Sorry {{ name }}, {{ vehicle }} is being repaired</p>')
+        recipients = [('user{0}@example.com'.format(i), {'name': 'User & {0}'.format(i), 'vehicle': 'Yaris'})
+                      for i in range(50)]
+        results = send_bulk_templated_email('Repair', recipients, connection=BatchingSendGridBackend(),
+                                            substitute=['name'])
+        self.assertTrue(all(result.sent for result in results))
+        self.assertEqual(len(self.server.requests), 1)
+        body = self.server.requests[0][1]
+        self.assertIn('<p>Sorry -name-, Yaris is being repaired</p>', body['content'][1]['value'])
+        self.assertEqual(len(body['personalizations']), 50)
+        self.assertEqual(body['personalizations'][3]['to'], [{'email': 'user3@example.com'}])
+        self.assertEqual(body['personalizations'][3]['substitutions'], {'-name-': 'User &amp; 3'})
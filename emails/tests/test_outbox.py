@@ -0,0 +1,94 @@
+from django.core import mail
+from django.core.mail import EmailMessage, get_connection
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase
+from django.utils import timezone
+
+from io import StringIO
+from unittest import mock
+
+from ..admin import retry_emails
+from ..models import EmailTemplate, OutboxEmail
+from ..utils import queue_email, send_templated_email
+
+
+class EmailsOutboxTests(TestCase):
+    def setUp(self):
+        EmailTemplate.objects.create(name='Test', subject='Hi {{ name }}', body='<p>Hello {{ name }}</p>')
+
+    def drain(self):
+        call_command('send_emails', once=True, stdout=StringIO())
+
+    def test_queued_then_sent(self):
+        """
+        Templated emails are queued rather than sent, and the worker sends them with their HTML and attachment
+        """
+        send_templated_email('Test', {'name': 'John'}, ['john@test.com'], attachment_filename='invoice.pdf',
+                             attachment_data=b'%PDF')
+        self.assertEqual(len(mail.outbox), 0)
+        self.drain()
+        self.assertEqual(len(mail.outbox), 1)
+        message = mail.outbox[0]
+        self.assertEqual(message.subject, 'Hi John')
+        self.assertEqual(message.to, ['john@test.com'])
+        self.assertIn('Hello John', message.alternatives[0][0])
+        self.assertEqual(message.attachments[0][:2], ('invoice.pdf', b'%PDF'))
+        self.assertEqual(OutboxEmail.objects.get().status, OutboxEmail.SENT)
+        # Nothing left to send
+        self.drain()
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_rolled_back_with_transaction(self):
+        """
+        An email queued in a transaction that rolls back is never sent
+        """
+        try:
+            with transaction.atomic():
+                send_templated_email('Test', {'name': 'John'}, ['john@test.com'])
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertFalse(OutboxEmail.objects.exists())
+
+    def test_one_connection_per_batch(self):
+        for i in range(3):
+            queue_email(EmailMessage(subject='Email {0}'.format(i), body='Body', to=['john@test.com']))
+        with mock.patch('emails.management.commands.send_emails.get_connection', wraps=get_connection) as connect:
+            self.drain()
+        self.assertEqual(connect.call_count, 1)
+        self.assertEqual(len(mail.outbox), 3)
+
+    def test_backoff_and_dead_letter(self):
+        """
+        Failed sends are retried with increasing delays, then left as dead
+        """
+        email = queue_email(EmailMessage(subject='Hi', body='Body', to=['john@test.com']))
+        delays = []
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError('down')):
+            for attempt in range(OutboxEmail.MAX_ATTEMPTS):
+                now = timezone.now()
+                with self.assertLogs('emails.management.commands.send_emails', 'ERROR'):
+                    self.drain()
+                email.refresh_from_db()
+                delays.append(email.run_after - now)
+                OutboxEmail.objects.filter(pk=email.pk).update(run_after=now)
+        self.assertEqual(email.status, OutboxEmail.DEAD)
+        self.assertIn('down', email.error)
+        self.assertGreater(delays[2], delays[1])
+        self.assertGreater(delays[1], delays[0])
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_retry_only_unsent_emails(self):
+        """
+        The admin's retry action leaves sent and sending emails alone, so they aren't delivered twice
+        """
+        sent, sending, dead = [queue_email(EmailMessage(subject='Hi', body='Body', to=['john@test.com']))
+                               for _ in range(3)]
+        OutboxEmail.objects.filter(pk=sent.pk).update(status=OutboxEmail.SENT, attempts=1)
+        OutboxEmail.objects.filter(pk=sending.pk).update(status=OutboxEmail.SENDING, attempts=1)
+        OutboxEmail.objects.filter(pk=dead.pk).update(status=OutboxEmail.DEAD, attempts=OutboxEmail.MAX_ATTEMPTS)
+        retry_emails(None, None, OutboxEmail.objects.all())
+        self.assertEqual(list(OutboxEmail.objects.order_by('pk').values_list('status', 'attempts')), [
+            (OutboxEmail.SENT, 1), (OutboxEmail.SENDING, 1), (OutboxEmail.PENDING, 0)
+        ])
@@ -0,0 +1,110 @@
+from django.core import mail
+from django.core.mail import get_connection
+from django.core.mail.backends import locmem
+from django.core.management import call_command
+from django.test import TestCase
+
+from io import StringIO
+from smtplib import SMTPRecipientsRefused
+from unittest import mock
+
+from ..models import EmailTemplate
+from ..utils import BulkEmailResult, compile_template, render_templated_email, send_bulk_templated_email
+
+
+class EmailsTemplateCacheTests(TestCase):
+    def setUp(self):
+        self.template = EmailTemplate.objects.create(name='Test', subject='Hi {{ name }}',
+                                                     body='<p>Hello {{ name }}</p>')
+
+    def test_compiled_once(self):
+        """
+        Templates are fetched for each email, but only compiled on first use
+        """
+        compile_template.cache_clear()
+        with self.assertNumQueries(1):
+            subject, body = render_templated_email('Test', {'name': 'John'})
+        self.assertEqual(subject, 'Hi John')
+        self.assertIn('<p>Hello John</p>', body)
+        with self.assertNumQueries(1):
+            self.assertEqual(render_templated_email('Test', {'name': 'Jane'})[0], 'Hi Jane')
+        self.assertEqual((compile_template.cache_info().misses, compile_template.cache_info().hits), (1, 1))
+
+    def test_invalidated_on_save(self):
+        """
+        Editing a template (e.g. in the admin) is used by the next email
+        """
+        render_templated_email('Test', {'name': 'John'})
+        self.template.subject = 'Welcome {{ name }}'
+        self.template.save()
+        self.assertEqual(render_templated_email('Test', {'name': 'John'})[0], 'Welcome John')
+
+    def test_updated_without_save(self):
+        """
+        Templates changed without save() (e.g. a queryset update or loading a fixture) are used by the next email too
+        """
+        render_templated_email('Test', {'name': 'John'})
+        EmailTemplate.objects.filter(name='Test').update(subject='Welcome {{ name }}')
+        self.assertEqual(render_templated_email('Test', {'name': 'John'})[0], 'Welcome John')
+
+    def test_benchmark(self):
+        out = StringIO()
+        call_command('benchmark_email_rendering', count=5, stdout=out)
+        self.assertIn('Uncached:', out.getvalue())
+        self.assertIn('Cached:', out.getvalue())
+
+
+class EmailsBulkSendTests(TestCase):
+    def setUp(self):
+        EmailTemplate.objects.create(name='Vehicle Unavailable', subject='{{ vehicle }} is unavailable',
+                                     body='<p>Sorry {{ name }}, {{ vehicle }} is being repaired.</p>')
+        self.recipients = [('user{0}@test.com'.format(i), {'name': 'User {0}'.format(i), 'vehicle': 'Yaris'})
+                           for i in range(5)]
+
+    def test_locmem(self):
+        """
+        Each recipient gets their own rendered email, over one connection
+        """
+        with mock.patch('emails.utils.get_connection', wraps=get_connection) as connect:
+            results = send_bulk_templated_email('Vehicle Unavailable', iter(self.recipients), chunk_size=2)
+        self.assertEqual(connect.call_count, 1)
+        self.assertEqual(results, [BulkEmailResult(recipient, True, None) for recipient, _ in self.recipients])
+        self.assertEqual([message.to for message in mail.outbox], [[recipient] for recipient, _ in self.recipients])
+        self.assertEqual(mail.outbox[3].subject, 'Yaris is unavailable')
+        self.assertIn('Sorry User 3', mail.outbox[3].body)
+
+    def test_substitutions_filled_in(self):
+        """
+        Emails rendered once for many recipients get each recipient's values from backends without substitutions
+        """
+        with self.assertNumQueries(1):
+            results = send_bulk_templated_email('Vehicle Unavailable', self.recipients, substitute=['name'])
+        self.assertTrue(all(result.sent for result in results))
+        self.assertEqual(mail.outbox[3].subject, 'Yaris is unavailable')
+        self.assertIn('Sorry User 3, Yaris is being repaired.', mail.outbox[3].body)
+        self.assertIn('<p>Sorry User 3, Yaris is being repaired.</p>', mail.outbox[3].alternatives[0][0])
+        self.assertFalse(hasattr(mail.outbox[3], 'substitutions'))
+
+    def test_console(self):
+        stream = StringIO()
+        connection = get_connection('django.core.mail.backends.console.EmailBackend', stream=stream)
+        results = send_bulk_templated_email('Vehicle Unavailable', self.recipients, connection=connection)
+        self.assertTrue(all(result.sent for result in results))
+        self.assertEqual(stream.getvalue().count('Subject: Yaris is unavailable'), 5)
+
+    def test_failures_reported(self):
+        """
+        A failed email is reported for its recipient, and doesn't stop the others
+        """
+        send_messages = locmem.EmailBackend.send_messages
+
+        def fail_for_user2(backend, messages):
+            if messages[0].to == ['user2@test.com']:
+                raise SMTPRecipientsRefused({'user2@test.com': (550, b'No such user')})
+            return send_messages(backend, messages)
+
+        with mock.patch.object(locmem.EmailBackend, 'send_messages', autospec=True, side_effect=fail_for_user2):
+            results = send_bulk_templated_email('Vehicle Unavailable', self.recipients)
+        self.assertEqual([result.sent for result in results], [True, True, False, True, True])
+        self.assertIsInstance(results[2].error, SMTPRecipientsRefused)
+        self.assertEqual(len(mail.outbox), 4)
@@ -4,24 +4,53 @@
 #
 
 from django.template import Engine, Context
-from django.core.mail import EmailMultiAlternatives
+from django.core.mail import EmailMultiAlternatives, get_connection
 from django.template.loader import render_to_string
-from django.utils.html import strip_tags
+from django.utils.html import conditional_escape, strip_tags
 from django.conf import settings
 
-from .models import EmailTemplate
+from collections import namedtuple
+from functools import lru_cache
+from itertools import islice
+import re
 
+from .models import EmailTemplate, OutboxEmail
 
-def send_templated_email(template_name, context, recipient_list, from_email=settings.DEFAULT_FROM_EMAIL, attachment_filename=None, attachment_data=None):
+
+# Engine for compiling email templates, shared by all emails
+template_engine = Engine()
+
+# Stands in for a per-recipient variable in an email rendered once for many recipients
+SUBSTITUTION_TAG = '-{0}-'
+
+
+@lru_cache(maxsize=64)
+def compile_template(subject, body):
     """
-    Sends an email using a template stored in the database (based on the template name)
-    Also supports attaching a file
+    Compiles an email template's subject and body. The compiled templates are kept by their text, so a template that
+    has been edited in any way (the admin, a queryset update, a fixture) is compiled again.
+    """
+    return template_engine.from_string(subject), template_engine.from_string(body)
+
+
+def get_compiled_template(template_name):
+    """
+    Returns the compiled (subject, body) templates for an email template. The template is fetched every time, so edits
+    are used straight away, but only compiled when its text has changed.
+    :raises EmailTemplate.DoesNotExist: if there is no template with that name
+    """
+    subject, body = EmailTemplate.objects.values_list('subject', 'body').get(name=template_name)
+    return compile_template(subject, body)
+
+
+def render_templated_email(template_name, context, templates=None):
+    """
+    Renders an email template stored in the database using the provided context
+    :param templates: the template's compiled templates from get_compiled_template(), to save fetching them again when
+        rendering many emails
+    :return: tuple of (subject, full HTML body)
     """
-    # Get template from database, render it using the provided context
-    template_engine = Engine()
-    email_template = EmailTemplate.objects.get(name=template_name)
-    subject_template = template_engine.from_string(email_template.subject)
-    body_template = template_engine.from_string(email_template.body)
+    subject_template, body_template = templates or get_compiled_template(template_name)
     email_context = Context(context)
     email_subject = subject_template.render(email_context)
     email_body = body_template.render(email_context)
@@ -29,16 +58,86 @@ def send_templated_email(template_name, context, recipient_list, from_email=sett
         'emails/default.html',
         context = {'rendered_email_body': email_body}
     )
+    return email_subject, email_body_full
+
+
+def queue_email(message):
+    """
+    Adds an EmailMessage to the outbox, to be sent by manage.py send_emails
+    """
+    return OutboxEmail.from_message(message)
+
+
+def queue_emails(messages):
+    """
+    Adds many EmailMessages to the outbox in one query
+    """
+    return OutboxEmail.objects.bulk_create([OutboxEmail.from_message(message, save=False) for message in messages])
+
 
-    # Send the email
+def build_templated_email(template_name, context, recipient_list, from_email=settings.DEFAULT_FROM_EMAIL,
+                          connection=None, templates=None):
+    """
+    Renders an email template into an EmailMessage (with HTML and plain text versions), ready to send
+    :param templates: as for render_templated_email()
+    """
+    email_subject, email_body_full = render_templated_email(template_name, context, templates)
+    return build_email(email_subject, email_body_full, recipient_list, from_email, connection)
+
+
+def build_email(email_subject, email_body_full, recipient_list, from_email=settings.DEFAULT_FROM_EMAIL,
+                connection=None):
+    """
+    Builds an EmailMessage from a rendered subject and HTML body, with a plain text version of the body
+    """
     text_message = strip_tags(email_body_full)
     email = EmailMultiAlternatives(
         to=recipient_list,
         from_email=from_email,
         subject=email_subject,
         body=text_message,
+        connection=connection,
     )
     email.attach_alternative(email_body_full, "text/html")
+    return email
+
+
+def build_substituted_emails(template_name, recipients, substitute, from_email=settings.DEFAULT_FROM_EMAIL,
+                             connection=None, templates=None):
+    """
+    Renders an email template once for many recipients, with a substitution tag in place of each variable named in
+    substitute, and builds an EmailMessage for each recipient. Backends that support substitutions (e.g.
+    BatchingSendGridBackend) are given each recipient's values to fill in, so the emails stay identical and can be sent
+    together. For other backends, the values are filled in here.
+    :param recipients: list of (email address, context) pairs. Only the substituted variables may differ between them.
+    :param templates: as for render_templated_email()
+    """
+    tags = {name: SUBSTITUTION_TAG.format(name) for name in substitute}
+    email_subject, email_body_full = render_templated_email(template_name, dict(recipients[0][1], **tags), templates)
+    pattern = re.compile('|'.join(re.escape(tag) for tag in tags.values()))
+    emails = []
+    for recipient, context in recipients:
+        # Escaped as the template would have escaped them
+        substitutions = {tag: str(conditional_escape(context[name])) for name, tag in tags.items()}
+        if getattr(connection, 'supports_substitutions', False):
+            email = build_email(email_subject, email_body_full, [recipient], from_email, connection)
+            email.substitutions = substitutions
+        else:
+            def replace(text):
+                return pattern.sub(lambda match: substitutions[match.group(0)], text)
+            email = build_email(replace(email_subject), replace(email_body_full), [recipient], from_email, connection)
+        emails.append(email)
+    return emails
+
+
+def send_templated_email(template_name, context, recipient_list, from_email=settings.DEFAULT_FROM_EMAIL, attachment_filename=None, attachment_data=None):
+    """
+    Sends an email using a template stored in the database (based on the template name)
+    Also supports attaching a file
+    The email is rendered straight away, but queued in the outbox rather than sent, so call this inside the same
+    transaction as the change the email is about.
+    """
+    email = build_templated_email(template_name, context, recipient_list, from_email)
     # Attachment?
     if attachment_filename:
         if attachment_data:
@@ -47,4 +146,59 @@ def send_templated_email(template_name, context, recipient_list, from_email=sett
             email.attach_file(attachment_filename)
     elif attachment_data:
         email.attach('attachment', attachment_data)
-    email.send()
+    queue_email(email)
+
+
+# Result of sending one email with send_bulk_templated_email(). error is None if the email was sent.
+BulkEmailResult = namedtuple('BulkEmailResult', ['recipient', 'sent', 'error'])
+
+
+def send_bulk_templated_email(template_name, recipients, from_email=settings.DEFAULT_FROM_EMAIL, chunk_size=100,
+                              connection=None, substitute=()):
+    """
+    Sends an email template to many recipients (e.g. everyone with a booking for a vehicle that is being repaired),
+    each with their own context. The template is compiled once and every email goes over the same connection.
+    Unlike send_templated_email(), the emails are sent straight away, so use this from management commands or
+    workers rather than views.
+    :param recipients: iterable of (email address, context) pairs. It is consumed a chunk at a time, so can be a
+        generator over a large queryset.
+    :param substitute: names of the variables that differ between recipients, if the template only outputs them as
+        they are (they aren't passed through filters or used in tags). Each chunk is then rendered once, and
+        backends that support substitutions can send it in one request. See build_substituted_emails().
+    :return: list of BulkEmailResult, in the same order as the recipients
+    """
+    results = []
+    templates = get_compiled_template(template_name)
+    connection = connection or get_connection()
+    # Like the backends' own send_messages(), only close the connection if it was opened here
+    opened = connection.open()
+    try:
+        recipients = iter(recipients)
+        while True:
+            chunk = list(islice(recipients, chunk_size))
+            if not chunk:
+                break
+            if substitute:
+                emails = build_substituted_emails(template_name, chunk, substitute, from_email, connection, templates)
+            else:
+                emails = [build_templated_email(template_name, context, [recipient], from_email, connection, templates)
+                          for recipient, context in chunk]
+            if hasattr(connection, 'send_batch'):
+                # The backend sends emails with the same content together, and reports the error for each email
+                for (recipient, _), error in zip(chunk, connection.send_batch(emails)):
+                    results.append(BulkEmailResult(recipient, error is None, error))
+                continue
+            # Otherwise send each email on its own (over the same connection), so that one bad address doesn't stop
+            # the rest and it is known exactly which emails were sent
+            for (recipient, _), email in zip(chunk, emails):
+                try:
+                    sent = connection.send_messages([email])
+                except Exception as e:
+                    results.append(BulkEmailResult(recipient, False, e))
+                else:
+                    error = None if sent else 'The email backend did not send the email'
+                    results.append(BulkEmailResult(recipient, bool(sent), error))
+    finally:
+        if opened:
+            connection.close()
+    return results
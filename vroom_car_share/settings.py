@@ -53,6 +53,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so that its total time covers the other middleware
+    'vroom_car_share.timing.RequestTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -67,7 +69,8 @@ ROOT_URLCONF = 'vroom_car_share.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates, with rendering timed by RequestTimingMiddleware
+        'BACKEND': 'vroom_car_share.timing.TimedDjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR, 'vroom_car_share/templates')],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -95,6 +98,32 @@ DATABASES = {
     }
 }
 
+# Caches
+# https://docs.djangoproject.com/en/1.11/topics/cache/
+# Both are shared by every process: 'default' holds the versions of the values kept in each process's memory (see
+# carshare.cache.ProcessLocalCache), and 'availability' is cleared by signals in the process that saved the booking.
+# The database cache needs its tables, made by manage.py createcachetable (run on release by the Procfile). The
+# backend reads and writes many keys in one query, which the stock DatabaseCache doesn't.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'carshare.cache.BulkDatabaseCache',
+        'LOCATION': 'vroom_cache',
+    },
+    'availability': {
+        'BACKEND': 'carshare.cache.BulkDatabaseCache',
+        'LOCATION': 'vroom_availability_cache',
+        'TIMEOUT': 60 * 60,
+        'OPTIONS': {
+            # One small integer per vehicle per day. Culled back to this when a read finds an expired entry.
+            'MAX_ENTRIES': 50000,
+        },
+    },
+}
+
+# Seconds between checks of whether the values kept in process memory have changed in another process
+PROCESS_LOCAL_CACHE_CHECK_INTERVAL = 1
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -112,6 +141,8 @@ AUTH_PASSWORD_VALIDATORS = [
 
 # Set user model to our custom model
 AUTH_USER_MODEL = 'accounts.User'
+# Loads the logged in user with their current booking, shown on every page
+AUTHENTICATION_BACKENDS = ['accounts.backends.CurrentBookingModelBackend']
 LOGIN_REDIRECT_URL = '/find-a-car/'
 
 # Internationalization
@@ -174,10 +205,43 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 CRISPY_TEMPLATE_PACK = 'bootstrap3'
 
 # SendGrid email
-EMAIL_BACKEND = "sgbackend.SendGridBackend"
+EMAIL_BACKEND = "emails.backends.BatchingSendGridBackend"
 SENDGRID_API_KEY = os.environ.get('SENDGRID_API_KEY')
 DEFAULT_FROM_EMAIL = 'Vroom Car Share <admin@vroomcs.org>'
 
+# Most queries each view should make, checked by vroom_car_share.timing.RequestTimingMiddleware. Going over budget is
+# logged, and fails the tests (see vroom_car_share.test_runner).
+QUERY_BUDGETS = {
+    'carshare:about_us': 3,
+    'carshare:find_a_car': 5,
+    'carshare:my_bookings': 8,
+    'carshare:booking_create': 8,
+    'carshare:booking_create_date': 8,
+}
+# Raise QueryBudgetExceeded instead of logging a warning (the test runner turns this on)
+QUERY_BUDGETS_RAISE = False
+
+# Enforces the query budgets in tests
+TEST_RUNNER = 'vroom_car_share.test_runner.TestRunner'
+
+# Request timings are logged to the console (at INFO, or set REQUEST_TIMING_LOG_LEVEL)
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'vroom_car_share.timing': {
+            'handlers': ['console'],
+            'level': os.environ.get('REQUEST_TIMING_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
 # Customise messages framework
 MESSAGE_TAGS = {
     messages.ERROR: 'danger' # To match the Bootstrap3 class
@@ -0,0 +1,32 @@
+#
+#   Author(s): Huon Imberger
+#   Description: Test runner that makes performance regressions fail the tests
+#
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+import logging
+import os
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Runs the tests with views over their query budget raising QueryBudgetExceeded, rather than only logging it. The
+    request timing log is quietened too, unless REQUEST_TIMING_LOG_LEVEL is set.
+    The tests run in a single process, where invalidating a ProcessLocalCache already empties it, so its version is
+    only read when the value is rebuilt. That keeps query counts the same however long the tests take.
+    """
+    def setup_test_environment(self, **kwargs):
+        super(TestRunner, self).setup_test_environment(**kwargs)
+        self.test_settings = override_settings(QUERY_BUDGETS_RAISE=True, PROCESS_LOCAL_CACHE_CHECK_INTERVAL=None)
+        self.test_settings.enable()
+        self.timing_logger = logging.getLogger('vroom_car_share.timing')
+        self.timing_log_level = self.timing_logger.level
+        if 'REQUEST_TIMING_LOG_LEVEL' not in os.environ:
+            self.timing_logger.setLevel(logging.WARNING)
+
+    def teardown_test_environment(self, **kwargs):
+        self.timing_logger.setLevel(self.timing_log_level)
+        self.test_settings.disable()
+        super(TestRunner, self).teardown_test_environment(**kwargs)
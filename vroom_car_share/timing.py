@@ -0,0 +1,145 @@
+#
+#   Author(s): Huon Imberger
+#   Description: Per-request timing of database queries and template rendering, with optional query budgets
+#
+
+from django.conf import settings
+from django.db import connections
+from django.template.backends.django import DjangoTemplates, Template
+
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+# Totals for the request being handled by this thread: template_time, queries and db_time (None outside of requests)
+_request = threading.local()
+
+
+class QueryBudgetExceeded(Exception):
+    """
+    Raised when a view makes more queries than its budget in settings.QUERY_BUDGETS (if QUERY_BUDGETS_RAISE is set)
+    """
+    pass
+
+
+class TimedTemplate(Template):
+    """
+    Template that adds the time it takes to render to the current request's template time
+    """
+    def render(self, context=None, request=None):
+        start = time.perf_counter()
+        try:
+            return super(TimedTemplate, self).render(context, request)
+        finally:
+            if getattr(_request, 'template_time', None) is not None:
+                _request.template_time += time.perf_counter() - start
+
+
+class TimedCursor(object):
+    """
+    Database cursor that adds each query, and the time it took, to the current request's totals
+    """
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def execute(self, *args):
+        return self.timed(self.cursor.execute, args)
+
+    def executemany(self, *args):
+        return self.timed(self.cursor.executemany, args)
+
+    def callproc(self, *args):
+        return self.timed(self.cursor.callproc, args)
+
+    @staticmethod
+    def timed(method, args):
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            if getattr(_request, 'queries', None) is not None:
+                _request.queries += 1
+                _request.db_time += time.perf_counter() - start
+
+
+def install_timed_cursors(connection):
+    """
+    Makes a database connection's cursors (with or without debug logging) TimedCursors. Connections belong to a
+    single thread, and this only needs doing once for each.
+    """
+    if getattr(connection, 'timed_cursors', False):
+        return
+    make_cursor, make_debug_cursor = connection.make_cursor, connection.make_debug_cursor
+    connection.make_cursor = lambda cursor: make_cursor(TimedCursor(cursor))
+    connection.make_debug_cursor = lambda cursor: make_debug_cursor(TimedCursor(cursor))
+    connection.timed_cursors = True
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """
+    Django template backend whose templates are timed by RequestTimingMiddleware. Templates included by other
+    templates are counted as part of the template including them.
+    """
+    def from_string(self, template_code):
+        return TimedTemplate(super(TimedDjangoTemplates, self).from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super(TimedDjangoTemplates, self).get_template(template_name).template, self)
+
+
+class RequestTimingMiddleware(object):
+    """
+    Records the number of queries, time spent in the database, time spent rendering templates and total time of each
+    request. They are sent in a Server-Timing header (shown in the browser's developer tools) and logged, along with
+    the name of the URL.
+    Views can be given a query budget in settings.QUERY_BUDGETS, e.g. {'carshare:find_a_car': 5}. Going over budget
+    is logged as a warning, or raises QueryBudgetExceeded if settings.QUERY_BUDGETS_RAISE is set (as it is in tests).
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        for connection in connections.all():
+            install_timed_cursors(connection)
+        _request.template_time, _request.queries, _request.db_time = 0.0, 0, 0.0
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            total_time = time.perf_counter() - start
+            template_time, queries, db_time = _request.template_time, _request.queries, _request.db_time
+            _request.template_time = _request.queries = _request.db_time = None
+
+        match = getattr(request, 'resolver_match', None)
+        view_name = match.view_name if match else None
+        response['Server-Timing'] = 'db;dur={0:.1f};desc="{1} queries", tpl;dur={2:.1f}, total;dur={3:.1f}'.format(
+            db_time * 1000, queries, template_time * 1000, total_time * 1000
+        )
+        logger.info(
+            'view=%s method=%s status=%s queries=%d db_ms=%.1f template_ms=%.1f total_ms=%.1f',
+            view_name, request.method, response.status_code, queries, db_time * 1000, template_time * 1000,
+            total_time * 1000,
+            extra={'view': view_name, 'method': request.method, 'status': response.status_code, 'queries': queries,
+                   'db_ms': db_time * 1000, 'template_ms': template_time * 1000, 'total_ms': total_time * 1000},
+        )
+        self.check_budget(view_name, queries)
+        return response
+
+    @staticmethod
+    def check_budget(view_name, queries):
+        budget = getattr(settings, 'QUERY_BUDGETS', {}).get(view_name)
+        if budget is None or queries <= budget:
+            return
+        message = '{0} made {1} queries, over its budget of {2}'.format(view_name, queries, budget)
+        if getattr(settings, 'QUERY_BUDGETS_RAISE', False):
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)